@@ -17,9 +17,25 @@ export default function App() {
   const API_URL = 'http://192.168.18.240:8000'; // Replace with your PC's IP
 
   useEffect(() => {
-    fetchQuestions();
+    startSession();
   }, []);
 
+  const setSessionHeader = (sessionId) => {
+    // Every request carries the session id so concurrent users don't share state
+    axios.defaults.headers.common['X-Session-Id'] = sessionId;
+  };
+
+  const startSession = async () => {
+    try {
+      const response = await axios.post(`${API_URL}/start`);
+      setSessionHeader(response.data.session_id);
+      fetchQuestions();
+    } catch (error) {
+      console.error(error);
+      setMessage("Error starting form");
+    }
+  };
+
   const fetchQuestions = async () => {
     setLoading(true);
     try {
@@ -42,10 +58,62 @@ export default function App() {
     setAnswers({ ...answers, [key]: value });
   };
 
+  const JOB_POLL_INTERVAL_MS = 1000;
+  const JOB_POLL_ATTEMPTS = 600; // Give up on a job after about ten minutes
+
+  const waitForJob = async (jobId) => {
+    // Poll the background job until it finishes, surfacing its progress message
+    for (let attempt = 0; attempt < JOB_POLL_ATTEMPTS; attempt++) {
+      const { data } = await axios.get(`${API_URL}/jobs/${jobId}`);
+      if (data.status === 'done') return data;
+      if (data.status === 'failed') throw new Error(data.error);
+      if (data.status === 'cancelled') throw new Error('Job was cancelled');
+      if (data.message) setMessage(data.message);
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+    throw new Error('Timed out waiting for the job to finish');
+  };
+
+  const streamAnswers = (answers, onEvent) =>
+    // POST the answers and read the server-sent progress events as they arrive
+    new Promise((resolve, reject) => {
+      const xhr = new XMLHttpRequest();
+      let seen = 0;
+      let buffer = '';
+      xhr.open('POST', `${API_URL}/submit-answers/stream`);
+      xhr.setRequestHeader('Content-Type', 'application/json');
+      xhr.setRequestHeader('X-Session-Id', axios.defaults.headers.common['X-Session-Id']);
+      xhr.onprogress = () => {
+        buffer += xhr.responseText.slice(seen);
+        seen = xhr.responseText.length;
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        events.forEach((event) => {
+          if (!event.startsWith('data: ')) return;
+          const data = JSON.parse(event.slice(6));
+          if (data.event === 'result') resolve(data);
+          else if (data.event === 'error') reject(new Error(data.detail));
+          else onEvent(data);
+        });
+      };
+      xhr.onload = () => {
+        xhr.onprogress();
+        // A promise settles only once, so these only take effect when no result or error event came
+        if (xhr.status !== 200) reject(new Error(`HTTP ${xhr.status}`));
+        else reject(new Error('Stream ended without a result'));
+      };
+      xhr.onerror = () => reject(new Error('Network error'));
+      xhr.send(JSON.stringify({ answers }));
+    });
+
   const submitAnswers = async () => {
     setLoading(true);
     try {
-      await axios.post(`${API_URL}/submit-answers`, { answers });
+      await streamAnswers(answers, (event) => {
+        if (event.event === 'tokens') setMessage(`Generating ${event.field} (${event.tokens} tokens)`);
+        else if (event.event === 'field_started') setMessage(`Generating ${event.field}`);
+      });
+      setMessage('');
       setAnswers({});
       fetchQuestions();
     } catch (error) {
@@ -70,14 +138,18 @@ export default function App() {
   const generateDocx = async () => {
     setLoading(true);
     try {
-      // First, tell the backend to generate the document
-      await axios.post(`${API_URL}/generate-docx`);
+      // First, queue the document and wait for the backend to render it
+      const response = await axios.post(`${API_URL}/jobs/generate-docx`);
+      const jobId = response.data.job_id;
+      await waitForJob(jobId);
 
       // Now download the document
-      const downloadUrl = `${API_URL}/download-docx`;
+      const downloadUrl = `${API_URL}/jobs/${jobId}/result`;
       const fileUri = FileSystem.documentDirectory + 'PC1_Output.docx';
 
-      const { uri } = await FileSystem.downloadAsync(downloadUrl, fileUri);
+      const { uri } = await FileSystem.downloadAsync(downloadUrl, fileUri, {
+        headers: { 'X-Session-Id': axios.defaults.headers.common['X-Session-Id'] },
+      });
       console.log('Document downloaded to:', uri);
 
       // Open the sharing dialog
@@ -94,7 +166,8 @@ export default function App() {
   const restartForm = async () => {
     setLoading(true);
     try {
-      await axios.post(`${API_URL}/restart`); // <-- Create this endpoint in backend
+      const response = await axios.post(`${API_URL}/restart`);
+      setSessionHeader(response.data.session_id);
       setAnswers({});
       setQuestions([]);
       setVariables([]);
@@ -0,0 +1,213 @@
+"""Non-interactive PC-1 drafts for every project in a manifest.
+
+    python batch.py projects.csv --out-dir drafts
+
+The manifest is a CSV with a header row, or JSON Lines, with one project per
+row; its columns (projectName, districtName, sector, budget, ...) answer the
+wizard's questions. Questions without a column are answered N/A, except the
+ones the wizard branches on, which take their ANSWER_DEFAULTS value
+(isProvincial: no); a row that leaves a branch undecided fails.
+
+Every project is appended to a checkpoint file as done, partial (drafted, but
+some prompts failed) or failed. Running the same command again skips the done
+ones and retries the rest.
+"""
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import records
+import render_service
+import ver2
+
+BATCH_PROJECTS = int(os.getenv("BATCH_PROJECTS", "4"))
+# Completions in flight across all projects, and the request rate they share (0 = unlimited)
+BATCH_PROMPT_CONCURRENCY = int(os.getenv("BATCH_PROMPT_CONCURRENCY", "8"))
+BATCH_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "0"))
+# Answer for questions the manifest has no column for
+MISSING_ANSWER = "N/A"
+# Answers for the branching questions when the manifest has no column for them
+ANSWER_DEFAULTS = {"isProvincial": "no"}
+
+class SharedLimiter:
+    """Caps the completions in flight across every project and spaces their starts to a request rate."""
+
+    def __init__(self, concurrency: int = BATCH_PROMPT_CONCURRENCY,
+                 requests_per_minute: float = BATCH_REQUESTS_PER_MINUTE):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self._slots:
+            if self.interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self._next_start)
+                    self._next_start = start + self.interval
+                time.sleep(start - now)
+            yield
+
+def read_manifest(path: str) -> List[dict]:
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in file if line.strip()]
+        return [{key.strip(): (value or "").strip() for key, value in row.items() if key}
+                for row in csv.DictReader(file)]
+
+def project_key(row: dict) -> str:
+    """Stable id of a manifest row; editing the row makes it a new project."""
+    return hashlib.sha256(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def output_name(row: dict, key: str) -> str:
+    name = re.sub(r"[^\w-]+", "_", str(row.get("projectName") or "project")).strip("_")[:60]
+    return f"{name}-{key[:8]}"
+
+def check_row(states: ver2.StateGraph, row: dict) -> List[str]:
+    """The variables the state machine branches on that the row has no answer or default for."""
+    branches = {predicate.variable for transitions in states.transitions.values()
+                for predicate, _ in transitions if predicate.variable}
+    return sorted(variable for variable in branches if variable not in row and variable not in ANSWER_DEFAULTS)
+
+class Checkpoint:
+    """Append-only JSON Lines record of drafted projects; only the done ones are skipped next time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash; that project runs again
+                        continue
+                    if entry.get("status") == "done":
+                        self.done.add(entry["key"])
+
+    def record(self, entry: dict):
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            if entry["status"] == "done":
+                self.done.add(entry["key"])
+
+def walk_states(states: ver2.StateGraph, answers: dict, limiter=None) -> tuple:
+    """Run the state machine for one project, answering questions from `answers`.
+
+    Returns the collected user data and the errors of fields whose prompts failed.
+    Raises ValueError if the walk can't reach the end of the state machine.
+    """
+    user_data = {}
+    field_errors = {}
+    visited = set()
+    current_state = states.start_state
+    while current_state:
+        if current_state in visited:
+            raise ValueError(f"state '{current_state}' was reached twice")
+        visited.add(current_state)
+        selected_state = states.resolve(current_state, user_data)
+        if selected_state is None:
+            answers_read = ", ".join(f"{predicate.variable}={user_data.get(predicate.variable)!r}"
+                                     for predicate, _ in states.transitions.get(current_state, ())
+                                     if predicate.variable)
+            raise ValueError(f"no transition out of state '{current_state}' matches {answers_read or 'the answers'}")
+
+        for action in selected_state.variableActions:
+            var, value = action.split("=")
+            user_data[var] = None if value == "null" else value
+        for variable in selected_state.variables:
+            user_data[variable] = answers.get(variable, ANSWER_DEFAULTS.get(variable, MISSING_ANSWER))
+
+        field_errors.update(ver2.run_prompt_actions(selected_state, user_data, limiter=limiter))
+        current_state = selected_state.next_state
+    return user_data, field_errors
+
+def run_project(states: ver2.StateGraph, row: dict, out_dir: str, limiter, renderer) -> dict:
+    key = project_key(row)
+    name = output_name(row, key)
+    missing = check_row(states, row)
+    if missing:
+        raise ValueError(f"the manifest has no {', '.join(missing)} column")
+    start = time.monotonic()
+    user_data, field_errors = walk_states(states, row, limiter)
+
+    json_path = os.path.join(out_dir, f"{name}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(user_data, f, ensure_ascii=False, indent=4, default=records.to_jsonable)
+    content = renderer.render_document(user_data).result()
+    docx_path = os.path.join(out_dir, f"{name}.docx")
+    with open(docx_path, "wb") as f:
+        f.write(content)
+    return {"key": key, "status": "partial" if field_errors else "done", "projectName": row.get("projectName"), "docx": docx_path,
+            "json": json_path, "field_errors": field_errors, "seconds": round(time.monotonic() - start, 2)}
+
+def run_batch(manifest_path: str, out_dir: str, checkpoint_path: Optional[str] = None,
+              projects: int = BATCH_PROJECTS, concurrency: int = BATCH_PROMPT_CONCURRENCY,
+              requests_per_minute: float = BATCH_REQUESTS_PER_MINUTE,
+              render_workers: int = render_service.RENDER_WORKERS) -> Dict[str, int]:
+    """Draft every project in the manifest that the checkpoint doesn't list as done."""
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(out_dir, "checkpoint.jsonl"))
+    rows = read_manifest(manifest_path)
+    pending = [row for row in rows if project_key(row) not in checkpoint.done]
+    print(f"{len(rows)} projects, {len(rows) - len(pending)} already done, {len(pending)} to run")
+
+    states = ver2.compile_state_machine("state_machine.csv")
+    limiter = SharedLimiter(concurrency, requests_per_minute)
+    renderer = render_service.RenderService(render_workers)
+    renderer.start()
+    counts = {"done": 0, "partial": 0, "failed": 0, "skipped": len(rows) - len(pending)}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, projects), thread_name_prefix="project") as executor:
+            futures = {executor.submit(run_project, states, row, out_dir, limiter, renderer): row for row in pending}
+            for finished, future in enumerate(as_completed(futures), 1):
+                row = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    print(f"Error drafting {row.get('projectName')}: {str(e)}")
+                    entry = {"key": project_key(row), "status": "failed", "projectName": row.get("projectName"),
+                             "error": str(e)}
+                checkpoint.record(entry)
+                counts[entry["status"]] += 1
+                errors = f", {len(entry['field_errors'])} fields with errors" if entry.get("field_errors") else ""
+                print(f"[{finished}/{len(pending)}] {row.get('projectName')}: {entry['status']}{errors}")
+    finally:
+        renderer.shutdown()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="CSV (with a header row) or .jsonl file, one project per row")
+    parser.add_argument("--out-dir", default="batch_output")
+    parser.add_argument("--checkpoint", help="defaults to <out-dir>/checkpoint.jsonl")
+    parser.add_argument("--projects", type=int, default=BATCH_PROJECTS, help="projects walked at once")
+    parser.add_argument("--concurrency", type=int, default=BATCH_PROMPT_CONCURRENCY,
+                        help="completions in flight across all projects")
+    parser.add_argument("--requests-per-minute", type=float, default=BATCH_REQUESTS_PER_MINUTE)
+    parser.add_argument("--render-workers", type=int, default=render_service.RENDER_WORKERS)
+    args = parser.parse_args()
+    counts = run_batch(args.manifest, args.out_dir, args.checkpoint, args.projects, args.concurrency,
+                       args.requests_per_minute, args.render_workers)
+    print(f"✅ {counts['done']} drafted, {counts['partial']} drafted with field errors, {counts['failed']} failed, "
+          f"{counts['skipped']} skipped")
+
+# Render workers are spawned and re-import this module, so only run from the command line
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Drives concurrent wizard sessions through /get-questions -> /submit-answers -> /download-docx.
+
+Against a running server:
+
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000 --sessions 50 --concurrency 10
+
+With --spawn it starts the stub completions server and the app itself
+(uvicorn main:app pointed at the stub) and also reports the app's memory,
+including its render workers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks import stats
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures.json")
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors[name] += 1
+            raise RuntimeError(f"{name} failed: {str(e)}") from e
+        self.latencies[name].append(time.perf_counter() - start)
+        return response
+
+async def run_session(client: httpx.AsyncClient, recorder: Recorder, answers: dict, index: int):
+    start = time.perf_counter()
+    session_id = (await recorder.call("start", client.post("/start"))).json()["session_id"]
+    headers = {"X-Session-Id": session_id}
+    # A distinct project per session, so prompts don't come out of the response cache
+    answers = {**answers, "projectName": f"{answers['projectName']} {index}"}
+    while True:
+        questions = (await recorder.call("get-questions", client.get("/get-questions", headers=headers))).json()
+        state_answers = {variable: answers.get(variable, "N/A") for variable in questions["variables"]}
+        result = (await recorder.call("submit-answers", client.post(
+            "/submit-answers", headers=headers, json={"answers": state_answers}))).json()
+        if result.get("completed") or not result.get("next"):
+            break
+    await recorder.call("download-docx", client.get("/download-docx", headers=headers))
+    recorder.latencies["session"].append(time.perf_counter() - start)
+
+async def run_load(base_url: str, sessions: int, concurrency: int, timeout: float) -> tuple:
+    with open(FIXTURES_PATH, 'r', encoding='utf-8') as file:
+        answers = json.load(file)["answers"]
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def bounded(index: int):
+            async with semaphore:
+                try:
+                    await run_session(client, recorder, answers, index)
+                except RuntimeError as e:
+                    recorder.errors["session"] += 1
+                    print(e, file=sys.stderr)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+    return recorder, elapsed
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout:g}s")
+
+def spawn_servers(args) -> tuple:
+    stub_port, app_port = free_port(), free_port()
+    stub = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.stub_server", "--port", str(stub_port),
+        "--tokens-per-second", str(args.tokens_per_second), "--jitter", str(args.jitter),
+        "--first-token-latency", str(args.first_token_latency), "--error-rate", str(args.error_rate),
+    ])
+    env = {**os.environ, "GROQ_BASE_URL": f"http://127.0.0.1:{stub_port}",
+           "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "stub"),
+           # Measure the completion path rather than the response cache, unless asked otherwise
+           "LLM_CACHE": os.getenv("LLM_CACHE", "0"),
+           # The stub has no rate limits to respect
+           "LLM_RATE_LIMITS": os.getenv("LLM_RATE_LIMITS", "0")}
+    app = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port),
+                            "--log-level", "warning"], env=env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{stub_port}/docs", stub)
+        wait_until_up(f"http://127.0.0.1:{app_port}/docs", app)
+    except RuntimeError:
+        stop_servers(stub, app)
+        raise
+    return stub, app, f"http://127.0.0.1:{app_port}"
+
+def stop_servers(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+async def sample_memory(pid: int, samples: list):
+    while True:
+        rss = stats.process_tree_rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+async def measure(args, base_url: str, app_pid=None) -> tuple:
+    memory = []
+    sampler = asyncio.create_task(sample_memory(app_pid, memory)) if app_pid else None
+    try:
+        recorder, elapsed = await run_load(base_url, args.sessions, args.concurrency, args.timeout)
+    finally:
+        if sampler:
+            sampler.cancel()
+    return recorder, elapsed, memory
+
+def report(recorder: Recorder, elapsed: float, memory: list):
+    names = ["start", "get-questions", "submit-answers", "download-docx", "session"]
+    rows = {name: stats.summarize(recorder.latencies[name], elapsed, recorder.errors[name]) for name in names}
+    stats.print_table(f"Load test: {elapsed:.1f}s", rows)
+    requests = sum(len(recorder.latencies[name]) for name in names if name != "session")
+    print(f"\nrequests/sec: {requests / elapsed:.2f}   sessions/sec: {rows['session']['per_sec']:.2f}")
+    if memory:
+        print(f"app memory (incl. render workers): start {memory[0]:.0f} MB, peak {max(memory):.0f} MB, "
+              f"end {memory[-1]:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-request timeout in seconds")
+    parser.add_argument("--spawn", action="store_true", help="start the stub and the app on free ports")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if not args.spawn:
+        report(*asyncio.run(measure(args, args.base_url)))
+        return
+    stub, app, base_url = spawn_servers(args)
+    try:
+        report(*asyncio.run(measure(args, base_url, app.pid)))
+    finally:
+        stop_servers(app, stub)
+
+if __name__ == "__main__":
+    main()
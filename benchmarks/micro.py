@@ -0,0 +1,79 @@
+"""Micro-benchmarks for the wizard's hot paths, reporting latency percentiles, ops/sec and peak memory.
+
+    python -m benchmarks.micro --iterations 200
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import records
+import sample2
+import ver2
+from benchmarks import stats
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures.json")
+CSV_PATH = "state_machine.csv"
+
+def completed_user_data() -> dict:
+    """User data of a finished wizard run: the fixture answers plus the parsed canned completions."""
+    with open(FIXTURES_PATH, 'r', encoding='utf-8') as file:
+        fixtures = json.load(file)
+    user_data = dict(fixtures["answers"])
+    for field_name, completion in fixtures["completions"].items():
+        user_data[field_name], _ = records.parse_response(field_name, completion["content"])
+    return user_data
+
+def replace_all_markers(states: ver2.StateGraph, user_data: dict):
+    for state_name in states.states:
+        for state in states.get(state_name):
+            for action in state.promptActions:
+                ver2.replace_markers(action, user_data)
+
+def bench(fn, iterations: int, warmup: int) -> tuple:
+    """Per-call latencies of fn, its total wall time, and the peak traced allocation of one call."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return samples, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", help="run just the benchmark with this name")
+    args = parser.parse_args()
+
+    user_data = completed_user_data()
+    states = ver2.compile_state_machine(CSV_PATH)
+    benchmarks = {
+        "parse_state_machine": lambda: ver2.parse_state_machine(CSV_PATH),
+        "replace_markers (all)": lambda: replace_all_markers(states, user_data),
+        "create_project_document": lambda: sample2.create_project_document_from_json(user_data),
+    }
+    rows = {}
+    peaks = {}
+    for name, fn in benchmarks.items():
+        if args.only and args.only != name:
+            continue
+        samples, elapsed, peaks[name] = bench(fn, args.iterations, args.warmup)
+        rows[name] = stats.summarize(samples, elapsed)
+    stats.print_table("Micro-benchmarks", rows, rate_label="ops/s")
+    print()
+    for name, peak in peaks.items():
+        print(f"{name:<28}peak allocation {peak / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+from typing import Dict, List, Optional
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of samples (pct in 0-100); 0.0 for no samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(samples: List[float], elapsed: float, errors: int = 0) -> dict:
+    """Latency percentiles in milliseconds plus throughput over elapsed seconds."""
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples, default=0.0) * 1000,
+        "per_sec": len(samples) / elapsed if elapsed > 0 else 0.0,
+    }
+
+def print_table(title: str, rows: Dict[str, dict], rate_label: str = "req/s"):
+    print(f"\n{title}")
+    print(f"{'':<28}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{rate_label:>10}")
+    for name, row in rows.items():
+        print(f"{name:<28}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['per_sec']:>10.2f}")
+
+def _status_kb(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _children(pid: int) -> List[int]:
+    children = []
+    try:
+        for name in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{name}/children") as file:
+                children.extend(int(child) for child in file.read().split())
+    except OSError:
+        pass
+    return children
+
+def process_tree_rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of pid and all its descendants (e.g. render workers), Linux only."""
+    total = _status_kb(pid, "VmRSS")
+    if total is None:
+        return None
+    pending = _children(pid)
+    while pending:
+        child = pending.pop()
+        total += _status_kb(child, "VmRSS") or 0
+        pending.extend(_children(child))
+    return total / 1024
@@ -0,0 +1,124 @@
+"""OpenAI/Groq-compatible chat completions stub that streams canned PC-1 answers.
+
+Completions come from the recorded q24-q34 answers in fixtures.json, matched
+on the start of the prompt, and are streamed word by word at a configurable
+token rate with jitter. Point the app at it with GROQ_BASE_URL:
+
+    python -m benchmarks.stub_server --port 8900 --tokens-per-second 150
+    GROQ_BASE_URL=http://127.0.0.1:8900 GROQ_API_KEY=stub uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures.json")
+FALLBACK_ANSWER = "This section will be completed during detailed design of the project."
+REASONING_MODELS = ("deepseek-r1", "qwq", "qwen3")
+
+_TOKEN = re.compile(r"\s*\S+")
+
+class StubSettings:
+    def __init__(self, tokens_per_second: float = 200.0, jitter: float = 0.3, first_token_latency: float = 0.2,
+                 error_rate: float = 0.0):
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.first_token_latency = first_token_latency
+        self.error_rate = error_rate
+
+def load_completions(path: str = FIXTURES_PATH) -> list:
+    with open(path, 'r', encoding='utf-8') as file:
+        return list(json.load(file)["completions"].values())
+
+def find_completion(completions: list, prompt: str) -> dict:
+    for completion in completions:
+        if prompt.startswith(completion["match"]):
+            return completion
+    return {"content": FALLBACK_ANSWER}
+
+def completion_tokens(body: dict, completion: dict) -> list:
+    """The answer split into word tokens, with the <think> block the model would send and capped at max tokens."""
+    text = completion["content"]
+    model = body.get("model", "")
+    if completion.get("reasoning") and any(name in model for name in REASONING_MODELS) \
+            and body.get("reasoning_format") != "hidden":
+        text = f"<think>\n{completion['reasoning']}\n</think>\n\n{text}"
+    tokens = _TOKEN.findall(text)
+    limit = body.get("max_completion_tokens") or body.get("max_tokens")
+    return tokens[:limit] if limit else tokens
+
+def create_app(settings: StubSettings, completions: list) -> FastAPI:
+    app = FastAPI()
+
+    def delay(base: float) -> float:
+        return max(0.0, base * random.uniform(1 - settings.jitter, 1 + settings.jitter))
+
+    def chunk(completion_id: str, model: str, delta: dict, finish_reason=None, usage=None) -> str:
+        payload = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage is not None:
+            payload["x_groq"] = {"usage": usage}
+        return f"data: {json.dumps(payload)}\n\n"
+
+    @app.post("/openai/v1/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if random.random() < settings.error_rate:
+            return JSONResponse({"error": {"message": "Rate limit reached (stub)", "type": "tokens"}},
+                                status_code=429, headers={"retry-after": "1"})
+        prompt = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        tokens = completion_tokens(body, find_completion(completions, prompt))
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        usage = {"prompt_tokens": len(_TOKEN.findall(prompt)), "completion_tokens": len(tokens),
+                 "total_tokens": len(_TOKEN.findall(prompt)) + len(tokens)}
+        finish_reason = "length" if len(tokens) == body.get("max_completion_tokens") else "stop"
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(settings.first_token_latency + len(tokens) / settings.tokens_per_second))
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        async def stream():
+            await asyncio.sleep(delay(settings.first_token_latency))
+            yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for token in tokens:
+                await asyncio.sleep(delay(1 / settings.tokens_per_second))
+                yield chunk(completion_id, model, {"content": token})
+            yield chunk(completion_id, model, {}, finish_reason, usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="streaming rate per completion")
+    parser.add_argument("--jitter", type=float, default=0.3, help="relative +/- jitter on every delay")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="seconds before the first chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+    settings = StubSettings(args.tokens_per_second, args.jitter, args.first_token_latency, args.error_rate)
+    uvicorn.run(create_app(settings, load_completions()), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
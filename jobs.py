@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+MAX_JOBS = int(os.getenv("MAX_JOBS", "500"))
+JOB_POLL_INTERVAL = 0.5
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    session_id: Optional[str] = None
+    status: str = "queued"  # queued -> running -> done | failed | cancelled
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    version: int = 0
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def report(self, progress: Optional[float] = None, message: Optional[str] = None):
+        """Update progress; safe to call from worker threads."""
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        self.version += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobManager:
+    """Runs submitted coroutines as background jobs, at most max_workers at a time.
+
+    Job coroutines don't block the event loop themselves: LLM chains run on
+    ver2's thread pool and documents on the render worker processes.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._slots = asyncio.Semaphore(max_workers)
+        self._jobs = OrderedDict()
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, job_fn, *args, session_id: Optional[str] = None) -> Job:
+        """Schedule job_fn(job, *args) on the running event loop and return its Job."""
+        job = Job(job_id=uuid.uuid4().hex, kind=kind, session_id=session_id)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict()
+        self._tasks[job.job_id] = asyncio.get_running_loop().create_task(self._run(job, job_fn, *args))
+        return job
+
+    def get(self, job_id: str, session_id: Optional[str] = None) -> Optional[Job]:
+        """Return the job, hiding jobs that belong to a different session."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (job.session_id is not None and job.session_id != session_id):
+            return None
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Ask a job to stop: a queued job never starts, a running one sees job.cancel_event set."""
+        if job.finished:
+            return False
+        job.cancel_event.set()
+        task = self._tasks.get(job.job_id)
+        if task is not None and job.status == "queued":
+            task.cancel()
+        return True
+
+    async def events(self, job: Job):
+        """Yield the job's status dict every time it changes, until it finishes."""
+        last_version = -1
+        while True:
+            if job.version != last_version:
+                last_version = job.version
+                yield job.to_dict()
+            if job.finished:
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    async def _run(self, job: Job, job_fn, *args):
+        try:
+            async with self._slots:
+                job.status = "running"
+                job.started_at = time.time()
+                job.report()
+                job.result = await job_fn(job, *args)
+                job.finished_at = time.time()
+                job.status = "cancelled" if job.cancel_event.is_set() else "done"
+                job.report(1.0)
+        except asyncio.CancelledError:
+            job.finished_at = time.time()
+            job.status = "cancelled"
+            job.report()
+        except Exception as e:
+            print(f"Job {job.job_id} ({job.kind}) failed:\n{traceback.format_exc()}")
+            job.error = getattr(e, "detail", None) or str(e)
+            job.finished_at = time.time()
+            job.status = "failed"
+            job.report()
+        finally:
+            self._tasks.pop(job.job_id, None)
+
+    def _evict(self):
+        # Drop the oldest finished jobs (and their results) once over the limit
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
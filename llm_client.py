@@ -0,0 +1,82 @@
+import os
+import threading
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from groq import DefaultHttpxClient, Groq, GroqError
+
+# Connections to the provider; also the most completions a process streams at once
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+LLM_SLOT_POLL_INTERVAL = 0.2
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+class ClientManager:
+    """Owns one Groq client per process, backed by a keep-alive HTTP connection pool.
+
+    All prompt threads share the client, so TLS connections are reused across
+    prompts, states and sessions instead of being rebuilt for every state.
+    Prompt threads can outnumber the connections (interactive batches,
+    prefetches and batch runs all stream at once), so each completion takes
+    a stream slot first and the rest queue here rather than in the pool.
+    """
+
+    def __init__(self, pool_size: int = LLM_POOL_SIZE, connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = LLM_READ_TIMEOUT, keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._client: Optional[Groq] = None
+        self._lock = threading.Lock()
+        self._streams = threading.BoundedSemaphore(max(1, pool_size))
+
+    def get(self) -> Groq:
+        with self._lock:
+            if self._client is None:
+                load_dotenv()
+                http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                        keepalive_expiry=self.keepalive_expiry,
+                    ),
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                )
+                try:
+                    # Retries are handled per field in ver2, with jittered backoff and a time budget
+                    self._client = Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client, max_retries=0)
+                except GroqError:
+                    http_client.close()
+                    raise
+            return self._client
+
+    def acquire_stream(self, cancel_event: Optional[threading.Event] = None) -> bool:
+        """Wait for a free connection for one completion; False if cancel_event was set meanwhile."""
+        while not self._streams.acquire(timeout=LLM_SLOT_POLL_INTERVAL):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+        return True
+
+    def release_stream(self):
+        self._streams.release()
+
+    def startup(self):
+        """Create the client up front so the first prompt doesn't pay for it."""
+        try:
+            self.get()
+        except GroqError as e:
+            print(f"Groq client not created at startup: {str(e)}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+client_manager = ClientManager()
+
+def get_client() -> Groq:
+    return client_manager.get()
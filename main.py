@@ -1,17 +1,45 @@
 # main.py (FastAPI Backend)
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import os
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+from typing import Optional
+import asyncio
+import contextlib
 import json
+import threading
+import time
 from dotenv import load_dotenv
 import ver2
+import sessions
+import jobs
+import llm_cache
+import llm_client
+import metrics
+import prefetch
+import rate_limiter
+import records
+import render_service
+import progress
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the Groq client and the render workers; on shutdown stop the work using them, then the pools."""
+    llm_client.client_manager.startup()
+    renderer.start()
+    try:
+        yield
+    finally:
+        job_manager.shutdown()
+        prefetcher.shutdown()
+        renderer.shutdown()
+        llm_client.client_manager.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow requests from your Expo app
 app.add_middleware(
@@ -22,99 +50,374 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Parse the state machine once at startup
+class InstrumentRequests:
+    """Time every request by route; with PROFILE_REQUESTS=1 an X-Profile header also profiles it.
+
+    The profile covers the event loop and the threads the request hands prompts
+    to until the response starts, and is saved under PROFILE_DIR;
+    X-Profile-Report gives its path. Plain ASGI rather than @app.middleware,
+    which would wrap receive and hide client disconnects from the routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        kind = metrics.profile_kind(Headers(scope=scope).get("x-profile"))
+        start = time.perf_counter()
+        if kind is None:
+            await self.app(scope, receive, send)
+        else:
+            profile = metrics.RequestProfile(kind)
+            profiling = contextlib.ExitStack()
+
+            async def send_with_report(message):
+                if message["type"] == "http.response.start":
+                    profiling.close()
+                    report = profile.save(scope["path"].strip("/").replace("/", "-") or "root")
+                    if report:
+                        message = {**message, "headers": [*message.get("headers", []),
+                                                          (b"x-profile-report", report.encode())]}
+                await send(message)
+
+            token = metrics.current_profile.set(profile)
+            try:
+                profiling.enter_context(profile.event_loop())
+                await self.app(scope, receive, send_with_report)
+            finally:
+                profiling.close()
+                metrics.current_profile.reset(token)
+        route = scope.get("route")
+        metrics.registry.observe("pc1_http_request_seconds", time.perf_counter() - start,
+                                 route=getattr(route, "path", "unmatched"), method=scope["method"])
+
+app.add_middleware(InstrumentRequests)
+
+# Compile the state machine once at startup (reuses the cached artefact if the CSV is unchanged)
 csv_path = "state_machine.csv"
-states = ver2.parse_state_machine(csv_path)
+states = ver2.compile_state_machine(csv_path)
+
+# Per-session user data & current state (SESSION_BACKEND selects memory or sqlite)
+session_store = sessions.create_session_store()
+
+# Background jobs for long LLM chains and document generation
+job_manager = jobs.JobManager()
+
+# Warm worker processes that render .docx files off the event loop
+renderer = render_service.RenderService()
+
+# Future states' prompts, started as soon as the answers they read are in
+prefetcher = prefetch.Prefetcher()
 
-# Store user data & current state in-memory (or use a DB in production)
-session_data = {
-    "user_data": {},
-    "current_state": "q1"
-}
+DOCX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+def get_session(session_id: Optional[str]) -> sessions.Session:
+    """Look up the caller's session or fail with 404 so the client starts a new one."""
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found. Call /start to begin a new form.")
+    return session
+
+async def snapshot_user_data(session_id: Optional[str]) -> dict:
+    """Copy the session's user data under its lock, so prompts still filling fields can't change it midway."""
+    get_session(session_id)
+    async with session_store.lock(session_id):
+        return dict(get_session(session_id).user_data)
+
+@app.post("/start")
+async def start():
+    """Issue a new session id for a fresh form."""
+    session = session_store.create()
+    return {"session_id": session.session_id, "current_state": session.current_state}
 
 @app.get("/get-questions")
-async def get_questions():
+async def get_questions(x_session_id: Optional[str] = Header(None)):
     """Return the questions for the current state."""
-    current_state = session_data["current_state"]
-    user_data = session_data["user_data"]
+    session = get_session(x_session_id)
+    current_state = session.current_state
+    user_data = session.user_data
 
-    state_options = states.get(current_state, [])
-    valid_states = [s for s in state_options if ver2.evaluate_condition(s.condition, user_data)]
-    if not valid_states:
+    selected_state = states.resolve(current_state, user_data)
+    if selected_state is None:
         return {"questions": [], "variables": [], "next": None}
 
-    selected_state = valid_states[0]
     return {
         "questions": selected_state.questions,
         "variables": selected_state.variables,
         "next": selected_state.next_state
     }
 
+async def run_state_prompts(session_id: str, state: ver2.State, user_data: dict, on_event=None,
+                            use_cache: bool = True, cancel_event=None) -> dict:
+    """Run the state's prompts, or take over the prefetch that already ran them on the same answers."""
+    staged = prefetcher.take(session_id, state, user_data) if use_cache else None
+    if staged is not None:
+        adopted = await staged.adopt_async(on_event, cancel_event)
+        if adopted is not None:
+            values, field_errors = adopted
+            user_data.update(values)
+            return field_errors
+    # Run prompt actions (call Groq) without blocking the event loop
+    return await ver2.run_prompt_actions_async(state, user_data, on_event=on_event, use_cache=use_cache,
+                                               cancel_event=cancel_event)
+
+async def process_answers(session_id: str, answers: dict, on_event=None, use_cache: bool = True,
+                          cancel_event=None) -> dict:
+    """Store answers for the session's current state, run its prompts and advance the state.
+
+    The batch can be stopped through cancel_event or POST /cancel. The fields
+    finished so far are then saved but the state doesn't advance, so
+    resubmitting picks up the rest.
+    """
+    get_session(session_id)
+    metrics.current_session.set(session_id)
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    with session_store.running(session_id, cancel_event):
+        async with session_store.lock(session_id):
+            # Reload under the lock so concurrent submits for this session don't interleave
+            session = get_session(session_id)
+
+            # Update user data with answers
+            user_data = session.user_data
+            user_data.update(answers)
+
+            # Get the current state and process prompts
+            current_state = session.current_state
+            selected_state = states.resolve(current_state, user_data)
+
+            if selected_state is None:
+                session_store.save(session)
+                renderer.prerender(session_id, dict(user_data))
+                return {"message": "No next state found.", "completed": True}
+
+            field_errors = await run_state_prompts(session_id, selected_state, user_data, on_event=on_event,
+                                                   use_cache=use_cache, cancel_event=cancel_event)
+
+            if cancel_event.is_set():
+                session_store.save(session)
+                return {"message": "Cancelled", "cancelled": True, "next": session.current_state,
+                        "field_errors": field_errors}
+
+            # Move to the next state
+            session.current_state = selected_state.next_state
+            session_store.save(session)
+            # Start the prompts of states ahead whose inputs the user has now answered
+            prefetcher.schedule(session_id, states, session.current_state, user_data)
+            # Render the sections these answers affect while the user moves on
+            renderer.prerender(session_id, dict(user_data))
+
+    result = {"message": "Answers saved", "next": session.current_state}
+    if field_errors:
+        # Invalid answers aren't cached, so the prompt gets a fresh completion next time it runs
+        result["field_errors"] = field_errors
+    return result
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+async def cancel_on_disconnect(request: Request, cancel_event: threading.Event):
+    """Set cancel_event once the client goes away."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    cancel_event.set()
+
 @app.post("/submit-answers")
-async def submit_answers(request: Request):
+async def submit_answers(request: Request, x_session_id: Optional[str] = Header(None)):
     """Receive answers for the current state, run prompts if needed, and move to the next state."""
     data = await request.json()
-    answers = data.get("answers", {})
+    cancel_event = threading.Event()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, cancel_event))
+    try:
+        return await process_answers(x_session_id, data.get("answers", {}),
+                                     use_cache=not data.get("bypass_cache", False), cancel_event=cancel_event)
+    finally:
+        watcher.cancel()
 
-    # Update user data with answers
-    user_data = session_data["user_data"]
-    user_data.update(answers)
+@app.post("/cancel")
+async def cancel(x_session_id: Optional[str] = Header(None)):
+    """Stop the prompts running for the caller's session; finished fields are kept."""
+    get_session(x_session_id)
+    return {"cancelled": session_store.cancel(x_session_id)}
 
-    # Get the current state and process prompts
-    current_state = session_data["current_state"]
-    state_options = states.get(current_state, [])
-    valid_states = [s for s in state_options if ver2.evaluate_condition(s.condition, user_data)]
+@app.post("/submit-answers/stream")
+async def submit_answers_stream(request: Request, x_session_id: Optional[str] = Header(None)):
+    """Like /submit-answers, but streams per-field progress as server-sent events.
 
-    if not valid_states:
-        return {"message": "No next state found.", "completed": True}
+    Events are field_started, tokens, field_done (with the parse status) and a
+    final result or error. Closing the connection cancels the remaining prompts.
+    """
+    get_session(x_session_id)
+    data = await request.json()
+    stream = progress.ProgressStream(asyncio.get_running_loop())
+    task = asyncio.create_task(process_answers(x_session_id, data.get("answers", {}), on_event=stream.on_event,
+                                               use_cache=not data.get("bypass_cache", False),
+                                               cancel_event=stream.cancel_event))
+    stream.attach(task)
+    return StreamingResponse(stream.sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    selected_state = valid_states[0]
+@app.post("/generate-json")
+async def generate_json(x_session_id: Optional[str] = Header(None)):
+    """Return the session's user data as JSON."""
+    user_data = await snapshot_user_data(x_session_id)
+    # Returned rather than written to a shared file, so concurrent sessions can't overwrite each other
+    content = json.dumps({"message": "JSON file generated ✅", "filename": "PC1_Output.json", "user_data": user_data},
+                         ensure_ascii=False, default=records.to_jsonable)
+    return Response(content, media_type="application/json")
 
-    # Run prompt actions (call Groq)
-    ver2.run_prompt_actions(selected_state, user_data)
+async def _submit_answers_job(job: jobs.Job, session_id: str, answers: dict, use_cache: bool):
+    session = get_session(session_id)
+    selected_state = states.resolve(session.current_state, {**session.user_data, **answers})
+    prompt_count = max(len(selected_state.promptFields), 1) if selected_state else 1
+    done_fields = []
 
-    # Move to the next state
-    session_data["current_state"] = selected_state.next_state
+    def on_event(event, field_name, detail=None):
+        if event == "field_done":
+            done_fields.append(field_name)
+            job.report(len(done_fields) / prompt_count, f"Generated {field_name}")
+        elif event == "tokens":
+            job.report(message=f"Generating {field_name} ({detail['tokens']} tokens)")
+        else:
+            job.report(message=f"Generating {field_name}")
 
-    return {"message": "Answers saved", "next": session_data["current_state"]}
+    return await process_answers(session_id, answers, on_event=on_event, use_cache=use_cache,
+                                 cancel_event=job.cancel_event)
 
-@app.post("/generate-json")
-async def generate_json():
-    """Save the user data as JSON."""
-    file_name = "PC1_Output"
-    user_data = session_data["user_data"]
+async def _generate_docx_job(job: jobs.Job, session_id: str):
+    user_data = await snapshot_user_data(session_id)
+    job.report(0.1, "Rendering document")
+    return await renderer.render(user_data, session_id)
 
-    with open(f"{file_name}.json", "w", encoding="utf-8") as f:
-        json.dump(user_data, f, ensure_ascii=False, indent=4)
+def get_job(job_id: str, session_id: Optional[str]) -> jobs.Job:
+    job = job_manager.get(job_id, session_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
-    return {"message": "JSON file generated ✅", "filename": f"{file_name}.json"}
+@app.post("/jobs/submit-answers")
+async def submit_answers_job(request: Request, x_session_id: Optional[str] = Header(None)):
+    """Queue the answers for the current state and return a job id to poll."""
+    get_session(x_session_id)
+    data = await request.json()
+    job = job_manager.submit("submit-answers", _submit_answers_job, x_session_id,
+                             data.get("answers", {}), not data.get("bypass_cache", False),
+                             session_id=x_session_id)
+    return job.to_dict()
 
-@app.post("/generate-docx")
-async def generate_docx():
-    """Generate the Word document using sample2."""
-    file_name = "PC1_Output"
-    user_data = session_data["user_data"]
+@app.post("/jobs/generate-docx")
+async def generate_docx_job(x_session_id: Optional[str] = Header(None)):
+    """Queue rendering of the session's Word document and return a job id to poll."""
+    get_session(x_session_id)
+    job = job_manager.submit("generate-docx", _generate_docx_job, x_session_id, session_id=x_session_id)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, x_session_id: Optional[str] = Header(None)):
+    return get_job(job_id, x_session_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, x_session_id: Optional[str] = Header(None)):
+    """Stream the job's status as server-sent events until it finishes."""
+    job = get_job(job_id, x_session_id)
 
-    import sample2
-    sample2.create_project_document_from_json(user_data, f"{file_name}.docx")
+    async def event_stream():
+        async for status in job_manager.events(job):
+            yield f"data: {json.dumps(status)}\n\n"
 
-    return {"message": "Word document generated ✅", "filename": f"{file_name}.docx"}
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, x_session_id: Optional[str] = Header(None)):
+    """Cancel a queued or running job; a submit-answers job keeps the fields it finished."""
+    job = get_job(job_id, x_session_id)
+    job_manager.cancel(job)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, x_session_id: Optional[str] = Header(None)):
+    """Return a finished job's result: the .docx for document jobs, JSON otherwise."""
+    job = get_job(job_id, x_session_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="Job was cancelled.")
+    if not job.finished:
+        raise HTTPException(status_code=409, detail="Job is still running.")
+    if isinstance(job.result, bytes):
+        return Response(
+            job.result,
+            media_type=DOCX_MEDIA_TYPE,
+            headers={"Content-Disposition": 'attachment; filename="PC1_Output.docx"'}
+        )
+    return job.result
+
+@app.get("/llm-cache/stats")
+async def llm_cache_stats():
+    """Hit/miss counters and size of the LLM response cache."""
+    cache = llm_cache.get_response_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+@app.get("/llm/rate-limits")
+async def llm_rate_limits():
+    """Headroom, adaptive rate factor and any 429 pause of each model's rate limits."""
+    return rate_limiter.limiter.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage timers, per-field and per-session records and pool gauges in the Prometheus text format."""
+    gauges = {f"pc1_render_{key}": value for key, value in renderer.metrics().items()}
+    cache = llm_cache.get_response_cache()
+    if cache:
+        gauges.update({f"pc1_llm_cache_{key}": value for key, value in cache.stats().items()})
+    return PlainTextResponse(metrics.registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/render/metrics")
+async def render_metrics():
+    """Queue depth and render timings of the document worker pool."""
+    return renderer.metrics()
+
+DOCX_CHUNK_SIZE = 64 * 1024
+
+@app.post("/generate-docx")
+async def generate_docx(x_session_id: Optional[str] = Header(None)):
+    """Kept for older clients, which call /download-docx next; the document is rendered there."""
+    get_session(x_session_id)
+    return {"message": "Word document generated ✅", "filename": "PC1_Output.docx"}
 
 @app.get("/download-docx")
-def download_docx():
-    file_path = "PC1_Output.docx"  # This should match your generate-docx filename
-    if not os.path.exists(file_path):
-        return {"error": "Document not found. Please generate the document first."}
-
-    return FileResponse(
-        file_path,
-        media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        filename="PC1_Output.docx"
+async def download_docx(x_session_id: Optional[str] = Header(None)):
+    """Render the session's Word document in memory and stream it back."""
+    user_data = await snapshot_user_data(x_session_id)
+    content = await renderer.render(user_data, x_session_id)
+
+    def chunks():
+        view = memoryview(content)
+        for start in range(0, len(content), DOCX_CHUNK_SIZE):
+            yield view[start:start + DOCX_CHUNK_SIZE]
+
+    return StreamingResponse(
+        chunks(),
+        media_type=DOCX_MEDIA_TYPE,
+        headers={
+            "Content-Length": str(len(content)),
+            "Content-Disposition": 'attachment; filename="PC1_Output.docx"',
+        }
     )
 
 @app.post("/restart")
-async def restart():
-    global state_machine, user_data, current_state
-    user_data = {}  # Clear all user data
-    current_state = "q1"  # Reset to first state
-    return {"message": "Form restarted"}
+async def restart(x_session_id: Optional[str] = Header(None)):
+    """Reset the caller's form, issuing a new session if the old one has expired."""
+    session = session_store.get(x_session_id)
+    if session is None:
+        session = session_store.create()
+    else:
+        # Don't wait for prompts the user is abandoning anyway
+        session_store.cancel(session.session_id)
+        async with session_store.lock(session.session_id):
+            session_store.reset(session)
+        renderer.fragments.forget(session.session_id)
+        prefetcher.forget(session.session_id)
+    return {"message": "Form restarted", "session_id": session.session_id}
@@ -0,0 +1,295 @@
+import contextlib
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+METRICS_MAX_SESSIONS = int(os.getenv("METRICS_MAX_SESSIONS", "100"))
+# Per-request profiling through the X-Profile header is off unless enabled here
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP = 40
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+_SESSION_TOTALS = {
+    "fields": "Prompt fields finished per session (latest sessions only).",
+    "tokens": "Streamed completion tokens per session (latest sessions only).",
+    "llm_seconds": "Seconds spent streaming completions per session (latest sessions only).",
+}
+
+class Registry:
+    """Counters and histograms kept in memory and written out in the Prometheus text format.
+
+    Work done in render worker processes is recorded under capture() and
+    replayed here, so /metrics covers it too.
+    """
+
+    def __init__(self, max_sessions: int = METRICS_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._help = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, list]] = {}
+        self._buckets = {}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = help_text
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self._help[name] = help_text
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        if _record(("inc", name, amount, labels)):
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        if _record(("observe", name, value, labels)):
+            return
+        key = _labels(labels)
+        buckets = self._buckets[name]
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self._histograms[name][key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def record_session(self, session_id: str, tokens: int, seconds: float):
+        """Add one finished field to the session's totals; only the latest sessions are kept."""
+        with self._lock:
+            totals = self._sessions.pop(session_id, None) or {"fields": 0, "tokens": 0, "llm_seconds": 0.0}
+            totals["fields"] += 1
+            totals["tokens"] += tokens
+            totals["llm_seconds"] += seconds
+            self._sessions[session_id] = totals
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def replay(self, observations: list):
+        for kind, name, value, labels in observations:
+            getattr(self, kind)(name, value, **labels)
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {value:g}" for labels, value in series.items()]
+            for name, series in self._histograms.items():
+                lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} histogram"]
+                buckets = self._buckets[name]
+                for labels, values in series.items():
+                    for bound, count in zip(buckets, values):
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+            for total, help_text in _SESSION_TOTALS.items():
+                name = f"pc1_session_{total}_total"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels((('session', session_id),))} {totals[total]:g}"
+                          for session_id, totals in self._sessions.items()]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+registry.histogram("pc1_stage_seconds", "Time spent in each processing stage.")
+registry.histogram("pc1_section_render_seconds", "Time to render each section of the PC-1 document.")
+registry.histogram("pc1_field_first_token_seconds", "Time from sending a prompt to its first streamed token.")
+registry.histogram("pc1_field_stream_seconds", "Total time to stream a prompt's completion.")
+registry.counter("pc1_field_tokens_total", "Streamed completion tokens per prompt field.")
+registry.counter("pc1_field_completions_total", "Finished prompt fields by outcome.")
+registry.histogram("pc1_http_request_seconds", "Latency of HTTP requests by route.")
+registry.counter("pc1_rate_limited_total", "Completions the provider rejected with 429, by model.")
+registry.counter("pc1_prefetch_total", "Speculative state runs by outcome (used, joined while running, discarded).")
+
+# Observations made while capture() is active are collected instead of recorded
+_captured = threading.local()
+
+def _record(observation: tuple) -> bool:
+    buffer = getattr(_captured, "observations", None)
+    if buffer is None:
+        return False
+    buffer.append(observation)
+    return True
+
+@contextlib.contextmanager
+def capture():
+    """Collect this thread's observations into a list, e.g. to send back from a worker process."""
+    _captured.observations = observations = []
+    try:
+        yield observations
+    finally:
+        _captured.observations = None
+
+@contextlib.contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("pc1_stage_seconds", time.perf_counter() - start, stage=name)
+
+@contextlib.contextmanager
+def section(key: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("pc1_section_render_seconds", time.perf_counter() - start, section=key)
+
+current_session = contextvars.ContextVar("current_session", default=None)
+
+def record_field(field_name: str, model: str, status: str, tokens: int, first_token: Optional[float],
+                 stream_seconds: Optional[float]):
+    """Record one prompt field's outcome, token count and latencies, for the session in current_session."""
+    registry.inc("pc1_field_completions_total", field=field_name, status=status)
+    registry.inc("pc1_field_tokens_total", tokens, field=field_name, model=model)
+    if first_token is not None:
+        registry.observe("pc1_field_first_token_seconds", first_token, field=field_name, model=model)
+    if stream_seconds is not None:
+        registry.observe("pc1_field_stream_seconds", stream_seconds, field=field_name, model=model)
+    session_id = current_session.get()
+    if session_id is not None:
+        registry.record_session(session_id, tokens, stream_seconds or 0.0)
+
+class RequestProfile:
+    """Profiles the threads that work on one request, each with its own profiler.
+
+    The threads a request hands work to run profile_thread(), which attaches to
+    the request's profile through a context variable. kind is "cprofile" or,
+    when it is installed, "pyinstrument".
+    """
+
+    def __init__(self, kind: str = "cprofile"):
+        self.kind = kind
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def thread(self):
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode="disabled")
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with self._lock:
+                    self._profilers.append(profiler)
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profilers.append(profiler)
+
+    @contextlib.contextmanager
+    def event_loop(self):
+        """Profile the event loop thread too, unless another request is already profiling it.
+
+        The loop serves other requests meanwhile, so their work shows up here as well.
+        """
+        if not _loop_profiling.acquire(blocking=False):
+            yield
+            return
+        try:
+            with self.thread():
+                yield
+        finally:
+            _loop_profiling.release()
+
+    def save(self, name: str) -> Optional[str]:
+        """Write the merged profile to PROFILE_DIR and return its path, or None if nothing ran."""
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}")
+        if self.kind == "pyinstrument":
+            path += ".txt"
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("\n".join(profiler.output_text() for profiler in profilers))
+            return path
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path + ".prof")
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(path + ".txt", "w", encoding="utf-8") as file:
+            file.write(summary.getvalue())
+        return path + ".prof"
+
+# A thread runs one profiler at a time, so only one request profiles the event loop
+_loop_profiling = threading.Lock()
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+@contextlib.contextmanager
+def profile_thread():
+    """Profile the calling thread if the request it works for asked for a profile."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.thread():
+        yield
+
+def profile_kind(header: Optional[str]) -> Optional[str]:
+    """The profiler an X-Profile header asks for, or None when profiling is off or not requested."""
+    if not PROFILE_REQUESTS or not header:
+        return None
+    if header.lower() == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+            return "pyinstrument"
+        except ImportError:
+            print("pyinstrument is not installed; profiling with cProfile instead")
+    return "cprofile"
+
+def _run_profiled(fn, args, kwargs):
+    with profile_thread():
+        return fn(*args, **kwargs)
+
+def in_context(fn):
+    """Wrap fn for another thread: it runs in a copy of the caller's context (session, profile)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(_run_profiled, fn, args, kwargs)
@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, replace
+from typing import List, Optional, Tuple
+
+MODEL_ROUTING_PATH = os.getenv("MODEL_ROUTING_PATH", "model_routing.json")
+
+# Rough tokens-per-character ratio of English prose for the Llama tokenizers
+CHARS_PER_TOKEN = 4
+# Expected answer size per line a prompt asks for ("in 4-5 lines")
+TOKENS_PER_LINE = 30
+# Answers without a size hint are assumed to run to this multiple of the prompt,
+# and to at least a few paragraphs
+OUTPUT_RATIO = 2.0
+MIN_OPEN_ANSWER_TOKENS = 600
+
+@dataclass(frozen=True)
+class Route:
+    """Model and sampling settings for one prompt."""
+    model: str = "deepseek-r1-distill-llama-70b"
+    max_completion_tokens: int = 4096
+    temperature: float = 0.6
+    top_p: float = 0.95
+    # Whether the answer may carry the model's <think> block; only sent to reasoning models
+    allow_reasoning: bool = True
+    reasoning_model: bool = True
+
+    @property
+    def reasoning_format(self) -> Optional[str]:
+        if self.reasoning_model and not self.allow_reasoning:
+            return "hidden"
+        return None
+
+DEFAULT_ROUTE = Route()
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+_LINES_HINT = re.compile(r"(\d+)\s*(?:-|to)?\s*(\d+)?\s+lines", re.IGNORECASE)
+
+def estimate_completion_tokens(prompt: str) -> int:
+    """Expected answer length: from an explicit "N lines" hint, else proportional to the prompt."""
+    match = _LINES_HINT.search(prompt)
+    if match:
+        return int(match.group(2) or match.group(1)) * TOKENS_PER_LINE
+    return max(MIN_OPEN_ANSWER_TOKENS, math.ceil(estimate_tokens(prompt) * OUTPUT_RATIO))
+
+class ModelRouter:
+    """Picks a Route per prompt field from the model_routing.json side table.
+
+    A field listed under "fields" uses its tier plus any settings it overrides.
+    Other fields go to the first tier whose max_estimated_tokens covers the
+    estimated answer, falling back to the "default" tier, so short answers run
+    on small, fast models and large JSON tables get the completion budget they
+    need.
+    """
+
+    def __init__(self, path: str = MODEL_ROUTING_PATH):
+        self.path = path
+        self._tiers: Optional[dict] = None
+        self._thresholds: List[Tuple[int, str]] = []
+        self._fields = {}
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def route(self, field_name: str, prompt: str) -> Route:
+        self._load()
+        settings = dict(self._fields.get(field_name, {}))
+        tier = settings.pop("tier", None) or self._tier_for(estimate_completion_tokens(prompt))
+        return self._route(self._tiers.get(tier, DEFAULT_ROUTE), settings)
+
+    def model_settings(self, model: str) -> dict:
+        """The model's entry in the "models" section, e.g. its reasoning flag and rpm/tpm limits."""
+        self._load()
+        return self._models.get(model, {})
+
+    def _tier_for(self, completion_tokens: int) -> str:
+        for max_tokens, name in self._thresholds:
+            if completion_tokens <= max_tokens:
+                return name
+        return "default"
+
+    def _route(self, base: Route, settings: dict) -> Route:
+        if "model" in settings and "reasoning_model" not in settings:
+            settings["reasoning_model"] = self._models.get(settings["model"], {}).get("reasoning", False)
+        return replace(base, **settings)
+
+    def _load(self):
+        with self._lock:
+            if self._tiers is not None:
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    table = json.load(file)
+            except FileNotFoundError:
+                table = {}
+            self._models = table.get("models", {})
+            self._tiers = {}
+            for name, settings in table.get("tiers", {}).items():
+                settings = dict(settings)
+                max_estimated_tokens = settings.pop("max_estimated_tokens", None)
+                self._tiers[name] = self._route(DEFAULT_ROUTE, settings)
+                if max_estimated_tokens is not None:
+                    self._thresholds.append((max_estimated_tokens, name))
+            self._thresholds.sort()
+            self._fields = table.get("fields", {})
+
+router = ModelRouter()
+
+def route(field_name: str, prompt: str) -> Route:
+    return router.route(field_name, prompt)
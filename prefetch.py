@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+from typing import Dict, Optional
+
+import metrics
+import records
+import ver2
+
+# Run a future state's prompts as soon as every variable they read is answered
+PREFETCH_PROMPTS = os.getenv("PREFETCH_PROMPTS", "1") != "0"
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+PREFETCH_SESSIONS = int(os.getenv("PREFETCH_SESSIONS", "256"))
+PREFETCH_POLL_INTERVAL = 0.2
+
+def input_fingerprint(inputs: dict) -> str:
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=records.to_jsonable)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class Prefetch:
+    """One state's prompts running ahead of the user, on a copy of just the inputs they read."""
+
+    def __init__(self, state: ver2.State, inputs: dict):
+        self.state = state
+        self.inputs = inputs
+        self.fingerprint = input_fingerprint(inputs)
+        self.user_data = dict(inputs)
+        self.cancel_event = threading.Event()
+        self.future = None
+        self._events = []
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def on_event(self, event: str, field_name: str, detail: Optional[dict] = None):
+        with self._lock:
+            if event != "tokens":
+                self._events.append((event, field_name, detail))
+            listener = self._listener
+        if listener:
+            listener(event, field_name, detail)
+
+    def matches(self, state: ver2.State, user_data: dict) -> bool:
+        """Whether this ran for `state` on the values user_data has now."""
+        if state is not self.state or any(name not in user_data for name in self.inputs):
+            return False
+        return input_fingerprint({name: user_data[name] for name in self.inputs}) == self.fingerprint
+
+    def failed(self) -> bool:
+        """Finished with a field it couldn't answer, or with an exception."""
+        if not self.future.done():
+            return False
+        if self.future.cancelled():
+            return True
+        return self.future.exception() is not None or bool(self.future.result())
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def adopt(self, on_event=None, cancel_event: Optional[threading.Event] = None) -> Optional[tuple]:
+        """Wait for the run to finish and return its (field values, field errors); None if it raised.
+
+        Blocks, so call it off the event loop. on_event first gets the field
+        events the run already had, then the rest as they happen. Setting
+        cancel_event cancels the run.
+        """
+        with self._lock:
+            self._listener = on_event
+            events = list(self._events)
+        if on_event:
+            for event in events:
+                on_event(*event)
+        while not self.future.done():
+            if cancel_event is not None and cancel_event.is_set():
+                self.cancel()
+            wait([self.future], timeout=PREFETCH_POLL_INTERVAL)
+        try:
+            field_errors = self.future.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            print(f"Error prefetching {self.state.name}: {str(e)}")
+            return None
+        values = {field: self.user_data[field] for field in self.state.promptFields if field in self.user_data}
+        return values, field_errors
+
+    async def adopt_async(self, on_event=None, cancel_event: Optional[threading.Event] = None) -> Optional[tuple]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.adopt, on_event, cancel_event))
+
+class Prefetcher:
+    """Per-session prefetches of future states' prompts, keyed by state name.
+
+    After each submit, schedule() starts the states whose inputs are all known
+    and cancels those whose inputs have changed since. When the user reaches
+    the state, take() hands over its prefetch if it still matches the answers.
+    Prefetches live in this process only; a session served by another worker
+    just runs its prompts when it gets there.
+    """
+
+    def __init__(self, workers: int = PREFETCH_WORKERS, max_sessions: int = PREFETCH_SESSIONS,
+                 enabled: bool = PREFETCH_PROMPTS):
+        self.enabled = enabled
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, session_id: str, states: ver2.StateGraph, current_state: Optional[str], user_data: dict):
+        if not self.enabled:
+            return
+        upcoming = {state.name: Prefetch(state, inputs)
+                    for state, inputs in ver2.upcoming_prompt_states(states, current_state, user_data)}
+        with self._lock:
+            staged = self._entry(session_id)
+            for name in list(staged):
+                prefetch = staged[name]
+                fresh = upcoming.get(name)
+                if fresh is not None and fresh.state is prefetch.state \
+                        and fresh.fingerprint == prefetch.fingerprint and not prefetch.failed():
+                    del upcoming[name]
+                    continue
+                prefetch.cancel()
+                del staged[name]
+                metrics.registry.inc("pc1_prefetch_total", state=name, outcome="discarded")
+            for name, prefetch in upcoming.items():
+                staged[name] = prefetch
+                prefetch.future = self._executor.submit(metrics.in_context(ver2.run_prompt_actions), prefetch.state,
+                                                        prefetch.user_data, on_event=prefetch.on_event,
+                                                        cancel_event=prefetch.cancel_event)
+
+    def take(self, session_id: str, state: ver2.State, user_data: dict) -> Optional[Prefetch]:
+        """Hand over the state's prefetch if it ran on the answers user_data has now; a stale one is cancelled."""
+        with self._lock:
+            staged = self._sessions.get(session_id)
+            prefetch = staged.pop(state.name, None) if staged is not None else None
+        if prefetch is None:
+            return None
+        # One still queued behind other sessions' prefetches is no head start, so the prompts just run now
+        if not prefetch.matches(state, user_data) or prefetch.failed() or prefetch.future.cancel():
+            prefetch.cancel()
+            metrics.registry.inc("pc1_prefetch_total", state=state.name, outcome="discarded")
+            return None
+        metrics.registry.inc("pc1_prefetch_total", state=state.name,
+                             outcome="used" if prefetch.future.done() else "joined")
+        return prefetch
+
+    def forget(self, session_id: str):
+        with self._lock:
+            staged = self._sessions.pop(session_id, {})
+        for prefetch in staged.values():
+            prefetch.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), OrderedDict()
+        for staged in sessions:
+            for prefetch in staged.values():
+                prefetch.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _entry(self, session_id: str) -> Dict[str, Prefetch]:
+        staged = self._sessions.get(session_id)
+        if staged is None:
+            staged = self._sessions[session_id] = {}
+            while len(self._sessions) > self.max_sessions:
+                for prefetch in self._sessions.popitem(last=False)[1].values():
+                    prefetch.cancel()
+        self._sessions.move_to_end(session_id)
+        return staged
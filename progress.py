@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+PROGRESS_QUEUE_SIZE = int(os.getenv("PROGRESS_QUEUE_SIZE", "64"))
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "0.1"))
+
+class ProgressStream:
+    """Carries prompt events from worker threads to one server-sent event response.
+
+    Field lifecycle events go through a bounded queue, so prompt threads wait
+    for a slow client instead of piling events up in memory. Token counts are
+    coalesced per field and sent at most every PROGRESS_INTERVAL, so a client
+    that can't keep up sees the latest count rather than a backlog. When the
+    client goes away, cancel_event tells the prompts to stop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = PROGRESS_QUEUE_SIZE,
+                 interval: float = PROGRESS_INTERVAL):
+        self.loop = loop
+        self.interval = interval
+        self.queue = asyncio.Queue(maxsize)
+        self.cancel_event = threading.Event()
+        self._tokens = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def on_event(self, event: str, field_name: str, detail: Optional[dict] = None):
+        """ver2 on_event callback; safe to call from any thread."""
+        if event == "tokens":
+            with self._lock:
+                self._tokens[field_name] = detail["tokens"]
+                self._dirty.add(field_name)
+            return
+        self.publish({"event": event, "field": field_name, **(detail or {})})
+
+    def publish(self, item: dict):
+        """Queue an event from a worker thread, waiting while the queue is full."""
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while not self.cancel_event.is_set():
+            try:
+                future.result(timeout=self.interval)
+                return
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def attach(self, task: asyncio.Task):
+        """Send the task's result (or error) as the final event once it finishes."""
+        def on_done(done: asyncio.Task):
+            if done.cancelled():
+                item = {"event": "error", "detail": "cancelled"}
+            elif done.exception() is not None:
+                error = done.exception()
+                item = {"event": "error", "detail": getattr(error, "detail", None) or str(error)}
+            else:
+                item = {"event": "result", **done.result()}
+            asyncio.ensure_future(self.queue.put(item))
+        task.add_done_callback(on_done)
+
+    def _token_events(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return [{"event": "tokens", "field": field_name, "tokens": self._tokens[field_name]}
+                    for field_name in dirty]
+
+    async def events(self):
+        """Yield events until the final result, cancelling the prompts if the consumer stops early."""
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), self.interval)
+                except asyncio.TimeoutError:
+                    item = None
+                for token_event in self._token_events():
+                    yield token_event
+                if item is not None:
+                    yield item
+                    if item["event"] in ("result", "error"):
+                        return
+        finally:
+            self.cancel()
+
+    async def sse(self):
+        async for item in self.events():
+            yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
@@ -0,0 +1,231 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+import model_router
+
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "1") != "0"
+# Limits for models model_routing.json doesn't list; 0 means unlimited
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+# After a 429 the refill rate is cut by this factor, then recovers a step per successful completion
+RATE_BACKOFF_FACTOR = float(os.getenv("RATE_BACKOFF_FACTOR", "0.5"))
+RATE_RECOVERY_STEP = float(os.getenv("RATE_RECOVERY_STEP", "0.05"))
+RATE_MIN_FACTOR = 0.1
+# Pause after a 429 that doesn't say how long to wait
+RATE_DEFAULT_PAUSE = 2.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit reset header such as "7.66s", "2m59.56s" or "120ms"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+class TokenBucket:
+    """Refills at capacity per minute. Callers reserve from it and are told how long to wait.
+
+    The level may go negative: that is capacity promised to callers still
+    waiting their turn, so they are served in the order they asked.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float, factor: float) -> float:
+        self.refill(now, factor)
+        # A request larger than the bucket waits for a full bucket rather than forever
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / (self.capacity / 60 * factor))
+
+    def refund(self, amount: float, now: float, factor: float):
+        self.refill(now, factor)
+        self.level = min(self.capacity, self.level + amount)
+
+    def refill(self, now: float, factor: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60 * factor)
+        self.updated = now
+
+class ModelLimits:
+    """Request and token buckets of one model, with the adaptive rate factor and any pause after a 429."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.factor = 1.0
+        self.paused_until = 0.0
+
+class Permit:
+    """One admitted completion; report back what the provider said so the limits stay accurate."""
+
+    def __init__(self, limiter: "RateLimiter", model: str, prompt_tokens: int, estimated_tokens: int):
+        self.limiter = limiter
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.estimated_tokens = estimated_tokens
+
+    def observe(self, headers=None, total_tokens: Optional[int] = None, streamed_tokens: Optional[int] = None):
+        """Apply the response's rate-limit headers and give back the unused part of the token estimate.
+
+        The provider's total_tokens is used when the stream reported it;
+        otherwise the prompt estimate plus the tokens streamed so far.
+        """
+        if total_tokens is None and streamed_tokens is not None:
+            total_tokens = self.prompt_tokens + streamed_tokens
+        self.limiter._observe(self, headers, total_tokens)
+
+    def cancel(self):
+        """Give the reservation back when the completion is never sent."""
+        self.limiter._release(self.model, self.estimated_tokens)
+
+    def failed(self, error: Exception):
+        """Slow the model down if the provider answered with 429."""
+        if getattr(error, "status_code", None) == 429:
+            response = getattr(error, "response", None)
+            self.limiter._throttled(self.model, getattr(response, "headers", None))
+
+class RateLimiter:
+    """Shared requests-per-minute and tokens-per-minute buckets for each model.
+
+    Limits come from the "models" section of model_routing.json (rpm, tpm)
+    and are corrected from the provider's x-ratelimit headers. A 429 pauses
+    every caller of that model for the time the provider asks and cuts its
+    refill rate, which then recovers step by step as completions succeed.
+    """
+
+    def __init__(self, default_rpm: float = LLM_RPM, default_tpm: float = LLM_TPM, enabled: bool = LLM_RATE_LIMITS):
+        self.enabled = enabled
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.throttled = 0
+        self._models: Dict[str, ModelLimits] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model: str, prompt_tokens: int, max_completion_tokens: int,
+                cancel_event: Optional[threading.Event] = None) -> Optional[Permit]:
+        """Wait until the model has room for one request; None if cancelled meanwhile.
+
+        The request counts as its prompt plus the longest completion it may produce.
+        """
+        estimated_tokens = prompt_tokens + max_completion_tokens
+        if not self.enabled:
+            return Permit(self, model, prompt_tokens, estimated_tokens)
+        with self._lock:
+            limits = self._limits(model)
+            now = time.monotonic()
+            wait = max(0.0, limits.paused_until - now)
+            if limits.requests is not None:
+                wait = max(wait, limits.requests.reserve(1, now, limits.factor))
+            if limits.tokens is not None:
+                wait = max(wait, limits.tokens.reserve(estimated_tokens, now, limits.factor))
+        if wait > 0:
+            with metrics.stage("rate_limit_wait"):
+                if cancel_event is None:
+                    time.sleep(wait)
+                elif cancel_event.wait(wait):
+                    self._release(model, estimated_tokens)
+                    return None
+        return Permit(self, model, prompt_tokens, estimated_tokens)
+
+    def _release(self, model: str, estimated_tokens: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            limits = self._limits(model)
+            now = time.monotonic()
+            if limits.requests is not None:
+                limits.requests.refund(1, now, limits.factor)
+            if limits.tokens is not None:
+                limits.tokens.refund(estimated_tokens, now, limits.factor)
+
+    def _observe(self, permit: Permit, headers, total_tokens: Optional[int]):
+        if not self.enabled:
+            return
+        with self._lock:
+            limits = self._limits(permit.model)
+            now = time.monotonic()
+            limits.factor = min(1.0, limits.factor + RATE_RECOVERY_STEP)
+            if total_tokens is not None and limits.tokens is not None:
+                limits.tokens.refund(permit.estimated_tokens - total_tokens, now, limits.factor)
+            if headers is not None:
+                self._apply_headers(limits, headers, now)
+
+    def _throttled(self, model: str, headers):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.throttled += 1
+            limits = self._limits(model)
+            now = time.monotonic()
+            limits.factor = max(RATE_MIN_FACTOR, limits.factor * RATE_BACKOFF_FACTOR)
+            pause = None
+            if headers is not None:
+                pause = parse_duration(headers.get("retry-after"))
+                self._apply_headers(limits, headers, now)
+            limits.paused_until = max(limits.paused_until, now + (pause if pause is not None else RATE_DEFAULT_PAUSE))
+        metrics.registry.inc("pc1_rate_limited_total", model=model)
+
+    def _apply_headers(self, limits: ModelLimits, headers, now: float):
+        token_limit = _number(headers.get("x-ratelimit-limit-tokens"))
+        if token_limit:
+            if limits.tokens is None:
+                limits.tokens = TokenBucket(token_limit)
+            limits.tokens.capacity = token_limit
+        remaining_tokens = _number(headers.get("x-ratelimit-remaining-tokens"))
+        if remaining_tokens is not None and limits.tokens is not None:
+            limits.tokens.refill(now, limits.factor)
+            limits.tokens.level = min(limits.tokens.level, remaining_tokens)
+        # Request quotas may be per day rather than per minute, so only an exhausted one is acted on
+        if _number(headers.get("x-ratelimit-remaining-requests")) == 0:
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                limits.paused_until = max(limits.paused_until, now + reset)
+
+    def _limits(self, model: str) -> ModelLimits:
+        limits = self._models.get(model)
+        if limits is None:
+            settings = model_router.router.model_settings(model)
+            limits = self._models[model] = ModelLimits(settings.get("rpm", self.default_rpm),
+                                                       settings.get("tpm", self.default_tpm))
+        return limits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "throttled": self.throttled,
+                "models": {
+                    model: {
+                        "factor": limits.factor,
+                        "tokens_available": limits.tokens.level if limits.tokens else None,
+                        "requests_available": limits.requests.level if limits.requests else None,
+                        "paused_for": max(0.0, limits.paused_until - time.monotonic()),
+                    }
+                    for model, limits in self._models.items()
+                },
+            }
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+limiter = RateLimiter()
+
+def estimate_prompt_tokens(messages: list) -> int:
+    return sum(model_router.estimate_tokens(message["content"]) for message in messages)
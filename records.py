@@ -0,0 +1,312 @@
+import abc
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+PROMPT_TEMPLATES_PATH = os.getenv("PROMPT_TEMPLATES_PATH",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts_with_json.json"))
+DOWNLOAD_PREFIX = "Download\n"
+
+# Schemas are ("object", {key: schema}), ("array", item schema) or ANY. Leaves are
+# left untyped: the templates only show example values, and the renderer prints
+# whatever it gets, so only the shape of containers is checked.
+ANY = ("any",)
+
+def schema_from_example(example) -> tuple:
+    """Derive a structural schema from an example value in prompts_with_json.json."""
+    if isinstance(example, dict):
+        return ("object", {key: schema_from_example(value) for key, value in example.items()})
+    if isinstance(example, list):
+        return ("array", schema_from_example(example[0]) if example else ANY)
+    return ANY
+
+def validate(value, schema: tuple, path: str = "$") -> List[str]:
+    """Check value against schema, returning one message per mismatch."""
+    errors = []
+    _validate(value, schema, path, errors)
+    return errors
+
+def _validate(value, schema: tuple, path: str, errors: List[str]):
+    kind = schema[0]
+    if kind == "object":
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected an object, got {type(value).__name__}")
+            return
+        for key, sub_schema in schema[1].items():
+            if value.get(key) is not None:
+                _validate(value[key], sub_schema, f"{path}.{key}", errors)
+    elif kind == "array":
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected an array, got {type(value).__name__}")
+            return
+        for i, item in enumerate(value):
+            _validate(item, schema[1], f"{path}[{i}]", errors)
+
+_JSON_BRACKET = re.compile(r'\\.|["{}\[\]]')
+_CLOSING = {"}": "{", "]": "["}
+
+def extract_json(text: str):
+    """Repair pass: the largest balanced {...} or [...] span of text that parses as JSON, or None.
+
+    Recovers answers wrapped in prose or followed by notes without another
+    round trip to the model.
+    """
+    spans = []
+    stack = []
+    in_string = False
+    for match in _JSON_BRACKET.finditer(text):
+        token = match.group()
+        if in_string:
+            in_string = token != '"'
+        elif token == '"':
+            in_string = bool(stack)
+        elif token in "{[":
+            stack.append((token, match.start()))
+        elif token in _CLOSING:
+            if stack and stack[-1][0] == _CLOSING[token]:
+                spans.append((stack.pop()[1], match.end()))
+            else:
+                stack.clear()
+    for start, end in sorted(spans, key=lambda span: span[0] - span[1]):
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError:
+            continue
+    return None
+
+class Record(abc.ABC):
+    """Base of the parsed forms of LLM answers.
+
+    The typed fields are a read-only view for the renderer. payload keeps the
+    JSON the model produced, keys the view doesn't know included, and to_json
+    gives it back unchanged, so prompts, stored sessions and /generate-json
+    see the answer as it was.
+    """
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def to_json(self):
+        """The record as the JSON payload it was parsed from."""
+
+@dataclass(frozen=True)
+class CostTable(Record):
+    __slots__ = ("name", "description", "headers", "subheaders", "rows", "payload")
+    name: str
+    description: Any
+    headers: List[str]
+    subheaders: Optional[List[Optional[List[str]]]]
+    rows: List[dict]
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+@dataclass(frozen=True)
+class CapitalCostEstimates(Record):
+    __slots__ = ("tables", "payload")
+    tables: List[CostTable]
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+@dataclass(frozen=True)
+class PlanEntry(Record):
+    __slots__ = ("label", "amount")
+    label: Any
+    amount: Any
+
+    def to_json(self):
+        return {self.label: self.amount}
+
+@dataclass(frozen=True)
+class MaintenanceCosts(Record):
+    """Either the year-wise financial plan or the list of operations costs, as (label, amount) rows.
+
+    entries holds only the rows the document shows.
+    """
+    __slots__ = ("kind", "entries", "payload")
+    kind: str
+    entries: List[PlanEntry]
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+@dataclass(frozen=True)
+class YearPhase(Record):
+    __slots__ = ("amount", "division_of_total_items", "payload")
+    amount: Any
+    division_of_total_items: Any
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+@dataclass(frozen=True)
+class ProjectComponent(Record):
+    __slots__ = ("serial_number", "input", "component_name", "units", "years",
+                 "baseline_indicator", "post_completion_targets", "key_benefits", "payload")
+    serial_number: Any
+    input: Any
+    component_name: Any
+    units: Any
+    years: Tuple[YearPhase, YearPhase, YearPhase]
+    baseline_indicator: Any
+    post_completion_targets: Any
+    key_benefits: Any
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+@dataclass(frozen=True)
+class Benefits(Record):
+    __slots__ = ("components", "payload")
+    components: List[ProjectComponent]
+    payload: dict
+
+    def to_json(self):
+        return self.payload
+
+def _build_capital_cost(key: str, answer: dict, errors: List[str]) -> CapitalCostEstimates:
+    tables = []
+    for i, table in enumerate(answer[key]):
+        rows = table.get("data") or []
+        if not all(isinstance(row, dict) for row in rows):
+            errors.append(f"$.capitalCost[{i}].data: expected an array of objects")
+            continue
+        headers = list(rows[0].keys()) if rows else []
+        subheaders = None
+        if rows and any(isinstance(value, dict) for value in rows[0].values()):
+            subheaders = [list(value.keys()) if isinstance(value, dict) else None for value in rows[0].values()]
+        tables.append(CostTable(table.get("name", ""), table.get("description", ""), headers, subheaders, rows,
+                                table))
+    return CapitalCostEstimates(tables, answer)
+
+def _build_maintenance_costs(key: str, answer: dict, errors: List[str]) -> MaintenanceCosts:
+    payload = answer[key]
+    if key == "operations":
+        entries = [PlanEntry(description, amount)
+                   for description, amount in zip(payload.get("description", []), payload.get("Amount", []))]
+        return MaintenanceCosts("operations", entries, answer)
+    entries = [PlanEntry(label, amount)
+               for item in payload for label, amount in item.items()
+               if "Year" in label or "Total Cost" in label]
+    return MaintenanceCosts("financialPlan", entries, answer)
+
+def _build_benefits(key: str, answer: dict, errors: List[str]) -> Benefits:
+    components = []
+    for item in answer[key]:
+        phasing = item.get("year_wise_phasing") or {}
+        years = []
+        for i in (1, 2, 3):
+            phase = phasing.get(f"year_{i}") or {}
+            years.append(YearPhase(phase.get("amount", ""), phase.get("division_of_total_items", ""), phase))
+        components.append(ProjectComponent(
+            item.get("serial_number", ""),
+            item.get("input", ""),
+            (item.get("outcome") or {}).get("component_name", ""),
+            (item.get("outcome") or {}).get("units", ""),
+            tuple(years),
+            (item.get("outcome_metrics") or {}).get("baseline_indicator", ""),
+            (item.get("targeted_impact") or {}).get("post_completion_targets", ""),
+            (item.get("impact_details") or {}).get("key_benefits", ""),
+            item,
+        ))
+    return Benefits(components, answer)
+
+_BUILDERS = {
+    "capitalCostEstimates": _build_capital_cost,
+    "maintenanceCosts": _build_maintenance_costs,
+    "benefits": _build_benefits,
+}
+
+def build_field_schemas(templates: dict) -> Dict[str, List[Tuple[str, tuple]]]:
+    """Maps each structured prompt field to the (top-level key, schema) forms its answer may take."""
+    table = schema_from_example(templates["finalJson"]["capitalCost"][0])
+    # finalJson elides each table's rows as "..."; they are objects whose keys vary by table
+    table[1]["data"] = ("array", ("object", {}))
+    return {
+        "capitalCostEstimates": [("capitalCost", ("array", table))],
+        "maintenanceCosts": [
+            ("financialPlan", schema_from_example(templates["financialPlanTable"]["financialPlan"])),
+            ("operations", schema_from_example(templates["operations"])),
+        ],
+        "benefits": [("project_components", schema_from_example([templates["summary"]]))],
+    }
+
+_field_schemas = None
+_field_schemas_lock = threading.Lock()
+
+def get_field_schemas() -> Dict[str, List[Tuple[str, tuple]]]:
+    global _field_schemas
+    with _field_schemas_lock:
+        if _field_schemas is None:
+            with open(PROMPT_TEMPLATES_PATH, 'r', encoding='utf-8') as file:
+                _field_schemas = build_field_schemas(json.load(file))
+        return _field_schemas
+
+def parse_field(field_name: str, value) -> Tuple[Any, List[str]]:
+    """Turn a field's JSON answer into its record, validating it against the field's schema.
+
+    Returns (record, []) on success and (None, errors) otherwise. Fields without
+    a schema come back unchanged.
+    """
+    forms = get_field_schemas().get(field_name)
+    if forms is None or isinstance(value, Record):
+        return value, []
+    if not isinstance(value, dict):
+        return None, [f"$: expected an object, got {type(value).__name__}"]
+    for key, schema in forms:
+        if value.get(key):
+            errors = validate(value[key], schema, f"$.{key}")
+            if errors:
+                return None, errors
+            record = _BUILDERS[field_name](key, value, errors)
+            return (None, errors) if errors else (record, [])
+    return None, [f"$: expected one of the keys {', '.join(key for key, _ in forms)}"]
+
+def parse_response(field_name: str, text: str) -> Tuple[Any, List[str]]:
+    """Parse a cleaned completion for field_name in one pass: JSON, then the record if it has a schema.
+
+    Fields with a schema fall back to extract_json when the text isn't JSON as a whole.
+
+    The value falls back to the raw text (or decoded JSON) when the record
+    can't be built, so nothing the model produced is lost.
+    """
+    payload = text[len(DOWNLOAD_PREFIX):] if text.startswith(DOWNLOAD_PREFIX) else text
+    try:
+        value = json.loads(payload)
+    except json.JSONDecodeError as e:
+        if field_name not in get_field_schemas():
+            return text, []
+        value = extract_json(payload)
+        if value is None:
+            return text, [f"invalid JSON: {str(e)}"]
+    record, errors = parse_field(field_name, value)
+    return (value, errors) if errors else (record, [])
+
+def coerce(field_name: str, value):
+    """The record for a stored field value, parsing it if it is still raw JSON; None if unusable."""
+    if isinstance(value, Record):
+        return value
+    if not value:
+        return None
+    if isinstance(value, str):
+        record, errors = parse_response(field_name, value)
+    else:
+        record, errors = parse_field(field_name, value)
+    if errors:
+        print(f"Invalid {field_name}: {'; '.join(errors)}")
+        return None
+    return record
+
+def to_jsonable(value):
+    """json.dumps default hook that writes records in the shape the model returned them."""
+    if isinstance(value, Record):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
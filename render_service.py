@@ -0,0 +1,249 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+import sample2
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 2)))
+# Workers are spawned rather than forked so they don't inherit the server's threads and sockets
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "spawn")
+FRAGMENT_CACHE_SESSIONS = int(os.getenv("FRAGMENT_CACHE_SESSIONS", "256"))
+
+def _warm_worker():
+    """Process initializer: build the base template before the first job."""
+    sample2.get_base_template()
+
+def _ping():
+    return os.getpid()
+
+def _render(user_data: dict, fragments: dict) -> tuple:
+    start = time.perf_counter()
+    with metrics.capture() as observations:
+        with metrics.stage("assemble_document"):
+            result = sample2.assemble_document(user_data, fragments)
+    return result, time.perf_counter() - start, observations
+
+def _render_fragments(user_data: dict, keys: list) -> tuple:
+    start = time.perf_counter()
+    with metrics.capture() as observations:
+        fragments = sample2.render_fragments(user_data, keys)
+    return fragments, time.perf_counter() - start, observations
+
+class FragmentCache:
+    """Per-session section fragments, each tagged with the fingerprint of the inputs it was rendered from.
+
+    The last assembled document is kept too, so downloading again without
+    changing any answer doesn't touch the worker pool at all.
+    """
+
+    def __init__(self, max_sessions: int = FRAGMENT_CACHE_SESSIONS):
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fresh(self, session_id: str, fingerprints: dict) -> dict:
+        """The cached fragments whose fingerprint still matches."""
+        with self._lock:
+            entry = self._entry(session_id)
+            fragments = {key: entry["fragments"][key][1] for key, fingerprint in fingerprints.items()
+                         if entry["fragments"].get(key, (None,))[0] == fingerprint}
+            self.hits += len(fragments)
+            self.misses += len(fingerprints) - len(fragments)
+            return fragments
+
+    def stale(self, session_id: str, fingerprints: dict) -> list:
+        with self._lock:
+            cached = self._entry(session_id)["fragments"]
+            return [key for key, fingerprint in fingerprints.items() if cached.get(key, (None,))[0] != fingerprint]
+
+    def store(self, session_id: str, fingerprints: dict, fragments: dict):
+        with self._lock:
+            cached = self._entry(session_id)["fragments"]
+            for key, fragment in fragments.items():
+                cached[key] = (fingerprints[key], fragment)
+
+    def document(self, session_id: str, fingerprints: dict):
+        with self._lock:
+            document = self._entry(session_id)["document"]
+            if document is not None and document[0] == fingerprints:
+                return document[1]
+            return None
+
+    def store_document(self, session_id: str, fingerprints: dict, content: bytes):
+        with self._lock:
+            self._entry(session_id)["document"] = (fingerprints, content)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _entry(self, session_id: str) -> dict:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = {"fragments": {}, "document": None}
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return entry
+
+class RenderService:
+    """Renders PC-1 documents to bytes on a pool of pre-warmed worker processes.
+
+    python-docx is CPU-bound and holds the GIL, so rendering in worker
+    processes lets documents for many users be built on all cores while the
+    event loop keeps serving requests. When a session id is given, sections
+    whose inputs haven't changed are reused from the fragment cache instead of
+    being rendered again.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, start_method: str = RENDER_START_METHOD):
+        self.workers = max(1, workers)
+        self.start_method = start_method
+        self._pool = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.render_seconds = 0.0
+        self.max_render_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.fragments = FragmentCache()
+
+    def start(self):
+        """Spawn every worker now and wait until each has imported sample2."""
+        pool = self._get_pool()
+        for future in [pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            # Wait for the workers to exit so none outlive the server
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, fn, *args) -> Future:
+        """Run fn(*args) on a worker and resolve to its result.
+
+        fn returns (result, seconds, observations); the observations are the
+        metrics it captured in the worker and are replayed into this process.
+        """
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+        result = Future()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset_pool()
+            future = self._get_pool().submit(fn, *args)
+
+        def on_done(done: Future):
+            try:
+                value, render_seconds, observations = done.result()
+            except BaseException as e:
+                with self._lock:
+                    self.failed += 1
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_pool()
+                result.set_exception(e)
+                return
+            metrics.registry.replay(observations)
+            with self._lock:
+                self.completed += 1
+                self.render_seconds += render_seconds
+                self.max_render_seconds = max(self.max_render_seconds, render_seconds)
+                self.wait_seconds += time.perf_counter() - submitted_at - render_seconds
+            result.set_result(value)
+
+        future.add_done_callback(on_done)
+        return result
+
+    def render_document(self, user_data: dict) -> Future:
+        """Render the document for user_data from scratch; the future resolves to the .docx bytes.
+
+        For callers outside the event loop, such as batch runs.
+        """
+        content = Future()
+
+        def on_done(done: Future):
+            if done.exception() is not None:
+                content.set_exception(done.exception())
+            else:
+                content.set_result(done.result()[0])
+
+        self.submit(_render, user_data, {}).add_done_callback(on_done)
+        return content
+
+    async def render(self, user_data: dict, session_id: str = None) -> bytes:
+        """Render the document for user_data, reusing the session's cached fragments."""
+        if session_id is None:
+            return await asyncio.wrap_future(self.render_document(user_data))
+        fingerprints = sample2.section_fingerprints(user_data)
+        content = self.fragments.document(session_id, fingerprints)
+        if content is not None:
+            return content
+        cached = self.fragments.fresh(session_id, fingerprints)
+        content, rendered = await asyncio.wrap_future(self.submit(_render, user_data, cached))
+        self.fragments.store(session_id, fingerprints, rendered)
+        self.fragments.store_document(session_id, fingerprints, content)
+        return content
+
+    def prerender(self, session_id: str, user_data: dict):
+        """Render the session's out-of-date fragments in the background, if a worker is idle."""
+        fingerprints = sample2.section_fingerprints(user_data)
+        stale = self.fragments.stale(session_id, fingerprints)
+        if not stale or self.metrics()["in_flight"] >= self.workers:
+            return None
+
+        def on_done(done: Future):
+            if done.exception() is not None:
+                print(f"Error prerendering document sections: {str(done.exception())}")
+                return
+            self.fragments.store(session_id, fingerprints, done.result())
+
+        future = self.submit(_render_fragments, user_data, stale)
+        future.add_done_callback(on_done)
+        return future
+
+    def metrics(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            in_flight = self.submitted - finished
+            return {
+                "workers": self.workers,
+                "in_flight": in_flight,
+                "queue_depth": max(in_flight - self.workers, 0),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_render_seconds": self.render_seconds / self.completed if self.completed else 0.0,
+                "max_render_seconds": self.max_render_seconds,
+                "avg_wait_seconds": self.wait_seconds / self.completed if self.completed else 0.0,
+                "fragment_hits": self.fragments.hits,
+                "fragment_misses": self.fragments.misses,
+            }
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_warm_worker,
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
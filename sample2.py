@@ -1,11 +1,18 @@
+import hashlib
+import io
 import json
+import os
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.enum.table import WD_TABLE_ALIGNMENT, WD_ALIGN_VERTICAL
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn, nsdecls
+from lxml import etree
+from xml.sax.saxutils import escape
 import re  # Add this line with your other imports
+import metrics
+import records
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 
@@ -51,6 +58,83 @@ def add_bold_subheading(document, text):
     run.bold = True
     run.font.name = 'Times New Roman'
 
+TABLE_STYLE = 'PC1 Table'
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def get_style_id(document, name):
+    """Looks up a style id by name, remembering it when `document` is a SectionWriter.
+
+    Assigning styles by name through python-docx rescans every style in the
+    document each time, which dominates rendering of long documents.
+    """
+    style_ids = getattr(document, 'style_ids', None)
+    if style_ids is not None and name in style_ids:
+        return style_ids[name]
+    style = get_table_style(document) if name == TABLE_STYLE else document.styles[name]
+    if style_ids is not None:
+        style_ids[name] = style.style_id
+    return style.style_id
+
+def get_table_style(document):
+    """Returns the document's table style ('Table Grid' in Times New Roman), adding it on first use."""
+    styles = document.styles
+    try:
+        return styles[TABLE_STYLE]
+    except KeyError:
+        style = styles.add_style(TABLE_STYLE, WD_STYLE_TYPE.TABLE)
+        style.base_style = styles['Table Grid']
+        style.font.name = 'Times New Roman'
+        return style
+
+def _cell_xml(text, width, bold=False, center=False, span=1):
+    """Builds the XML for one vertically centered table cell holding `text` (newlines become breaks)."""
+    lines = _INVALID_XML_CHARS.sub('', str(text)).split('\n')
+    run_text = '</w:t><w:br/><w:t xml:space="preserve">'.join(escape(line) for line in lines)
+    tc_pr = f'<w:tcW w:w="{width}" w:type="dxa"/>' if width else ''
+    if span > 1:
+        tc_pr += f'<w:gridSpan w:val="{span}"/>'
+    p_pr = '<w:pPr><w:jc w:val="center"/></w:pPr>' if center else ''
+    r_pr = '<w:rPr><w:b/></w:rPr>' if bold else ''
+    return (f'<w:tc><w:tcPr>{tc_pr}<w:vAlign w:val="center"/></w:tcPr>'
+            f'<w:p>{p_pr}<w:r>{r_pr}<w:t xml:space="preserve">{run_text}</w:t></w:r></w:p></w:tc>')
+
+def add_table_rows(document, column_count, rows):
+    """Adds a styled table and fills it with all `rows` in a single XML parse.
+
+    Each row is a list of (text, options) cells, where options are the keyword
+    arguments of _cell_xml (bold, center, span). Fonts come from the table style
+    rather than being set run by run.
+    """
+    table = document.add_table(rows=0, cols=column_count)
+    table._tbl.tblPr.style = get_style_id(document, TABLE_STYLE)
+    table.autofit = True  # Enable auto-fit
+
+    widths = [grid_col.w.twips if grid_col.w is not None else None
+              for grid_col in table._tbl.tblGrid.gridCol_lst]
+    xml = [f'<w:tbl {nsdecls("w")}>']
+    for row in rows:
+        xml.append('<w:tr>')
+        col = 0
+        for text, options in row:
+            span = options.get('span', 1)
+            width = sum(widths[col:col + span]) if all(widths[col:col + span]) else None
+            xml.append(_cell_xml(text, width, **options))
+            col += span
+        xml.append('</w:tr>')
+    xml.append('</w:tbl>')
+    table._tbl.extend(parse_xml(''.join(xml)).tr_lst)
+    return table
+
+def _format_cell_value(header, value):
+    """Formats a data cell: bullet lists for list descriptions, thousands separators elsewhere."""
+    if header == 'Description':
+        if isinstance(value, list):
+            return ''.join(f"• {item_desc}\n" for item_desc in value)
+        return str(value)
+    return str(format_number_with_commas(value))
+
+HEADER_CELL = {'bold': True, 'center': True}
+
 def create_table(document, headers, data, include_total=False, total_column_index=None):
     """Creates a formatted table with given headers and data with auto-fit columns,
          optionally including a total row."""
@@ -58,55 +142,24 @@ def create_table(document, headers, data, include_total=False, total_column_inde
         document.add_paragraph("No data available for this table.")
         return
 
-    table = document.add_table(rows=1, cols=len(headers))
-    table.style = 'Table Grid'
-    table.autofit = True  # Enable auto-fit
-
-    hdr_cells = table.rows[0].cells
-    for i, header in enumerate(headers):
-        hdr_cells[i].text = header
-        hdr_cells[i].paragraphs[0].runs[0].bold = True
-        hdr_cells[i].paragraphs[0].runs[0].font.name = 'Times New Roman'
-        hdr_cells[i].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-        hdr_cells[i].paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
+    rows = [[(header, HEADER_CELL) for header in headers]]
     for item in data:
-        row_cells = table.add_row().cells
-        for i, header in enumerate(headers):
-            value = item.get(header, '')
-            if header == 'Description':  # Check if it's the 'Description' column
-                if isinstance(value, list):
-                    p = row_cells[i].add_paragraph()
-                    for item_desc in value:
-                        p.add_run(f"• {item_desc}\n")
-                    p.runs[0].font.name = 'Times New Roman'
-                else:
-                    row_cells[i].text = str(value)
-            else:
-                formatted_value = format_number_with_commas(value)
-                row_cells[i].text = str(formatted_value)
-            row_cells[i].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-            for paragraph in row_cells[i].paragraphs:
-                for run in paragraph.runs:
-                    run.font.name = 'Times New Roman'
+        rows.append([(_format_cell_value(header, item.get(header, '')), {}) for header in headers])
 
     # Add total row if required
     if include_total and total_column_index is not None:
         try:
-            total = sum(float(str(row[total_column_index]).replace(',', '')) for row in data)
-            total_row_cells = table.add_row().cells
-            total_row_cells[0].text = "Total"
-            total_row_cells[total_column_index].text = format_number_with_commas(total)
-
-            # Format the total row
-            for cell in total_row_cells:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.bold = True
-                        run.font.name = 'Times New Roman'
+            column = headers[total_column_index]
+            total = sum(float(str(row.get(column, 0)).replace(',', '')) for row in data)
+            total_row = [('', {'bold': True}) for _ in headers]
+            total_row[0] = ("Total", {'bold': True})
+            total_row[total_column_index] = (format_number_with_commas(total), {'bold': True})
+            rows.append(total_row)
         except (IndexError, ValueError):
             print("Warning: Could not calculate or format total for the table.")
 
+    add_table_rows(document, len(headers), rows)
+
 def create_table_with_subcolumns(document, main_headers, data, subheaders=None):
     """Creates a table with optional subcolumns and auto-fitting."""
     if not main_headers or not data:
@@ -116,84 +169,32 @@ def create_table_with_subcolumns(document, main_headers, data, subheaders=None):
     if subheaders and len(main_headers) != len(subheaders):
         raise ValueError("Length of main headers must match length of subheaders.")
 
-    num_cols = sum(len(subs) if subs else 1 for subs in subheaders) if subheaders else len(main_headers)
-    table = document.add_table(rows=1 + (1 if any(subheaders) else 0), cols=num_cols)
-    table.style = 'Table Grid'
-    table.autofit = True  # Enable autofit
-
-    hdr_cells = table.rows[0].cells
-    col_index = 0
-    for i, header in enumerate(main_headers):
-        if subheaders and subheaders[i]:
-            hdr_cells[col_index].text = header
-            hdr_cells[col_index].paragraphs[0].runs[0].bold = True
-            hdr_cells[col_index].paragraphs[0].runs[0].font.name = 'Times New Roman'
-            hdr_cells[col_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-            hdr_cells[col_index].paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            hdr_cells[col_index].merge(table.rows[0].cells[col_index + len(subheaders[i]) - 1])
-            col_index += len(subheaders[i])
-        else:
-            hdr_cells[col_index].text = header
-            hdr_cells[col_index].paragraphs[0].runs[0].bold = True
-            hdr_cells[col_index].paragraphs[0].runs[0].font.name = 'Times New Roman'
-            hdr_cells[col_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-            hdr_cells[col_index].paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            col_index += 1
-    if any(subheaders):  # Add this condition
-        sub_hdr_cells = table.add_row().cells
-        col_index = 0
-        for subs in subheaders:
-            if subs:
-                for sub in subs:
-                    sub_hdr_cells[col_index].text = sub
-                    sub_hdr_cells[col_index].paragraphs[0].runs[0].bold = True
-                    sub_hdr_cells[col_index].paragraphs[0].runs[0].font.name = 'Times New Roman'
-                    sub_hdr_cells[col_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-                    sub_hdr_cells[col_index].paragraphs[0].alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                    col_index += 1
-            else:
-                col_index += 1
+    subheaders = subheaders or [None] * len(main_headers)
+    num_cols = sum(len(subs) if subs else 1 for subs in subheaders)
+
+    # Main headers span their subcolumns; the second header row names the subcolumns
+    rows = [[(header, dict(HEADER_CELL, span=len(subs) if subs else 1))
+             for header, subs in zip(main_headers, subheaders)]]
+    if any(subheaders):
+        rows.append([(sub, HEADER_CELL) if subs else ('', {})
+                     for subs in subheaders for sub in (subs or [None])])
 
     # Add data rows
     for row_data in data:
-        row_cells = table.add_row().cells
-        cell_index = 0
-        for i, header_name in enumerate(main_headers):  # changed header to header_name
+        row = []
+        for header_name, subs in zip(main_headers, subheaders):
             value = row_data.get(header_name)
-            if subheaders and subheaders[i]:
+            if subs:
                 if isinstance(value, dict):
-                    for sub_header in subheaders[i]:
-                        formatted_value = format_number_with_commas(value.get(sub_header, ''))
-                        row_cells[cell_index].text = str(formatted_value)
-                        row_cells[cell_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-                        for paragraph in row_cells[cell_index].paragraphs:
-                            for run in paragraph.runs:
-                                run.font.name = 'Times New Roman'
-                        cell_index += 1
+                    row.extend((str(format_number_with_commas(value.get(sub, ''))), {}) for sub in subs)
                 else:
-                    row_cells[cell_index].text = str(format_number_with_commas(value))
-                    row_cells[cell_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-                    for paragraph in row_cells[cell_index].paragraphs:
-                        for run in paragraph.runs:
-                            run.font.name = 'Times New Roman'
-                    cell_index += 1
+                    row.append((str(format_number_with_commas(value)), {}))
+                    row.extend(('', {}) for _ in subs[1:])
             else:
-                if header_name == 'Description':
-                    if isinstance(value, list):
-                        p = row_cells[cell_index].add_paragraph()
-                        for item_desc in value:
-                            p.add_run(f"• {item_desc}\n")
-                        p.runs[0].font.name = 'Times New Roman'
-                    else:
-                        row_cells[cell_index].text = str(value)
-                else:
-                    formatted_value = format_number_with_commas(value)
-                    row_cells[cell_index].text = str(formatted_value)
-                row_cells[cell_index].vertical_alignment = WD_ALIGN_VERTICAL.CENTER
-                for paragraph in row_cells[cell_index].paragraphs:
-                    for run in paragraph.runs:
-                        run.font.name = 'Times New Roman'
-                cell_index += 1
+                row.append((_format_cell_value(header_name, value), {}))
+        rows.append(row)
+
+    add_table_rows(document, num_cols, rows)
 
 def process_text_with_subheadings(document, text):
     """Processes text to identify and format subheadings (text followed by colons) as bold, all on one line."""
@@ -370,8 +371,32 @@ def format_supply_demand_analysis(document, data):
             p = document.add_paragraph()
             p.add_run(str(section_content))
 
-def create_project_document_from_json(json_data, output_docx_path):
-    """Creates a Word document with information from the provided JSON data."""
+# The fixed part of every PC-1: title, page setup, fonts and the numbered section headers.
+# Each header is followed by a "{{key}}" placeholder paragraph that marks where its content goes.
+PC1_SECTIONS = [
+    ("overview", "1. Project Overview"),
+    ("agency", "2. Agency Information"),
+    ("timeline", "3. Project Timeline & Budget"),
+    ("details", "4. Project Details"),
+    ("risks", "5. Risks, Deliverables & Stakeholders"),
+    ("monitoring", "6. Monitoring & Sustainability"),
+    ("objectives", "7. Objectives"),
+    ("ict", "8. ICT Requirements"),
+    ("supply_demand", "9. Supply and Demand Analysis"),
+    ("capital_cost", "10. Capital Cost Estimates"),
+    ("maintenance", "11. Maintenance Costs"),
+    ("benefits", "12. Benefits"),
+    ("financial_plan", "13. Financial Plan Table"),
+    ("management", "14. Management Structure and Manpower"),
+    ("additional", "15. Additional Projects/Decisions"),
+    ("certification", "16. Certification"),
+]
+PC1_TEMPLATE_PATH = os.getenv("PC1_TEMPLATE_PATH")
+
+_base_template = None
+
+def build_base_template():
+    """Builds the PC-1 base document once and returns it as .docx bytes."""
     doc = Document()
 
     # Add "PC-1 FORM" heading at the top center
@@ -391,33 +416,139 @@ def create_project_document_from_json(json_data, output_docx_path):
     font = style.font
     font.name = 'Times New Roman'
     font.size = Pt(11)
+    get_table_style(doc)
+
+    for key, title in PC1_SECTIONS:
+        add_section_header(doc, title)
+        doc.add_paragraph(f"{{{{{key}}}}}")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def get_base_template():
+    """Returns the cached base template, loaded from PC1_TEMPLATE_PATH if set or built on first use."""
+    global _base_template
+    if _base_template is None:
+        if PC1_TEMPLATE_PATH:
+            with open(PC1_TEMPLATE_PATH, 'rb') as f:
+                _base_template = f.read()
+        else:
+            _base_template = build_base_template()
+    return _base_template
+
+def new_pc1_document():
+    """Returns a fresh copy of the base template to fill in."""
+    return Document(io.BytesIO(get_base_template()))
+
+class SectionWriter:
+    """Stands in for the Document while filling one section: everything added lands before its placeholder."""
+
+    def __init__(self, document, placeholder, style_ids=None):
+        self.document = document
+        self.placeholder = placeholder
+        self.style_ids = {} if style_ids is None else style_ids
+
+    @property
+    def styles(self):
+        return self.document.styles
+
+    def add_paragraph(self, text='', style=None):
+        paragraph = self.placeholder.insert_paragraph_before(text)
+        if style is not None:
+            paragraph._p.style = get_style_id(self, style)
+        return paragraph
+
+    def add_table(self, rows, cols, style=None):
+        table = self.document.add_table(rows, cols, style)
+        self.placeholder._p.addprevious(table._tbl)
+        return table
+
+def open_sections(document):
+    """Maps each section key to a SectionWriter positioned at its placeholder."""
+    placeholders = {f"{{{{{key}}}}}": key for key, _ in PC1_SECTIONS}
+    style_ids = {}
+    return {
+        placeholders[paragraph.text]: SectionWriter(document, paragraph, style_ids)
+        for paragraph in document.paragraphs if paragraph.text in placeholders
+    }
+
+def close_sections(sections):
+    """Removes the placeholder paragraphs once every section has been written."""
+    for writer in sections.values():
+        element = writer.placeholder._p
+        element.getparent().remove(element)
+
+SECTION_RENDERERS = {}
+
+def section_renderer(key, *variables):
+    """Registers the renderer of a PC-1 section together with the user_data variables it reads."""
+    def register(fn):
+        SECTION_RENDERERS[key] = (fn, variables)
+        return fn
+    return register
+
+def section_inputs(key, json_data):
+    """The slice of json_data a section's renderer is allowed to see."""
+    _, variables = SECTION_RENDERERS[key]
+    return {name: json_data[name] for name in variables if name in json_data}
+
+def section_fingerprints(json_data):
+    """Maps each section key to a hash of its inputs; a cached fragment is reusable while it matches."""
+    fingerprints = {}
+    for key, _ in PC1_SECTIONS:
+        payload = json.dumps(section_inputs(key, json_data), ensure_ascii=False, sort_keys=True,
+                             default=records.to_jsonable)
+        fingerprints[key] = hashlib.sha256(f"{key}\0{payload}".encode('utf-8')).hexdigest()
+    return fingerprints
+
+def render_section(section, key, json_data):
+    """Renders one section before its placeholder and returns the XML fragment it produced."""
+    renderer, _ = SECTION_RENDERERS[key]
+    boundary = section.placeholder._p.getprevious()
+    with metrics.section(key):
+        renderer(section, section_inputs(key, json_data))
+    elements = []
+    element = section.placeholder._p.getprevious()
+    while element is not boundary:
+        elements.append(element)
+        element = element.getprevious()
+    return ''.join(etree.tostring(element, encoding='unicode') for element in reversed(elements))
+
+def insert_fragment(section, fragment):
+    """Inserts a fragment produced by render_section before the section's placeholder."""
+    if not fragment:
+        return
+    for element in list(parse_xml(f'<w:fragment {nsdecls("w")}>{fragment}</w:fragment>')):
+        section.placeholder._p.addprevious(element)
+
 
-    project_data = json_data
 
-    # Add basic information sections
-    add_section_header(doc, "1. Project Overview")
-    p = doc.add_paragraph()
+@section_renderer("overview", "projectName", "districtName", "sector")
+def render_overview(section, project_data):
+    p = section.add_paragraph()
     run1 = p.add_run("Project Name: ")
     run1.font.name = 'Times New Roman'
     run1.bold = True
     run2 = p.add_run(f"{project_data.get('projectName', 'N/A')}")
     run2.font.name = 'Times New Roman'
 
-    p = doc.add_paragraph()
+    p = section.add_paragraph()
     run1 = p.add_run("District: ")
     run1.font.name = 'Times New Roman'
     run1.bold = True
     run2 = p.add_run(f"{project_data.get('districtName', 'N/A')}")
     run2.font.name = 'Times New Roman'
 
-    p = doc.add_paragraph()
+    p = section.add_paragraph()
     run1 = p.add_run("Sector: ")
     run1.font.name = 'Times New Roman'
     run1.bold = True
     run2 = p.add_run(f"{project_data.get('sector', 'N/A')}")
     run2.font.name = 'Times New Roman'
 
-    add_section_header(doc, "2. Agency Information")
+@section_renderer("agency", "sponsAgency", "opAgency", "exeAgency", "maintAgency", "isProvincial", "federalMinistry")
+def render_agency(section, project_data):
     agency_info = [
         {"Sponsoring Agency": project_data.get("sponsAgency", "N/A"),
          "Operating Agency": project_data.get("opAgency", "N/A"),
@@ -426,60 +557,67 @@ def create_project_document_from_json(json_data, output_docx_path):
         {"Is Provincial": project_data.get("isProvincial", "N/A"),
          "Federal Ministry": project_data.get("federalMinistry", "N/A")}
     ]
-    create_table(doc, list(agency_info[0].keys()), [agency_info[0]])
-    create_table(doc, list(agency_info[1].keys()), [agency_info[1]])
+    create_table(section, list(agency_info[0].keys()), [agency_info[0]])
+    create_table(section, list(agency_info[1].keys()), [agency_info[1]])
 
-    add_section_header(doc, "3. Project Timeline & Budget")
+@section_renderer("timeline", "budget", "duration", "startDate", "endDate")
+def render_timeline(section, project_data):
     timeline_budget = [
         {"Budget": project_data.get("budget", "N/A"),
          "Duration (months)": project_data.get("duration", "N/A"),
          "Start Date": project_data.get("startDate", "N/A"),
          "End Date": project_data.get("endDate", "N/A")}
     ]
-    create_table(doc, list(timeline_budget[0].keys()), timeline_budget)
-
-    add_section_header(doc, "4. Project Details")
-    process_text_with_subheadings(doc, f"Scope: {project_data.get('scope', 'N/A')}")
-    process_text_with_subheadings(doc, f"Location: {project_data.get('location', 'N/A')}")
-    process_text_with_subheadings(doc, f"Feasibility Study Completed: {project_data.get('feasibilityStudy', 'N/A')}")
-    process_text_with_subheadings(doc, f"Design Finalized: {project_data.get('designFinalized', 'N/A')}")
-    process_text_with_subheadings(doc, f"Technology: {project_data.get('technology', 'N/A')}")
-    process_text_with_subheadings(doc, f"Capacity: {project_data.get('capacity', 'N/A')}")
-    process_text_with_subheadings(doc, f"Phases: {project_data.get('phases', 'N/A')}")
-
-    add_section_header(doc, "5. Risks, Deliverables & Stakeholders")
-    process_text_with_subheadings(doc, f"Risks: {project_data.get('risks', 'N/A')}")
-    process_text_with_subheadings(doc, f"Deliverables: {project_data.get('deliverables', 'N/A')}")
-    process_text_with_subheadings(doc, f"Stakeholders: {project_data.get('stakeholders', 'N/A')}")
-
-    add_section_header(doc, "6. Monitoring & Sustainability")
-    process_text_with_subheadings(doc, f"Monitoring Plan: {project_data.get('monitoringPlan', 'N/A')}")
-    process_text_with_subheadings(doc, f"Sustainability Measures: {project_data.get('sustainabilityMeasures', 'N/A')}")
-
-    add_section_header(doc, "7. Objectives")
-    process_text_with_subheadings(doc, project_data.get("Objectives", "N/A"))
-
-    add_section_header(doc, "8. ICT Requirements")
+    create_table(section, list(timeline_budget[0].keys()), timeline_budget)
+
+@section_renderer("details", "scope", "location", "feasibilityStudy", "designFinalized", "technology", "capacity", "phases")
+def render_details(section, project_data):
+    process_text_with_subheadings(section, f"Scope: {project_data.get('scope', 'N/A')}")
+    process_text_with_subheadings(section, f"Location: {project_data.get('location', 'N/A')}")
+    process_text_with_subheadings(section, f"Feasibility Study Completed: {project_data.get('feasibilityStudy', 'N/A')}")
+    process_text_with_subheadings(section, f"Design Finalized: {project_data.get('designFinalized', 'N/A')}")
+    process_text_with_subheadings(section, f"Technology: {project_data.get('technology', 'N/A')}")
+    process_text_with_subheadings(section, f"Capacity: {project_data.get('capacity', 'N/A')}")
+    process_text_with_subheadings(section, f"Phases: {project_data.get('phases', 'N/A')}")
+
+@section_renderer("risks", "risks", "deliverables", "stakeholders")
+def render_risks(section, project_data):
+    process_text_with_subheadings(section, f"Risks: {project_data.get('risks', 'N/A')}")
+    process_text_with_subheadings(section, f"Deliverables: {project_data.get('deliverables', 'N/A')}")
+    process_text_with_subheadings(section, f"Stakeholders: {project_data.get('stakeholders', 'N/A')}")
+
+@section_renderer("monitoring", "monitoringPlan", "sustainabilityMeasures")
+def render_monitoring(section, project_data):
+    process_text_with_subheadings(section, f"Monitoring Plan: {project_data.get('monitoringPlan', 'N/A')}")
+    process_text_with_subheadings(section, f"Sustainability Measures: {project_data.get('sustainabilityMeasures', 'N/A')}")
+
+@section_renderer("objectives", "Objectives")
+def render_objectives(section, project_data):
+    process_text_with_subheadings(section, project_data.get("Objectives", "N/A"))
+
+@section_renderer("ict", "ICT-Reqs")
+def render_ict(section, project_data):
     ict_reqs = project_data.get("ICT-Reqs", "N/A")
     if isinstance(ict_reqs, dict):
-        process_ict_requirements(doc, ict_reqs)
+        process_ict_requirements(section, ict_reqs)
     elif isinstance(ict_reqs, str):
         ict_reqs = ict_reqs.replace('**', '').replace('*', '')
         # Try to parse as JSON if it's a string that might contain JSON
         try:
             ict_data = json.loads(ict_reqs)
-            process_ict_requirements(doc, ict_data)
+            process_ict_requirements(section, ict_data)
         except json.JSONDecodeError:
             # Process as plain text if not JSON
             lines = ict_reqs.split('\n')
             for line in lines:
                 line = line.strip()
                 if line:
-                    process_ict_requirements(doc, line)
+                    process_ict_requirements(section, line)
     else:
-        process_ict_requirements(doc, str(ict_reqs))
+        process_ict_requirements(section, str(ict_reqs))
 
-    add_section_header(doc, "9. Supply and Demand Analysis")
+@section_renderer("supply_demand", "Supply and Demand")
+def render_supply_demand(section, project_data):
     supply_demand = project_data.get("Supply and Demand", {})
     if isinstance(supply_demand, str) and supply_demand.startswith("Download\n"):
         try:
@@ -487,157 +625,148 @@ def create_project_document_from_json(json_data, output_docx_path):
         except json.JSONDecodeError:
             pass  # Keep as string if can't parse
 
-    format_supply_demand_analysis(doc, supply_demand)
+    format_supply_demand_analysis(section, supply_demand)
 
-    # --- Process Capital Cost Estimates ---
-    add_section_header(doc, "10. Capital Cost Estimates")
-    capital_cost_estimates = project_data.get("capitalCostEstimates", "")
-
-    if isinstance(capital_cost_estimates, str) and capital_cost_estimates.startswith("Download\n"):
-        capital_cost_data = json.loads(capital_cost_estimates.replace("Download\n", ""))
-    elif isinstance(capital_cost_estimates, dict):
-        capital_cost_data = capital_cost_estimates
-    else:
-        capital_cost_data = {}
-
-    if isinstance(capital_cost_data, dict) and 'capitalCost' in capital_cost_data:
-        for cost_section in capital_cost_data['capitalCost']:
-            add_bold_subheading(doc, cost_section.get('name', ''))
-            process_text_with_subheadings(doc, cost_section.get('description', ''))
-            if 'data' in cost_section and cost_section['data']:
-                first_data_item = cost_section['data'][0]
-                has_subheaders = any(isinstance(value, dict) for value in first_data_item.values())
-
-                if has_subheaders:
-                    main_headers = []
-                    subheaders = []
-                    for key, value in first_data_item.items():
-                        if isinstance(value, dict):
-                            main_headers.append(key)
-                            subheaders.append(list(value.keys()))
-                        else:
-                            main_headers.append(key)
-                            subheaders.append(None)
-                    create_table_with_subcolumns(doc, main_headers, cost_section['data'],
-                                                subheaders=subheaders)
-                else:
-                    headers = list(cost_section['data'][0].keys()) if cost_section['data'] else []
-                    create_table(doc, headers, cost_section['data'])
+# --- Process Capital Cost Estimates ---
+@section_renderer("capital_cost", "capitalCostEstimates")
+def render_capital_cost(section, project_data):
+    capital_cost = records.coerce("capitalCostEstimates", project_data.get("capitalCostEstimates"))
+    if capital_cost is None:
+        return
 
-    # --- Process Maintenance Costs ---
-    add_section_header(doc, "11. Maintenance Costs")
+    for table in capital_cost.tables:
+        add_bold_subheading(section, table.name)
+        process_text_with_subheadings(section, table.description)
+        if table.subheaders:
+            create_table_with_subcolumns(section, table.headers, table.rows, subheaders=table.subheaders)
+        elif table.rows:
+            create_table(section, table.headers, table.rows)
+
+# --- Process Maintenance Costs ---
+@section_renderer("maintenance", "maintenanceCosts")
+def render_maintenance(section, project_data):
+    maintenance_costs = records.coerce("maintenanceCosts", project_data.get("maintenanceCosts"))
+    if maintenance_costs is None:
+        return
 
-    maintenance_costs = project_data.get("maintenanceCosts", "")
-    if isinstance(maintenance_costs, str) and maintenance_costs.startswith("Download\n"):
-        try:
-            maintenance_costs_data = json.loads(maintenance_costs.replace("Download\n", ""))
-        except json.JSONDecodeError:
-            maintenance_costs_data = {}
-    elif isinstance(maintenance_costs, dict):
-        maintenance_costs_data = maintenance_costs
+    if maintenance_costs.kind == "financialPlan":
+        add_bold_subheading(section, "Financial Plan:")
+        label_header = "Year"
     else:
-        maintenance_costs_data = {}
-
-    if isinstance(maintenance_costs_data, dict):
-        if 'financialPlan' in maintenance_costs_data and maintenance_costs_data['financialPlan']:
-            add_bold_subheading(doc, "Financial Plan:")
-            table_data = []
-            for item in maintenance_costs_data['financialPlan']:
-                for key, value in item.items():
-                    if "Year" in key or "Total Cost" in key:
-                        year_part = key
-                        cost_part = value
-                        table_data.append({"Year": year_part, "Amount (Rs. in million)": cost_part})
-            if table_data:
-                headers = ["Year", "Amount (Rs. in million)"]
-                create_table(doc, headers, table_data)
-
-        elif 'operations' in maintenance_costs_data and maintenance_costs_data['operations']:
-            add_bold_subheading(doc, "Operations Costs:")
-            operations_data = [
-                {"Description": d, "Amount (Rs. in million)": a}
-                for d, a in zip(
-                    maintenance_costs_data['operations'].get('description', []),
-                    maintenance_costs_data['operations'].get('Amount', [])
-                )
-            ]
-            if operations_data:
-                headers = ["Description", "Amount (Rs. in million)"]
-                create_table(doc, headers, operations_data)
-
-    add_section_header(doc, "12. Benefits")
-
-    benefits = project_data.get("benefits", "")
-    if isinstance(benefits, str) and benefits.startswith("Download\n"):
-        try:
-            benefits_data = json.loads(benefits.replace("Download\n", ""))
-        except json.JSONDecodeError:
-            benefits_data = {}
-    elif isinstance(benefits, dict):
-        benefits_data = benefits
-    else:
-        benefits_data = {}
-
-    if isinstance(benefits_data, dict) and 'project_components' in benefits_data:
-        add_bold_subheading(doc, "Project Components:")
-        headers = [
-            "S.No.", "Input", "Component", "Units",
-            "Year 1 Amount", "Year 1 Division",
-            "Year 2 Amount", "Year 2 Division",
-            "Year 3 Amount", "Year 3 Division",
-            "Baseline Indicator", "Post Completion Targets",
-            "Key Benefits"
-        ]
-        table_data = []
-        for item in benefits_data['project_components']:
-            table_data.append({
-                "S.No.": item.get('serial_number', ''),
-                "Input": item.get('input', ''),
-                "Component": item.get('outcome', {}).get('component_name', ''),
-                "Units": item.get('outcome', {}).get('units', ''),
-                "Year 1 Amount": item.get('year_wise_phasing', {}).get('year_1', {}).get('amount', ''),
-                "Year 1 Division": item.get('year_wise_phasing', {}).get('year_1', {}).get(
-                    'division_of_total_items', ''),
-                "Year 2 Amount": item.get('year_wise_phasing', {}).get('year_2', {}).get('amount', ''),
-                "Year 2 Division": item.get('year_wise_phasing', {}).get('year_2', {}).get(
-                    'division_of_total_items', ''),
-                "Year 3 Amount": item.get('year_wise_phasing', {}).get('year_3', {}).get('amount', ''),
-                "Year 3 Division": item.get('year_wise_phasing', {}).get('year_3', {}).get(
-                    'division_of_total_items', ''),
-                "Baseline Indicator": item.get('outcome_metrics', {}).get('baseline_indicator', ''),
-                "Post Completion Targets": item.get('targeted_impact', {}).get(
-                    'post_completion_targets', ''),
-                "Key Benefits": item.get('impact_details', {}).get('key_benefits', '')
-            })
-        create_table(doc, headers, table_data)
-
-    add_section_header(doc, "13. Financial Plan Table")
+        add_bold_subheading(section, "Operations Costs:")
+        label_header = "Description"
+    if maintenance_costs.entries:
+        headers = [label_header, "Amount (Rs. in million)"]
+        table_data = [{label_header: entry.label, "Amount (Rs. in million)": entry.amount}
+                      for entry in maintenance_costs.entries]
+        create_table(section, headers, table_data)
+
+@section_renderer("benefits", "benefits")
+def render_benefits(section, project_data):
+    benefits = records.coerce("benefits", project_data.get("benefits"))
+    if benefits is None:
+        return
+
+    add_bold_subheading(section, "Project Components:")
+    headers = [
+        "S.No.", "Input", "Component", "Units",
+        "Year 1 Amount", "Year 1 Division",
+        "Year 2 Amount", "Year 2 Division",
+        "Year 3 Amount", "Year 3 Division",
+        "Baseline Indicator", "Post Completion Targets",
+        "Key Benefits"
+    ]
+    table_data = []
+    for component in benefits.components:
+        year_1, year_2, year_3 = component.years
+        table_data.append({
+            "S.No.": component.serial_number,
+            "Input": component.input,
+            "Component": component.component_name,
+            "Units": component.units,
+            "Year 1 Amount": year_1.amount,
+            "Year 1 Division": year_1.division_of_total_items,
+            "Year 2 Amount": year_2.amount,
+            "Year 2 Division": year_2.division_of_total_items,
+            "Year 3 Amount": year_3.amount,
+            "Year 3 Division": year_3.division_of_total_items,
+            "Baseline Indicator": component.baseline_indicator,
+            "Post Completion Targets": component.post_completion_targets,
+            "Key Benefits": component.key_benefits
+        })
+    create_table(section, headers, table_data)
+
+@section_renderer("financial_plan", "financialPlanTable")
+def render_financial_plan(section, project_data):
     financial_plan_table = project_data.get("financialPlanTable", {})
     if isinstance(financial_plan_table, dict):
         financial_plan_data = financial_plan_table.get("financialPlan", [])
         if financial_plan_data:
             headers = list(financial_plan_data[0].keys()) if financial_plan_data else []
-            create_table(doc, headers, financial_plan_data)
+            create_table(section, headers, financial_plan_data)
         else:
-            process_text_with_subheadings(doc, json.dumps(financial_plan_table, indent=2))
+            process_text_with_subheadings(section, json.dumps(financial_plan_table, indent=2))
     elif isinstance(financial_plan_table, str):
-        process_text_with_subheadings(doc, financial_plan_table)
+        process_text_with_subheadings(section, financial_plan_table)
     else:
-        process_text_with_subheadings(doc, str(financial_plan_table))
+        process_text_with_subheadings(section, str(financial_plan_table))
 
-    add_section_header(doc, "14. Management Structure and Manpower")
-    process_text_with_subheadings(doc, project_data.get("managementStructure", "N/A"))
+@section_renderer("management", "managementStructure")
+def render_management(section, project_data):
+    process_text_with_subheadings(section, project_data.get("managementStructure", "N/A"))
 
-    add_section_header(doc, "15. Additional Projects/Decisions")
-    process_text_with_subheadings(doc, project_data.get("additionalProjects", "N/A"))
+@section_renderer("additional", "additionalProjects")
+def render_additional(section, project_data):
+    process_text_with_subheadings(section, project_data.get("additionalProjects", "N/A"))
 
-    add_section_header(doc, "16. Certification")
-    process_text_with_subheadings(doc,
+@section_renderer("certification", "prepared_by", "checked_by", "approved_by")
+def render_certification(section, project_data):
+    process_text_with_subheadings(section,
                                     "Certified that the project proposal has been prepared...")  # Add full certification text as needed
-    process_text_with_subheadings(doc, f"Prepared by: {project_data.get('prepared_by', 'N/A')}")
-    process_text_with_subheadings(doc, f"Checked by: {project_data.get('checked_by', 'N/A')}")
-    process_text_with_subheadings(doc, f"Approved by: {project_data.get('approved_by', 'N/A')}")
+    process_text_with_subheadings(section, f"Prepared by: {project_data.get('prepared_by', 'N/A')}")
+    process_text_with_subheadings(section, f"Checked by: {project_data.get('checked_by', 'N/A')}")
+    process_text_with_subheadings(section, f"Approved by: {project_data.get('approved_by', 'N/A')}")
+
+def render_fragments(json_data, keys=None):
+    """Renders the given sections (all by default) and returns their XML fragments by key."""
+    sections = open_sections(new_pc1_document())
+    keys = [key for key, _ in PC1_SECTIONS] if keys is None else keys
+    return {key: render_section(sections[key], key, json_data) for key in keys}
+
+def assemble_document(json_data, fragments=None):
+    """Builds the document from cached fragments, rendering only the sections missing from `fragments`.
+
+    Returns the .docx bytes and the fragments that had to be rendered.
+    """
+    doc = new_pc1_document()
+    sections = open_sections(doc)
+    fragments = fragments or {}
+    rendered = {}
+    for key, _ in PC1_SECTIONS:
+        if key in fragments:
+            insert_fragment(sections[key], fragments[key])
+        else:
+            rendered[key] = render_section(sections[key], key, json_data)
+    close_sections(sections)
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue(), rendered
+
+def create_project_document_from_json(json_data, output_docx_path=None):
+    """Creates a Word document with information from the provided JSON data.
+
+    output_docx_path may be a file path or a writable file-like object; when it
+    is None the document is returned as bytes instead of being saved.
+    """
+    content, _ = assemble_document(json_data)
 
     # Save the document
-    doc.save(output_docx_path)
-    print(f"Document generated successfully at: {output_docx_path}")
+    if output_docx_path is None:
+        return content
+    if isinstance(output_docx_path, str):
+        with open(output_docx_path, 'wb') as f:
+            f.write(content)
+        print(f"Document generated successfully at: {output_docx_path}")
+    else:
+        output_docx_path.write(content)
@@ -0,0 +1,172 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import records
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+START_STATE = "q1"
+
+@dataclass
+class Session:
+    session_id: str
+    current_state: Optional[str] = START_STATE
+    user_data: Dict = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+
+class MemorySessionBackend:
+    """LRU store that keeps at most max_sessions sessions and drops idle ones after ttl seconds."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.updated_at > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def save(self, session: Session):
+        session.updated_at = time.time()
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+class SQLiteSessionBackend:
+    """Sessions persisted in a SQLite file, so they survive restarts and can be shared by workers."""
+
+    def __init__(self, path: str = "sessions.db", max_sessions: int = MAX_SESSIONS, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, current_state TEXT, user_data TEXT, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    def load(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT current_state, user_data, updated_at FROM sessions WHERE session_id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        return Session(session_id, row[0], json.loads(row[1]), row[2])
+
+    def save(self, session: Session):
+        session.updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                (session.session_id, session.current_state,
+                 json.dumps(session.user_data, ensure_ascii=False, default=records.to_jsonable),
+                 session.updated_at)
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_id NOT IN "
+                "(SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT ?)",
+                (self.max_sessions,)
+            )
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+class SessionStore:
+    """Issues session ids and hands out one asyncio lock per live session.
+
+    It also tracks the cancel events of the prompt batches running for each
+    session, so a client can stop work it no longer wants.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._locks = weakref.WeakValueDictionary()
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def create(self) -> Session:
+        session = Session(session_id=uuid.uuid4().hex)
+        self.backend.save(session)
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        if not session_id:
+            return None
+        return self.backend.load(session_id)
+
+    def save(self, session: Session):
+        self.backend.save(session)
+
+    def reset(self, session: Session):
+        session.current_state = START_STATE
+        session.user_data = {}
+        self.backend.save(session)
+
+    def delete(self, session_id: str):
+        self.backend.delete(session_id)
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    @contextlib.contextmanager
+    def running(self, session_id: str, cancel_event: threading.Event):
+        """Register cancel_event for the duration of a prompt batch on the session."""
+        with self._running_lock:
+            self._running.setdefault(session_id, set()).add(cancel_event)
+        try:
+            yield cancel_event
+        finally:
+            with self._running_lock:
+                events = self._running.get(session_id)
+                events.discard(cancel_event)
+                if not events:
+                    del self._running[session_id]
+
+    def cancel(self, session_id: str) -> int:
+        """Cancel every prompt batch running or waiting for the session; returns how many."""
+        with self._running_lock:
+            events = list(self._running.get(session_id, ()))
+        for event in events:
+            event.set()
+        return len(events)
+
+def create_session_store() -> SessionStore:
+    """Build the store selected by SESSION_BACKEND ("memory" or "sqlite")."""
+    if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+        return SessionStore(SQLiteSessionBackend(os.getenv("SESSION_DB", "sessions.db")))
+    return SessionStore(MemorySessionBackend())
@@ -0,0 +1,65 @@
+import os
+import sys
+
+# Modules read their settings at import time; keep tests off the network and the shared on-disk caches
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("LLM_RATE_LIMITS", "0")
+os.environ.setdefault("PREFETCH_PROMPTS", "0")
+os.environ.setdefault("RENDER_WORKERS", "1")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+class FakeStream:
+    """Iterates like a Groq completion stream, one content chunk per item."""
+
+    def __init__(self, parts, total_tokens=None):
+        self.parts = list(parts)
+        self.total_tokens = total_tokens
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], x_groq=None)
+        if self.total_tokens is not None:
+            usage = SimpleNamespace(total_tokens=self.total_tokens)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=""))],
+                                  x_groq=SimpleNamespace(usage=usage))
+
+    def close(self):
+        self.closed = True
+
+class FakeLLM:
+    """Stands in for the Groq client. respond(prompt, kwargs) returns the chunks to stream or raises."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        with self._lock:
+            self.calls.append(kwargs)
+        result = self.respond(prompt, kwargs)
+        return result if isinstance(result, FakeStream) else FakeStream(result)
+
+    def prompts(self):
+        with self._lock:
+            return [call["messages"][-1]["content"] for call in self.calls]
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Install a FakeLLM answering every prompt with "ok"; set .respond to change that."""
+    import llm_client
+    llm = FakeLLM(lambda prompt, kwargs: ["ok"])
+    monkeypatch.setattr(llm_client, "get_client", lambda: llm)
+    return llm
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import FakeStream
+
+ANSWERS = {"projectName": "Smart Schools", "districtName": "Lahore", "sector": "Education"}
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def session(client):
+    session_id = client.post("/start").json()["session_id"]
+    return {"X-Session-Id": session_id}
+
+def test_generate_docx_keeps_its_json_contract(client, session):
+    response = client.post("/generate-docx", headers=session)
+    assert response.status_code == 200
+    assert response.json() == {"message": "Word document generated ✅", "filename": "PC1_Output.docx"}
+
+def test_download_docx_streams_the_sessions_document(client, session):
+    client.post("/submit-answers", headers=session, json={"answers": ANSWERS})
+    response = client.get("/download-docx", headers=session)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.DOCX_MEDIA_TYPE
+    assert response.content[:2] == b"PK"
+    assert int(response.headers["content-length"]) == len(response.content)
+
+def test_generate_json_keeps_its_contract_and_returns_the_data(client, session):
+    client.post("/submit-answers", headers=session, json={"answers": ANSWERS})
+    body = client.post("/generate-json", headers=session).json()
+    assert body["message"] == "JSON file generated ✅"
+    assert body["filename"] == "PC1_Output.json"
+    assert body["user_data"] == ANSWERS
+
+def test_user_data_is_copied_once_running_prompts_release_the_session():
+    session = main.session_store.create()
+
+    async def copy_while_prompts_run():
+        async with main.session_store.lock(session.session_id):
+            copy = asyncio.create_task(main.snapshot_user_data(session.session_id))
+            await asyncio.sleep(0.05)
+            assert not copy.done()
+            session.user_data["Objectives"] = "filled"
+        return await copy
+
+    assert asyncio.run(copy_while_prompts_run()) == {"Objectives": "filled"}
+
+def test_unknown_session_is_rejected(client):
+    assert client.post("/generate-docx", headers={"X-Session-Id": "nope"}).status_code == 404
+
+class SlowStream(FakeStream):
+    """A completion that would take ten seconds to finish."""
+
+    def __iter__(self):
+        for chunk in FakeStream(["word "]):
+            for _ in range(200):
+                time.sleep(0.05)
+                yield chunk
+
+def test_client_disconnect_cancels_the_prompts(fake_llm, monkeypatch):
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.05)
+    streams = []
+
+    def respond(prompt, kwargs):
+        streams.append(SlowStream([]))
+        return streams[-1]
+
+    fake_llm.respond = respond
+    session = main.session_store.create()
+    session.current_state = "q24"
+    main.session_store.save(session)
+    body = json.dumps({"answers": {}, "bypass_cache": True}).encode()
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": "/submit-answers", "raw_path": b"/submit-answers", "query_string": b"",
+             "root_path": "", "client": ("testclient", 50000), "server": ("testserver", 80),
+             "headers": [(b"content-type", b"application/json"), (b"x-session-id", session.session_id.encode())]}
+    sent = []
+
+    async def request():
+        disconnect_at = time.monotonic() + 0.5
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The client drops half a second in; until then there's nothing to read
+            if time.monotonic() < disconnect_at:
+                await asyncio.sleep(disconnect_at - time.monotonic())
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(main.app(scope, receive, send), timeout=5)
+
+    started = time.monotonic()
+    asyncio.run(request())
+    assert time.monotonic() - started < 5
+    assert len(streams) == 1 and streams[0].closed
+    assert json.loads(sent[-1]["body"])["cancelled"] is True
+    assert main.session_store.get(session.session_id).current_state == "q24"
+
+def test_requests_are_timed_and_profiled_on_request(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(main.metrics, "PROFILE_REQUESTS", True)
+    monkeypatch.setattr(main.metrics, "PROFILE_DIR", str(tmp_path))
+    response = client.post("/start", headers={"X-Profile": "cprofile"})
+    assert response.status_code == 200
+    assert response.headers["x-profile-report"].startswith(str(tmp_path))
+    assert "x-profile-report" not in client.post("/start").headers
+    exposition = client.get("/metrics").text
+    assert 'pc1_http_request_seconds_count{method="POST",route="/start"}' in exposition
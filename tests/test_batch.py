@@ -0,0 +1,90 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+import batch
+import ver2
+
+@pytest.fixture
+def states():
+    return ver2.compile_state_machine("state_machine.csv")
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Answer every prompt with text; projects named in .failing get an error on every prompt field."""
+
+    def run_prompt_actions(state, user_data, limiter=None, **kwargs):
+        prompts.runs.append((user_data.get("projectName"), state.name))
+        for field in state.promptFields:
+            user_data[field] = "text"
+        if user_data.get("projectName") in prompts.failing:
+            return {field: ["status 503"] for field in state.promptFields}
+        return {}
+
+    prompts.runs = []
+    prompts.failing = set()
+    monkeypatch.setattr(batch.ver2, "run_prompt_actions", run_prompt_actions)
+    return prompts
+
+class FakeRenderService:
+    def __init__(self, workers=1):
+        pass
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def render_document(self, user_data):
+        future = Future()
+        future.set_result(b"PK docx")
+        return future
+
+def test_minimal_row_walks_to_the_last_state_with_the_branch_defaults(states, prompts):
+    user_data, field_errors = batch.walk_states(states, {"projectName": "Schools"})
+    assert field_errors == {}
+    assert user_data["isProvincial"] == "False"
+    assert user_data["sector"] == batch.MISSING_ANSWER
+    assert [state for _, state in prompts.runs][-1] == "q34"
+
+def test_undecided_branch_fails_the_walk(states, prompts):
+    with pytest.raises(ValueError, match=r"state 'q6' matches isProvincial='maybe'"):
+        batch.walk_states(states, {"projectName": "Schools", "isProvincial": "maybe"})
+
+def test_rows_must_answer_branches_without_a_default(states, monkeypatch):
+    monkeypatch.setattr(batch, "ANSWER_DEFAULTS", {})
+    assert batch.check_row(states, {"projectName": "Schools"}) == ["isProvincial"]
+    assert batch.check_row(states, {"isProvincial": "yes"}) == []
+
+def test_rerun_retries_partial_and_failed_projects_only(tmp_path, prompts, monkeypatch):
+    monkeypatch.setattr(batch.render_service, "RenderService", FakeRenderService)
+    manifest = tmp_path / "projects.jsonl"
+    rows = [{"projectName": "Roads", "isProvincial": "no"}, {"projectName": "Schools"},
+            {"projectName": "Clinics", "isProvincial": "maybe"}]
+    manifest.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    out_dir = str(tmp_path / "drafts")
+
+    prompts.failing = {"Schools"}
+    assert batch.run_batch(str(manifest), out_dir, projects=1) == {"done": 1, "partial": 1, "failed": 1,
+                                                                   "skipped": 0}
+    entries = [json.loads(line) for line in (tmp_path / "drafts" / "checkpoint.jsonl").read_text().splitlines()]
+    status = {entry["projectName"]: entry["status"] for entry in entries}
+    assert status == {"Roads": "done", "Schools": "partial", "Clinics": "failed"}
+    assert "q6" in next(entry["error"] for entry in entries if entry["status"] == "failed")
+
+    prompts.failing = set()
+    prompts.runs = []
+    assert batch.run_batch(str(manifest), out_dir, projects=1) == {"done": 1, "partial": 0, "failed": 1,
+                                                                   "skipped": 1}
+    assert {name for name, _ in prompts.runs} == {"Schools", "Clinics"}
+
+    prompts.runs = []
+    assert batch.run_batch(str(manifest), out_dir, projects=1)["skipped"] == 2
+    assert {name for name, _ in prompts.runs} == {"Clinics"}
+
+def test_checkpoint_ignores_a_line_cut_short(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_text('{"key": "a", "status": "done"}\n{"key": "b", "status": "partial"}\n{"key": "c", "sta')
+    assert batch.Checkpoint(str(path)).done == {"a"}
@@ -0,0 +1,79 @@
+import asyncio
+import io
+
+import docx
+import pytest
+
+import render_service
+import sample2
+
+USER_DATA = {"projectName": "Smart Schools", "districtName": "Lahore", "sector": "Education", "budget": "500",
+             "risks": "Delays", "prepared_by": "A"}
+
+def sections_reading(name):
+    return {key for key, (_, variables) in sample2.SECTION_RENDERERS.items() if name in variables}
+
+def changed_sections(before, after):
+    return {key for key in before if before[key] != after[key]}
+
+def test_fingerprints_change_only_for_sections_reading_the_answer():
+    before = sample2.section_fingerprints(USER_DATA)
+    after = sample2.section_fingerprints({**USER_DATA, "risks": "Floods"})
+    assert changed_sections(before, after) == sections_reading("risks")
+    assert sections_reading("risks")
+
+def test_answers_no_section_reads_change_nothing():
+    before = sample2.section_fingerprints(USER_DATA)
+    assert sample2.section_fingerprints({**USER_DATA, "unrelated": "x"}) == before
+
+def test_fresh_and_stale_follow_fingerprints():
+    cache = render_service.FragmentCache()
+    fingerprints = {"a": "1", "b": "2"}
+    assert cache.stale("s", fingerprints) == ["a", "b"]
+    cache.store("s", fingerprints, {"a": "<a/>", "b": "<b/>"})
+    assert cache.fresh("s", {"a": "1", "b": "3"}) == {"a": "<a/>"}
+    assert cache.stale("s", {"a": "1", "b": "3"}) == ["b"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_document_is_reused_only_for_identical_fingerprints():
+    cache = render_service.FragmentCache()
+    cache.store_document("s", {"a": "1"}, b"doc")
+    assert cache.document("s", {"a": "1"}) == b"doc"
+    assert cache.document("s", {"a": "2"}) is None
+    assert cache.document("other", {"a": "1"}) is None
+
+def test_sessions_are_kept_separately_and_forgotten():
+    cache = render_service.FragmentCache(max_sessions=2)
+    for session_id in ("s1", "s2", "s3"):
+        cache.store(session_id, {"a": "1"}, {"a": session_id})
+    assert cache.fresh("s1", {"a": "1"}) == {}
+    assert cache.fresh("s3", {"a": "1"}) == {"a": "s3"}
+    cache.forget("s3")
+    assert cache.fresh("s3", {"a": "1"}) == {}
+
+def text_of(content: bytes) -> str:
+    return "\n".join(paragraph.text for paragraph in docx.Document(io.BytesIO(content)).paragraphs)
+
+def test_document_from_fragments_matches_a_full_render():
+    full, rendered = sample2.assemble_document(USER_DATA)
+    assert set(rendered) == {key for key, _ in sample2.PC1_SECTIONS}
+    fragments = sample2.render_fragments(USER_DATA)
+    assembled, rendered = sample2.assemble_document(USER_DATA, fragments)
+    assert rendered == {}
+    assert text_of(assembled) == text_of(full)
+
+@pytest.fixture(scope="module")
+def renderer():
+    service = render_service.RenderService(workers=1)
+    service.start()
+    yield service
+    service.shutdown()
+
+def test_changed_answer_rerenders_only_its_sections(renderer):
+    first = asyncio.run(renderer.render(USER_DATA, "session"))
+    hits = renderer.fragments.hits
+    changed = {**USER_DATA, "risks": "Floods"}
+    second = asyncio.run(renderer.render(changed, "session"))
+    assert renderer.fragments.hits - hits == len(sample2.PC1_SECTIONS) - len(sections_reading("risks"))
+    assert "Floods" in text_of(second) and "Floods" not in text_of(first)
+    assert text_of(second) == text_of(sample2.assemble_document(changed)[0])
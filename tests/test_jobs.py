@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import jobs
+import main
+from conftest import FakeStream
+
+async def settle(*job_list):
+    while not all(job.finished for job in job_list):
+        await asyncio.sleep(0.01)
+
+def test_cancelled_queued_job_never_starts():
+    async def run():
+        manager = jobs.JobManager(max_workers=1)
+        release = asyncio.Event()
+        started = []
+
+        async def work(job, name):
+            started.append(name)
+            await release.wait()
+            return name
+
+        first = manager.submit("test", work, "first")
+        second = manager.submit("test", work, "second")
+        await asyncio.sleep(0.05)
+        assert (first.status, second.status) == ("running", "queued")
+        assert manager.cancel(second)
+        release.set()
+        await settle(first, second)
+        return first, second, started
+
+    first, second, started = asyncio.run(run())
+    assert (first.status, first.result) == ("done", "first")
+    assert second.status == "cancelled" and second.started_at is None
+    assert started == ["first"]
+
+def test_cancelled_running_job_finishes_with_what_it_has():
+    async def run():
+        manager = jobs.JobManager()
+
+        async def work(job):
+            while not job.cancel_event.is_set():
+                await asyncio.sleep(0.01)
+            return {"fields": ["Objectives"]}
+
+        job = manager.submit("test", work)
+        await asyncio.sleep(0.05)
+        assert manager.cancel(job)
+        await settle(job)
+        assert not manager.cancel(job)
+        return job
+
+    job = asyncio.run(run())
+    assert (job.status, job.result) == ("cancelled", {"fields": ["Objectives"]})
+
+def test_failed_job_keeps_the_error():
+    async def run():
+        manager = jobs.JobManager()
+
+        async def work(job):
+            raise ValueError("boom")
+
+        job = manager.submit("test", work)
+        await settle(job)
+        return job
+
+    job = asyncio.run(run())
+    assert (job.status, job.error) == ("failed", "boom")
+
+def test_oldest_finished_jobs_are_evicted_and_running_ones_kept():
+    async def run():
+        manager = jobs.JobManager(max_jobs=2)
+        release = asyncio.Event()
+
+        async def wait(job):
+            await release.wait()
+
+        async def done(job):
+            return "done"
+
+        running = manager.submit("test", wait)
+        finished = [manager.submit("test", done) for _ in range(2)]
+        await settle(*finished)
+        latest = manager.submit("test", done)
+        await settle(latest)
+        kept = [job.job_id for job in (running, *finished, latest) if manager.get(job.job_id)]
+        release.set()
+        await settle(running)
+        return kept, running, finished, latest
+
+    kept, running, finished, latest = asyncio.run(run())
+    # Submitting the fourth job drops the finished ones it takes to get back to max_jobs
+    assert kept == [running.job_id, latest.job_id]
+
+def test_jobs_are_private_to_their_session():
+    async def run():
+        manager = jobs.JobManager()
+
+        async def done(job):
+            return None
+
+        job = manager.submit("test", done, session_id="a")
+        await settle(job)
+        return manager, job
+
+    manager, job = asyncio.run(run())
+    assert manager.get(job.job_id, "a") is job
+    assert manager.get(job.job_id, "b") is None
+
+class SlowStream(FakeStream):
+    def __iter__(self):
+        for chunk in FakeStream(["word "]):
+            for _ in range(200):
+                time.sleep(0.02)
+                yield chunk
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def wait_for(client, headers, job_id, status):
+    for _ in range(500):
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job never became {status}: {job}")
+
+def start_at(client, state):
+    session_id = client.post("/start").json()["session_id"]
+    session = main.session_store.get(session_id)
+    session.current_state = state
+    main.session_store.save(session)
+    return {"X-Session-Id": session_id}
+
+def test_document_job_result_is_the_docx(client):
+    headers = start_at(client, "Q1")
+    job_id = client.post("/jobs/generate-docx", headers=headers).json()["job_id"]
+    wait_for(client, headers, job_id, "done")
+    response = client.get(f"/jobs/{job_id}/result", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.DOCX_MEDIA_TYPE
+    assert response.content[:2] == b"PK"
+
+def test_result_of_a_running_then_cancelled_job(client, fake_llm):
+    fake_llm.respond = lambda prompt, kwargs: SlowStream([])
+    headers = start_at(client, "q24")
+    job_id = client.post("/jobs/submit-answers", headers=headers,
+                         json={"answers": {}, "bypass_cache": True}).json()["job_id"]
+    wait_for(client, headers, job_id, "running")
+    response = client.get(f"/jobs/{job_id}/result", headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (409, "Job is still running.")
+    client.post(f"/jobs/{job_id}/cancel", headers=headers)
+    wait_for(client, headers, job_id, "cancelled")
+    response = client.get(f"/jobs/{job_id}/result", headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (409, "Job was cancelled.")
+
+def test_result_of_a_failed_job(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(main, "process_answers", fail)
+    headers = start_at(client, "q24")
+    job_id = client.post("/jobs/submit-answers", headers=headers, json={"answers": {}}).json()["job_id"]
+    wait_for(client, headers, job_id, "failed")
+    response = client.get(f"/jobs/{job_id}/result", headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (500, "boom")
+
+def test_result_of_another_sessions_job_is_not_found(client):
+    headers = start_at(client, "Q1")
+    job_id = client.post("/jobs/generate-docx", headers=headers).json()["job_id"]
+    assert client.get(f"/jobs/{job_id}/result", headers=start_at(client, "Q1")).status_code == 404
+    assert client.get("/jobs/unknown/result", headers=headers).status_code == 404
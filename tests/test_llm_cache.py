@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import llm_cache
+import model_router
+import ver2
+
+MESSAGES = [{"role": "user", "content": "Write the objectives of Smart Schools"}]
+
+def key(**overrides):
+    params = {"messages": MESSAGES, "model": "m", "temperature": 0.6, "top_p": 0.95, "max_tokens": 4096}
+    params.update(overrides)
+    return llm_cache.cache_key(**params)
+
+def test_cache_key_is_stable():
+    assert key() == key()
+    assert len(key()) == 64
+
+@pytest.mark.parametrize("override", [
+    {"messages": [{"role": "user", "content": "Write the objectives of Smart Roads"}]},
+    {"model": "other"},
+    {"temperature": 0.5},
+    {"top_p": 0.9},
+    {"max_tokens": 1024},
+    {"reasoning_format": "hidden"},
+])
+def test_cache_key_covers_prompt_and_every_sampling_parameter(override):
+    assert key(**override) != key()
+
+def test_unset_reasoning_format_keeps_earlier_keys():
+    assert key(reasoning_format=None) == key()
+
+def test_prompt_key_follows_the_rendered_answers():
+    action = "Objectives of ^projectName in ^districtName"
+    before = ver2.prompt_cache_key(ver2.replace_markers(action, {"projectName": "A", "districtName": "D"}))
+    same = ver2.prompt_cache_key(ver2.replace_markers(action, {"projectName": "A", "districtName": "D",
+                                                               "unrelated": "x"}))
+    changed = ver2.prompt_cache_key(ver2.replace_markers(action, {"projectName": "B", "districtName": "D"}))
+    assert before == same
+    assert before != changed
+
+def test_prompt_key_follows_the_route():
+    route = model_router.Route("llama-3.1-8b-instant", max_completion_tokens=1024)
+    assert ver2.prompt_cache_key("p", route) != ver2.prompt_cache_key("p")
+
+@pytest.fixture
+def cache(tmp_path):
+    return llm_cache.ResponseCache(str(tmp_path / "cache.db"))
+
+def test_put_and_get(cache):
+    assert cache.get("k") is None
+    cache.put("k", "answer")
+    assert cache.get("k") == "answer"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": 6}
+
+def test_expired_entries_miss(tmp_path):
+    cache = llm_cache.ResponseCache(str(tmp_path / "cache.db"), max_age=60)
+    cache.put("k", "answer")
+    cache._conn.execute("UPDATE responses SET created_at = ?", (time.time() - 61,))
+    assert cache.get("k") is None
+
+def test_evicts_least_recently_used_beyond_max_entries(tmp_path):
+    cache = llm_cache.ResponseCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("a", "1")
+    time.sleep(0.01)
+    cache.put("b", "2")
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+def test_evicts_beyond_max_bytes(tmp_path):
+    cache = llm_cache.ResponseCache(str(tmp_path / "cache.db"), max_bytes=10)
+    cache.put("a", "x" * 6)
+    time.sleep(0.01)
+    cache.put("b", "y" * 6)
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 6
+
+def test_run_prompt_caches_only_accepted_answers(cache, fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_cache, "get_response_cache", lambda: cache)
+    fake_llm.respond = lambda prompt, kwargs: ["bad"]
+    assert ver2.run_prompt(fake_llm, "p", accept=lambda text: text == "good") == "bad"
+    assert ver2.run_prompt(fake_llm, "p", accept=lambda text: text == "good") == "bad"
+    assert len(fake_llm.calls) == 2
+
+    fake_llm.respond = lambda prompt, kwargs: ["good"]
+    assert ver2.run_prompt(fake_llm, "p", accept=lambda text: text == "good") == "good"
+    assert ver2.run_prompt(fake_llm, "p", accept=lambda text: text == "good") == "good"
+    assert len(fake_llm.calls) == 3
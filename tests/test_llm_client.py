@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import llm_client
+import model_router
+import rate_limiter
+import ver2
+
+def test_streams_beyond_the_pool_queue_for_a_connection(fake_llm, monkeypatch):
+    manager = llm_client.ClientManager(pool_size=2)
+    monkeypatch.setattr(llm_client, "client_manager", manager)
+    in_flight = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def respond(prompt, kwargs):
+        with lock:
+            in_flight.append(prompt)
+            peak[0] = max(peak[0], len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(prompt)
+        return ["ok"]
+
+    fake_llm.respond = respond
+    threads = [threading.Thread(target=ver2.run_prompt, args=(fake_llm, f"p{i}", False)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_llm.calls) == 6
+    assert peak[0] == 2
+
+def test_waiting_for_a_connection_can_be_cancelled(fake_llm, monkeypatch):
+    manager = llm_client.ClientManager(pool_size=1)
+    monkeypatch.setattr(llm_client, "client_manager", manager)
+    assert manager.acquire_stream()
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(ver2.Cancelled):
+        ver2.run_prompt(fake_llm, "p", use_cache=False, cancel_event=cancel_event)
+    assert fake_llm.calls == []
+    manager.release_stream()
+
+def test_prompt_waiting_on_its_rate_limit_leaves_the_connection_to_other_models(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_client, "client_manager", llm_client.ClientManager(pool_size=1))
+    limiter = rate_limiter.RateLimiter(enabled=True)
+    limiter._models["slow-model"] = rate_limiter.ModelLimits(rpm=1, tpm=0)
+    monkeypatch.setattr(rate_limiter, "limiter", limiter)
+    slow = model_router.Route(model="slow-model", reasoning_model=False)
+    fast = model_router.Route(model="fast-model", reasoning_model=False)
+    ver2.run_prompt(fake_llm, "first", use_cache=False, route=slow)
+
+    cancel_event = threading.Event()
+    outcome = []
+
+    def wait_for_the_next_minute():
+        try:
+            ver2.run_prompt(fake_llm, "second", use_cache=False, route=slow, cancel_event=cancel_event)
+        except ver2.Cancelled:
+            outcome.append("cancelled")
+
+    waiting = threading.Thread(target=wait_for_the_next_minute)
+    waiting.start()
+    time.sleep(0.2)
+    started = time.monotonic()
+    assert ver2.run_prompt(fake_llm, "other model", use_cache=False, route=fast) == "ok"
+    assert time.monotonic() - started < 1
+    cancel_event.set()
+    waiting.join(5)
+    assert outcome == ["cancelled"]
+    assert fake_llm.prompts() == ["first", "other model"]
+    # The cancelled prompt's reservation is given back
+    assert limiter.stats()["models"]["slow-model"]["requests_available"] == pytest.approx(0, abs=0.1)
+
+def test_reservation_is_given_back_when_the_connection_wait_is_cancelled(fake_llm, monkeypatch):
+    manager = llm_client.ClientManager(pool_size=1)
+    monkeypatch.setattr(llm_client, "client_manager", manager)
+    limiter = rate_limiter.RateLimiter(default_rpm=10, enabled=True)
+    monkeypatch.setattr(rate_limiter, "limiter", limiter)
+    assert manager.acquire_stream()
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(ver2.Cancelled):
+        ver2.run_prompt(fake_llm, "p", use_cache=False, cancel_event=cancel_event,
+                        route=model_router.Route(model="any-model", reasoning_model=False))
+    manager.release_stream()
+    assert limiter.stats()["models"]["any-model"]["requests_available"] == pytest.approx(10)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import model_router
+
+TABLE = {
+    "models": {
+        "big-reasoner": {"reasoning": True, "rpm": 30, "tpm": 30000},
+        "small-chat": {"reasoning": False, "rpm": 30, "tpm": 6000},
+        "mid-chat": {"reasoning": False},
+    },
+    "tiers": {
+        "medium": {"max_estimated_tokens": 1500, "model": "mid-chat", "max_completion_tokens": 3072},
+        "short": {"max_estimated_tokens": 400, "model": "small-chat", "max_completion_tokens": 1024,
+                  "temperature": 0.5},
+        "default": {"model": "big-reasoner", "max_completion_tokens": 4096},
+    },
+    "fields": {
+        "tableField": {"tier": "default", "max_completion_tokens": 8192, "allow_reasoning": False},
+        "pinnedField": {"model": "small-chat"},
+    },
+}
+
+@pytest.fixture
+def router(tmp_path):
+    path = tmp_path / "model_routing.json"
+    path.write_text(json.dumps(TABLE))
+    return model_router.ModelRouter(str(path))
+
+@pytest.mark.parametrize("prompt, tokens", [
+    ("Describe the project in 4-5 lines.", 150),
+    ("Summarise it in 3 lines", 90),
+    ("Give 2 to 6 lines on the scope.", 180),
+    ("Explain.", model_router.MIN_OPEN_ANSWER_TOKENS),
+    ("x" * 4000, 2000),
+])
+def test_completion_estimates(prompt, tokens):
+    assert model_router.estimate_completion_tokens(prompt) == tokens
+
+def test_short_answers_go_to_the_smallest_tier_that_fits(router):
+    route = router.route("Objectives", "List the objectives in 4-5 lines.")
+    assert (route.model, route.max_completion_tokens, route.temperature) == ("small-chat", 1024, 0.5)
+    assert not route.reasoning_model
+
+def test_thresholds_are_checked_in_ascending_order(router):
+    assert router.route("Scope", "Describe the scope in 30 lines.").model == "mid-chat"
+
+def test_long_answers_fall_back_to_the_default_tier(router):
+    route = router.route("Scope", "Describe the scope in 60 lines.")
+    assert (route.model, route.reasoning_model, route.reasoning_format) == ("big-reasoner", True, None)
+
+def test_listed_fields_use_their_tier_and_overrides(router):
+    route = router.route("tableField", "Fill the table in 2 lines.")
+    assert (route.model, route.max_completion_tokens) == ("big-reasoner", 8192)
+    assert route.reasoning_format == "hidden"
+
+def test_field_model_override_takes_the_models_reasoning_flag(router):
+    route = router.route("pinnedField", "Explain in 60 lines.")
+    assert route.model == "small-chat"
+    assert not route.reasoning_model and route.reasoning_format is None
+
+def test_model_settings(router):
+    assert router.model_settings("small-chat")["tpm"] == 6000
+    assert router.model_settings("unknown") == {}
+
+def test_missing_table_routes_everything_to_the_default(tmp_path):
+    router = model_router.ModelRouter(str(tmp_path / "missing.json"))
+    assert router.route("Objectives", "In 2 lines.") == model_router.DEFAULT_ROUTE
+
+def test_shipped_table_routes_the_json_fields_with_room_for_their_tables():
+    router = model_router.ModelRouter()
+    for field in ("capitalCostEstimates", "benefits"):
+        route = router.route(field, "short prompt")
+        assert route.max_completion_tokens == 8192
+        assert route.reasoning_format == "hidden"
+        assert router.model_settings(route.model)["reasoning"]
@@ -0,0 +1,104 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import prefetch
+import ver2
+
+def state(name, next_state, variables=(), prompts=(), fields=(), condition=None, actions=()):
+    return ver2.State(name, None, condition, [], list(variables), list(prompts), list(fields), list(actions),
+                      next_state)
+
+STATES = ver2.StateGraph({
+    "s1": [state("s1", "s2", variables=["name", "funded"])],
+    "s2": [state("s2", "s3", prompts=["Describe ^name"], fields=["desc"])],
+    "s3": [state("s3", "s4", prompts=["Summarise ^desc"], fields=["summary"])],
+    "s4": [state("s4", "s5", condition="!funded", actions=["budget=0"]),
+           state("s4", "s5", condition="funded", variables=["budget"])],
+    "s5": [state("s5", None, prompts=["Cost at ^budget"], fields=["cost"])],
+}, start_state="s1")
+
+def upcoming(name, user_data):
+    return [(state.name, inputs) for state, inputs in ver2.upcoming_prompt_states(STATES, name, user_data)]
+
+def test_prompts_are_ready_once_their_inputs_are_answered():
+    assert upcoming("s2", {"name": "Schools", "funded": "no"}) == [("s2", {"name": "Schools"}),
+                                                                   ("s5", {"budget": "0"})]
+
+def test_prompts_reading_fields_still_to_be_filled_wait():
+    assert ("s3", {"desc": "old"}) not in upcoming("s2", {"name": "Schools", "desc": "old", "funded": "no"})
+
+def test_walk_stops_at_a_question_still_to_be_answered():
+    # s1 asks name and funded again, so their current values may still change
+    assert upcoming("s1", {"name": "Schools", "funded": "no"}) == []
+    assert upcoming("s2", {"name": "Schools", "funded": "yes"}) == [("s2", {"name": "Schools"})]
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Stand-in for run_prompt_actions that fills each field and finishes once .release is set."""
+    runs = SimpleNamespace(states=[], release=threading.Event())
+
+    def run_prompt_actions(state, user_data, on_event=None, cancel_event=None, **kwargs):
+        runs.states.append(state.name)
+        runs.release.wait(5)
+        for field in state.promptFields:
+            user_data[field] = f"{field} of {user_data.get('name')}"
+        return {}
+
+    monkeypatch.setattr(ver2, "run_prompt_actions", run_prompt_actions)
+    return runs
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = prefetch.Prefetcher(workers=2, enabled=True)
+    yield prefetcher
+    prefetcher.shutdown()
+
+def test_matching_prefetch_is_handed_over(runs, prefetcher):
+    answers = {"name": "Schools", "funded": "yes"}
+    runs.release.set()
+    prefetcher.schedule("a", STATES, "s2", answers)
+    taken = prefetcher.take("a", STATES.resolve("s2", answers), answers)
+    assert taken is not None
+    assert taken.adopt() == ({"desc": "desc of Schools"}, {})
+    assert prefetcher.take("a", STATES.resolve("s2", answers), answers) is None
+
+def test_prefetch_for_a_changed_answer_is_discarded(runs, prefetcher):
+    prefetcher.schedule("a", STATES, "s2", {"name": "Schools", "funded": "yes"})
+    changed = {"name": "Clinics", "funded": "yes"}
+    staged = prefetcher._sessions["a"]["s2"]
+    assert prefetcher.take("a", STATES.resolve("s2", changed), changed) is None
+    assert staged.cancel_event.is_set()
+
+def test_rescheduling_keeps_a_prefetch_whose_inputs_are_unchanged(runs, prefetcher):
+    answers = {"name": "Schools", "funded": "yes"}
+    prefetcher.schedule("a", STATES, "s2", answers)
+    first = prefetcher._sessions["a"]["s2"]
+    prefetcher.schedule("a", STATES, "s2", {**answers, "unrelated": "x"})
+    assert prefetcher._sessions["a"]["s2"] is first
+    assert runs.states == ["s2"]
+    prefetcher.schedule("a", STATES, "s2", {**answers, "name": "Clinics"})
+    assert prefetcher._sessions["a"]["s2"] is not first
+    assert first.cancel_event.is_set()
+    runs.release.set()
+    assert prefetcher.take("a", STATES.resolve("s2", answers), {**answers, "name": "Clinics"}).adopt()[0] == \
+        {"desc": "desc of Clinics"}
+
+def test_prefetches_left_behind_are_cancelled(runs, prefetcher):
+    answers = {"name": "Schools", "funded": "no"}
+    prefetcher.schedule("a", STATES, "s2", answers)
+    staged = dict(prefetcher._sessions["a"])
+    assert set(staged) == {"s2", "s5"}
+    prefetcher.schedule("a", STATES, "s5", {**answers, "budget": "0"})
+    assert staged["s2"].cancel_event.is_set() and not staged["s5"].cancel_event.is_set()
+    prefetcher.forget("a")
+    assert staged["s5"].cancel_event.is_set()
+    runs.release.set()
+
+def test_disabled_prefetcher_runs_nothing(runs):
+    prefetcher = prefetch.Prefetcher(enabled=False)
+    prefetcher.schedule("a", STATES, "s2", {"name": "Schools"})
+    assert prefetcher.take("a", STATES.resolve("s2", {}), {"name": "Schools"}) is None
+    assert runs.states == []
+    prefetcher.shutdown()
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import threading
+
+from fastapi.testclient import TestClient
+
+import main
+import progress
+
+async def collect(stream):
+    return [item async for item in stream.events()]
+
+def test_token_counts_are_coalesced_to_the_latest_per_field():
+    async def run():
+        stream = progress.ProgressStream(asyncio.get_running_loop(), interval=0.05)
+        for tokens in range(1, 101):
+            stream.on_event("tokens", "Objectives", {"tokens": tokens})
+        stream.on_event("tokens", "Scope", {"tokens": 3})
+        await stream.queue.put({"event": "field_done", "field": "Objectives", "status": "ok"})
+        await stream.queue.put({"event": "result", "next": "q25"})
+        return await collect(stream)
+
+    events = asyncio.run(run())
+    tokens = [event for event in events if event["event"] == "tokens"]
+    assert sorted((event["field"], event["tokens"]) for event in tokens) == [("Objectives", 100), ("Scope", 3)]
+    assert [event["event"] for event in events][-2:] == ["field_done", "result"]
+
+def test_publishers_wait_while_the_queue_is_full():
+    async def run():
+        stream = progress.ProgressStream(asyncio.get_running_loop(), maxsize=1, interval=0.05)
+        published = []
+
+        def publish_three():
+            for i in range(3):
+                stream.publish({"event": "field_done", "field": f"f{i}"})
+                published.append(i)
+
+        worker = threading.Thread(target=publish_three)
+        worker.start()
+        await asyncio.sleep(0.3)
+        held_back = list(published)
+        received = [await stream.queue.get() for _ in range(3)]
+        await asyncio.get_running_loop().run_in_executor(None, worker.join, 5)
+        return held_back, received, published
+
+    held_back, received, published = asyncio.run(run())
+    assert held_back == [0]
+    assert [item["field"] for item in received] == ["f0", "f1", "f2"]
+    assert published == [0, 1, 2]
+
+def test_consumer_leaving_cancels_the_prompts_and_frees_waiting_publishers():
+    async def run():
+        stream = progress.ProgressStream(asyncio.get_running_loop(), maxsize=1, interval=0.05)
+        await stream.queue.put({"event": "field_started", "field": "Objectives"})
+        events = stream.events()
+        assert (await events.__anext__())["event"] == "field_started"
+        await stream.queue.put({"event": "field_started", "field": "Scope"})
+        blocked = threading.Thread(target=stream.publish, args=({"event": "field_done", "field": "Scope"},))
+        blocked.start()
+        await events.aclose()
+        await asyncio.get_running_loop().run_in_executor(None, blocked.join, 5)
+        return stream.cancel_event.is_set(), blocked.is_alive()
+
+    assert asyncio.run(run()) == (True, False)
+
+def test_task_outcome_is_the_final_event():
+    async def run(outcome):
+        stream = progress.ProgressStream(asyncio.get_running_loop(), interval=0.05)
+
+        async def task():
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        stream.attach(asyncio.create_task(task()))
+        return await collect(stream)
+
+    assert asyncio.run(run({"next": "q25"})) == [{"event": "result", "next": "q25"}]
+    assert asyncio.run(run(ValueError("boom"))) == [{"event": "error", "detail": "boom"}]
+
+def test_submit_answers_stream_reports_each_field(fake_llm):
+    fake_llm.respond = lambda prompt, kwargs: ["Better ", "schools ", "for ", "all."]
+    with TestClient(main.app) as client:
+        session_id = client.post("/start").json()["session_id"]
+        session = main.session_store.get(session_id)
+        session.current_state = "q24"
+        main.session_store.save(session)
+        response = client.post("/submit-answers/stream", headers={"X-Session-Id": session_id},
+                               json={"answers": {}, "bypass_cache": True})
+    events = [json.loads(line[len("data: "):]) for line in response.text.split("\n\n") if line]
+    # Token counts are flushed between lifecycle events, so only those keep a fixed order
+    assert [event["event"] for event in events if event["event"] != "tokens"] == ["field_started", "field_done",
+                                                                                 "result"]
+    assert events[-2] == {"event": "field_done", "field": "Objectives", "status": "ok", "errors": []}
+    assert events[-1]["next"] == "q25"
+    assert all(event["tokens"] <= 4 for event in events if event["event"] == "tokens")
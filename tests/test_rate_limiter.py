@@ -0,0 +1,116 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+
+class Clock:
+    """Stands in for the time module; sleeping just moves the clock on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+def limiter(rpm=0, tpm=0):
+    return rate_limiter.RateLimiter(default_rpm=rpm, default_tpm=tpm, enabled=True)
+
+def error_429(headers=None):
+    return SimpleNamespace(status_code=429, response=SimpleNamespace(headers=headers or {}))
+
+@pytest.mark.parametrize("value, seconds", [
+    ("7.66s", 7.66), ("2m59.56s", 179.56), ("120ms", 0.12), ("1h", 3600), ("3", 3.0),
+])
+def test_parse_duration(value, seconds):
+    assert rate_limiter.parse_duration(value) == pytest.approx(seconds)
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_unparseable_duration(value):
+    assert rate_limiter.parse_duration(value) is None
+
+def test_bucket_queues_callers_behind_the_capacity_already_promised():
+    bucket = rate_limiter.TokenBucket(60)
+    bucket.updated = 0.0
+    assert bucket.reserve(60, 0.0, 1.0) == 0
+    assert bucket.reserve(1, 0.0, 1.0) == pytest.approx(1.0)
+    assert bucket.reserve(1, 0.0, 1.0) == pytest.approx(2.0)
+    assert bucket.reserve(1, 0.0, 0.5) == pytest.approx(6.0)
+
+def test_bucket_refills_up_to_its_capacity():
+    bucket = rate_limiter.TokenBucket(60)
+    bucket.updated = 0.0
+    bucket.reserve(30, 0.0, 1.0)
+    bucket.refill(10.0, 1.0)
+    assert bucket.level == 40
+    bucket.refill(100.0, 1.0)
+    assert bucket.level == 60
+
+def test_request_larger_than_the_bucket_waits_for_a_full_one():
+    bucket = rate_limiter.TokenBucket(100)
+    bucket.updated = 0.0
+    bucket.reserve(100, 0.0, 1.0)
+    assert bucket.reserve(500, 0.0, 1.0) == pytest.approx(60.0)
+
+def test_requests_per_minute_are_spaced_out(clock):
+    limits = limiter(rpm=2)
+    for _ in range(3):
+        assert limits.acquire("unlisted-model", 10, 10) is not None
+    assert clock.slept == [pytest.approx(30.0)]
+
+def test_unused_token_estimate_is_given_back(clock):
+    limits = limiter(tpm=1000)
+    permit = limits.acquire("unlisted-model", 100, 800)
+    assert limits.stats()["models"]["unlisted-model"]["tokens_available"] == 100
+    permit.observe(total_tokens=200)
+    assert limits.stats()["models"]["unlisted-model"]["tokens_available"] == 800
+    limits.acquire("unlisted-model", 100, 100).observe(streamed_tokens=50)
+    assert limits.stats()["models"]["unlisted-model"]["tokens_available"] == 650
+
+def test_429_pauses_the_model_and_cuts_its_rate_until_completions_succeed(clock):
+    limits = limiter(rpm=600)
+    limits.acquire("unlisted-model", 1, 1).failed(error_429({"retry-after": "5"}))
+    stats = limits.stats()
+    assert stats["throttled"] == 1
+    assert stats["models"]["unlisted-model"]["factor"] == rate_limiter.RATE_BACKOFF_FACTOR
+    permit = limits.acquire("unlisted-model", 1, 1)
+    assert clock.slept == [pytest.approx(5.0)]
+    permit.observe()
+    assert limits.stats()["models"]["unlisted-model"]["factor"] == pytest.approx(
+        rate_limiter.RATE_BACKOFF_FACTOR + rate_limiter.RATE_RECOVERY_STEP)
+
+def test_provider_headers_correct_the_limits(clock):
+    limits = limiter()
+    limits.acquire("unlisted-model", 100, 100).observe({"x-ratelimit-limit-tokens": "6000",
+                                                        "x-ratelimit-remaining-tokens": "1200",
+                                                        "x-ratelimit-remaining-requests": "0",
+                                                        "x-ratelimit-reset-requests": "2m"})
+    stats = limits.stats()["models"]["unlisted-model"]
+    assert stats["tokens_available"] == 1200
+    assert stats["paused_for"] == pytest.approx(120.0)
+
+def test_cancelled_wait_gives_its_reservation_back(clock):
+    limits = limiter(rpm=1)
+    limits.acquire("unlisted-model", 1, 1)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert limits.acquire("unlisted-model", 1, 1, cancel_event) is None
+    assert limits.stats()["models"]["unlisted-model"]["requests_available"] == 0
+
+def test_disabled_limiter_never_waits(clock):
+    limits = rate_limiter.RateLimiter(default_rpm=1, enabled=False)
+    for _ in range(5):
+        limits.acquire("unlisted-model", 1, 1).failed(error_429())
+    assert clock.slept == [] and limits.stats()["throttled"] == 0
@@ -0,0 +1,140 @@
+import dataclasses
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import records
+import sessions
+import ver2
+
+CAPITAL_COST = {"capitalCost": [
+    {"name": "Cost Estimation", "description": "Break-up of costs",
+     "data": [{"Item": "Servers", "Cost": {"Local": 10, "Foreign": 5}}, {"Item": "Software", "Cost": {"Local": 3,
+                                                                                                      "Foreign": 0}}]},
+    {"name": "Financial Phasing", "description": "By year", "data": [{"Year": "2025", "Amount": 15}]},
+]}
+FINANCIAL_PLAN = {"financialPlan": [
+    {"Sr_No": 1, "Description": "Hardware", "Year_I": 50, "Year_II": 30, "Year_III": 20, "Total_Cost": 100},
+    {"Sr_No": 2, "Description": "Software", "Year_I": 20, "Year_II": 15, "Year_III": 15, "Total_Cost": 50},
+]}
+OPERATIONS = {"operations": {"description": ["Pay and Allowances", "General Utilities"], "Amount": ["32.87", "6.00"]}}
+BENEFITS = {"project_components": [{
+    "serial_number": 1, "input": 25000000,
+    "outcome": {"component_name": "Hardware Procurement", "units": 500},
+    "year_wise_phasing": {"year_1": {"amount": 12000000, "division_of_total_items": 250},
+                          "year_2": {"amount": 10000000, "division_of_total_items": 200},
+                          "year_3": {"amount": 3000000, "division_of_total_items": 50}},
+    "outcome_metrics": {"baseline_indicator": "Current Infrastructure"},
+    "targeted_impact": {"post_completion_targets": "Enhanced Digital Infrastructure"},
+    "impact_details": {"key_benefits": "Improved service delivery"},
+}]}
+
+ANSWERS = [
+    ("capitalCostEstimates", CAPITAL_COST, records.CapitalCostEstimates),
+    ("maintenanceCosts", FINANCIAL_PLAN, records.MaintenanceCosts),
+    ("maintenanceCosts", OPERATIONS, records.MaintenanceCosts),
+    ("benefits", BENEFITS, records.Benefits),
+]
+
+@pytest.mark.parametrize("field, payload, record_type", ANSWERS)
+def test_answers_parse_into_records(field, payload, record_type):
+    record, errors = records.parse_response(field, json.dumps(payload))
+    assert errors == []
+    assert isinstance(record, record_type)
+
+@pytest.mark.parametrize("field, payload, record_type", ANSWERS)
+def test_records_round_trip_through_json(field, payload, record_type):
+    record, _ = records.parse_response(field, json.dumps(payload))
+    stored = json.dumps(record, default=records.to_jsonable)
+    assert json.loads(stored) == payload
+    assert records.parse_response(field, stored) == (record, [])
+
+@pytest.mark.parametrize("field, payload, record_type", ANSWERS)
+def test_records_round_trip_through_the_sqlite_session_store(field, payload, record_type, tmp_path):
+    record, _ = records.parse_response(field, json.dumps(payload))
+    backend = sessions.SQLiteSessionBackend(str(tmp_path / "sessions.db"))
+    backend.save(sessions.Session("s", "q25", {field: record}))
+    loaded = backend.load("s").user_data[field]
+    assert loaded == payload
+    assert records.coerce(field, loaded) == record
+
+def test_financial_plan_keeps_every_row_and_shows_only_year_and_total_columns():
+    record, _ = records.parse_response("maintenanceCosts", json.dumps({"financialPlan": [
+        {"Year I (Rs. in million)": 100, "Total Cost (Rs. in million)": 100, "Note": "phase 1"}]}))
+    assert [entry.label for entry in record.entries] == ["Year I (Rs. in million)", "Total Cost (Rs. in million)"]
+    assert record.to_json()["financialPlan"][0]["Note"] == "phase 1"
+
+def test_answer_wrapped_in_prose_is_recovered():
+    text = f"Here is the plan:\n{json.dumps(FINANCIAL_PLAN)}\nLet me know if you need more."
+    record, errors = records.parse_response("maintenanceCosts", text)
+    assert errors == []
+    assert record.to_json() == FINANCIAL_PLAN
+
+def test_download_prefix_is_ignored():
+    record, errors = records.parse_response("benefits", records.DOWNLOAD_PREFIX + json.dumps(BENEFITS))
+    assert errors == [] and record.components[0].component_name == "Hardware Procurement"
+
+@pytest.mark.parametrize("field, text, error", [
+    ("benefits", '{"project_components": "none"}', "$.project_components: expected an array, got str"),
+    ("capitalCostEstimates", '{"capitalCost": [{"name": "x", "data": ["row"]}]}',
+     "$.capitalCost[0].data[0]: expected an object, got str"),
+    ("maintenanceCosts", '{"other": 1}', "$: expected one of the keys financialPlan, operations"),
+    ("benefits", "not json at all", "invalid JSON: Expecting value: line 1 column 1 (char 0)"),
+])
+def test_malformed_answers_are_reported(field, text, error):
+    value, errors = records.parse_response(field, text)
+    assert errors == [error]
+    assert not isinstance(value, records.Record)
+
+def test_fields_without_a_schema_stay_text():
+    assert records.parse_response("Objectives", "Improve schools.") == ("Improve schools.", [])
+
+def test_extract_json_prefers_the_largest_balanced_span():
+    assert records.extract_json('note {"a": [1, {"b": 2}]} and [3]') == {"a": [1, {"b": 2}]}
+    assert records.extract_json('no json "{" here') is None
+
+def test_record_base_is_abstract():
+    with pytest.raises(TypeError):
+        records.Record()
+
+EXTENDED = [
+    ("capitalCostEstimates", {"capitalCost": [{"name": "Cost Estimation", "data": [{"Item": "Servers", "Cost": 10}],
+                                               "total": 10, "notes": "excluding taxes"}],
+                              "currency": "PKR"}),
+    ("benefits", {"project_components": [{"serial_number": 1, "outcome": {"component_name": "Labs"},
+                                          "year_wise_phasing": {"year_1": {"amount": 5}, "year_4": {"amount": 1}},
+                                          "remarks": "phased"}]}),
+    ("maintenanceCosts", {"operations": {"description": ["Salaries"], "Amount": ["3"], "unit": "Rs. million"},
+                          "note": "annual"}),
+]
+
+@pytest.mark.parametrize("field, payload", EXTENDED)
+def test_keys_the_records_dont_know_are_kept_and_missing_ones_stay_missing(field, payload):
+    record, errors = records.parse_response(field, json.dumps(payload))
+    assert errors == []
+    assert json.loads(json.dumps(record, default=records.to_jsonable)) == payload
+    # Prompts reading the field get the answer as the model gave it
+    assert json.loads(ver2._render_var(field, {field: record})) == payload
+
+def test_typed_view_fills_gaps_without_touching_the_payload():
+    record, _ = records.parse_response("benefits", json.dumps(EXTENDED[1][1]))
+    component = record.components[0]
+    assert (component.units, component.years[1].amount, component.years[0].amount) == ("", "", 5)
+    assert "units" not in component.to_json()["outcome"]
+
+def test_records_are_read_only():
+    record, _ = records.parse_response("benefits", json.dumps(BENEFITS))
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        record.components = []
+
+def test_schemas_load_outside_the_repository(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ("import json, records; "
+              f"print(records.coerce('capitalCostEstimates', json.loads({json.dumps(json.dumps(CAPITAL_COST))})) "
+              "is not None)")
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": root}, timeout=60)
+    assert result.stdout.strip() == "True", result.stderr
@@ -0,0 +1,37 @@
+import io
+import os
+
+import docx
+import pytest
+
+import render_service
+
+USER_DATA = {"projectName": "Smart Schools", "districtName": "Lahore", "sector": "Education", "budget": "500"}
+
+def _crash(*args):
+    os._exit(1)
+
+@pytest.fixture(scope="module")
+def renderer():
+    service = render_service.RenderService(workers=1)
+    service.start()
+    yield service
+    service.shutdown()
+
+def text_of(content: bytes) -> str:
+    return "\n".join(paragraph.text for paragraph in docx.Document(io.BytesIO(content)).paragraphs)
+
+def test_render_document_returns_docx_bytes(renderer):
+    content = renderer.render_document(USER_DATA).result(timeout=60)
+    assert content[:2] == b"PK"
+    assert "Smart Schools" in text_of(content)
+    assert renderer.metrics()["completed"] >= 1
+
+def test_pool_recovers_after_a_worker_dies(renderer):
+    failed = renderer.metrics()["failed"]
+    with pytest.raises(Exception):
+        renderer.submit(_crash).result(timeout=60)
+    assert renderer.metrics()["failed"] == failed + 1
+    content = renderer.render_document(USER_DATA).result(timeout=60)
+    assert "Smart Schools" in text_of(content)
+    assert renderer.metrics()["in_flight"] == 0
@@ -0,0 +1,124 @@
+import json
+import time
+
+import groq
+import httpx
+import pytest
+
+import ver2
+from test_records import BENEFITS as BENEFITS_ANSWER
+
+BENEFITS = json.dumps(BENEFITS_ANSWER)
+
+def prompt_state(field="benefits", prompt="Estimate the benefits."):
+    return ver2.State("q1", None, None, [], [], [prompt], [field], [], None)
+
+def api_error(status, headers=None):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return groq.APIStatusError(f"status {status}", response=response, body=None)
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ver2, "backoff_delay", lambda attempt, error=None: 0.0)
+
+def run(llm, state, user_data=None):
+    user_data = {} if user_data is None else user_data
+    events = []
+    errors = ver2._run_prompt_action(llm, state, 0, user_data, on_event=lambda *event: events.append(event),
+                                     use_cache=False)
+    return errors, user_data, events[-1][2]["status"]
+
+def test_server_errors_are_retried(fake_llm):
+    answers = iter([api_error(503), api_error(429), [BENEFITS]])
+
+    def respond(prompt, kwargs):
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    fake_llm.respond = respond
+    errors, user_data, status = run(fake_llm, prompt_state())
+    assert (errors, status) == ([], "ok")
+    assert len(fake_llm.calls) == 3
+    assert user_data["benefits"].components[0].component_name == "Hardware Procurement"
+
+def test_client_errors_are_not_retried(fake_llm):
+    def respond(prompt, kwargs):
+        raise api_error(400)
+
+    fake_llm.respond = respond
+    errors, user_data, status = run(fake_llm, prompt_state())
+    assert (errors, status) == (["status 400"], "failed")
+    assert len(fake_llm.calls) == 1
+    assert "benefits" not in user_data
+
+def test_attempts_are_capped(fake_llm, monkeypatch):
+    monkeypatch.setattr(ver2, "LLM_MAX_ATTEMPTS", 2)
+
+    def respond(prompt, kwargs):
+        raise api_error(500)
+
+    fake_llm.respond = respond
+    assert run(fake_llm, prompt_state())[2] == "failed"
+    assert len(fake_llm.calls) == 2
+
+def test_malformed_answer_is_asked_for_again_with_its_errors(fake_llm):
+    answers = iter([['{"project_components": "none"}'], [BENEFITS]])
+    fake_llm.respond = lambda prompt, kwargs: next(answers)
+    errors, user_data, status = run(fake_llm, prompt_state())
+    assert (errors, status) == ([], "ok")
+    first, repair = fake_llm.prompts()
+    assert first == "Estimate the benefits."
+    assert repair.startswith("Estimate the benefits.\n\nYour previous answer could not be used")
+    assert "$.project_components: expected an array, got str" in repair
+
+def test_answer_still_malformed_after_every_attempt_is_kept_as_invalid(fake_llm):
+    fake_llm.respond = lambda prompt, kwargs: ["no json here"]
+    errors, user_data, status = run(fake_llm, prompt_state())
+    assert status == "invalid"
+    assert errors and errors[0].startswith("invalid JSON")
+    assert len(fake_llm.calls) == ver2.LLM_MAX_ATTEMPTS
+    assert user_data["benefits"] == "no json here"
+
+def test_stream_past_the_field_budget_is_abandoned(fake_llm, monkeypatch):
+    monkeypatch.setattr(ver2, "FIELD_TIME_BUDGET", 0.05)
+
+    def respond(prompt, kwargs):
+        time.sleep(0.1)
+        return ['{"project_components": [', "]}"]
+
+    fake_llm.respond = respond
+    errors, user_data, status = run(fake_llm, prompt_state())
+    assert (errors, status) == (["no complete answer within 0.05s"], "failed")
+    assert len(fake_llm.calls) == 1
+
+def test_no_retry_when_the_backoff_outlasts_the_budget(fake_llm, monkeypatch):
+    monkeypatch.setattr(ver2, "FIELD_TIME_BUDGET", 1.0)
+    monkeypatch.setattr(ver2, "backoff_delay", lambda attempt, error=None: 5.0)
+
+    def respond(prompt, kwargs):
+        raise api_error(503)
+
+    fake_llm.respond = respond
+    started = time.monotonic()
+    assert run(fake_llm, prompt_state())[2] == "failed"
+    assert len(fake_llm.calls) == 1
+    assert time.monotonic() - started < 1.0
+
+def test_backoff_follows_retry_after_and_is_otherwise_jittered_exponential(monkeypatch):
+    monkeypatch.undo()
+    assert ver2.backoff_delay(0, api_error(429, {"retry-after": "7"})) == 7.0
+    monkeypatch.setattr(ver2, "LLM_BACKOFF_BASE", 0.5)
+    monkeypatch.setattr(ver2, "LLM_BACKOFF_MAX", 3.0)
+    delays = [ver2.backoff_delay(attempt, api_error(503)) for attempt in range(6) for _ in range(20)]
+    assert all(0 <= delay <= 3.0 for delay in delays)
+    assert max(ver2.backoff_delay(0) for _ in range(50)) <= 0.5
+
+def test_retryable_errors():
+    assert ver2.is_retryable(api_error(429))
+    assert ver2.is_retryable(api_error(502))
+    assert not ver2.is_retryable(api_error(401))
+    assert ver2.is_retryable(httpx.ConnectError("refused"))
+    assert not ver2.is_retryable(ValueError("bad"))
@@ -0,0 +1,84 @@
+import copy
+import json
+import threading
+
+import pytest
+
+import records
+import sessions
+from test_records import CAPITAL_COST
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions, "time", clock)
+    return clock
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return sessions.SQLiteSessionBackend(str(tmp_path / "sessions.db"), **kwargs)
+        return sessions.MemorySessionBackend(**kwargs)
+    return make
+
+def test_idle_sessions_expire(make_backend, clock):
+    backend = make_backend(ttl=60)
+    backend.save(sessions.Session("a", "q4", {"projectName": "Schools"}))
+    clock.now += 59
+    assert backend.load("a").user_data == {"projectName": "Schools"}
+    clock.now += 2
+    assert backend.load("a") is None
+
+def test_least_recently_used_sessions_go_first(make_backend, clock):
+    backend = make_backend(max_sessions=2)
+    for session_id in ("a", "b"):
+        backend.save(sessions.Session(session_id))
+        clock.now += 1
+    backend.save(backend.load("a"))
+    clock.now += 1
+    backend.save(sessions.Session("c"))
+    assert [backend.load(session_id) is not None for session_id in ("a", "b", "c")] == [True, False, True]
+
+def test_deleted_session_is_gone(make_backend):
+    backend = make_backend()
+    backend.save(sessions.Session("a"))
+    backend.delete("a")
+    assert backend.load("a") is None
+
+def test_sqlite_sessions_survive_a_restart_with_their_answers_intact(tmp_path):
+    payload = {**copy.deepcopy(CAPITAL_COST), "currency": "PKR"}
+    payload["capitalCost"][0]["total"] = 15
+    record, errors = records.parse_response("capitalCostEstimates", json.dumps(payload))
+    assert errors == []
+    path = str(tmp_path / "sessions.db")
+    sessions.SQLiteSessionBackend(path).save(sessions.Session("a", "q32", {"projectName": "Schools",
+                                                                           "capitalCostEstimates": record}))
+    loaded = sessions.SQLiteSessionBackend(path).load("a")
+    assert loaded.current_state == "q32"
+    assert loaded.user_data == {"projectName": "Schools", "capitalCostEstimates": payload}
+    assert loaded.user_data["capitalCostEstimates"]["capitalCost"][0]["total"] == 15
+    assert records.coerce("capitalCostEstimates", loaded.user_data["capitalCostEstimates"]) == record
+
+def test_store_resets_and_cancels_a_sessions_prompt_batches():
+    store = sessions.SessionStore(sessions.MemorySessionBackend())
+    session = store.create()
+    session.current_state = "q8"
+    session.user_data["projectName"] = "Schools"
+    store.save(session)
+    store.reset(session)
+    assert (store.get(session.session_id).current_state, store.get(session.session_id).user_data) == ("q1", {})
+    assert store.get(None) is None
+
+    first, second = threading.Event(), threading.Event()
+    with store.running(session.session_id, first), store.running(session.session_id, second):
+        assert store.cancel(session.session_id) == 2
+    assert first.is_set() and second.is_set()
+    assert store.cancel(session.session_id) == 0
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import ver2
+
+MACHINE = ('q1,null,null,["Provincial?"],["isProvincial"],[],[],[],q2\n'
+           'q2,q1,!isProvincial,[],[],[],[],["federalMinistry=null"],q3\n'
+           'q2,q1,isProvincial,["Ministry?"],["federalMinistry"],[],[],[],q3\n'
+           'q3,q2,null,[],[],[],[],[],null\n')
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "machine.csv"
+    path.write_text(MACHINE, encoding="utf-8")
+    return path
+
+@pytest.mark.parametrize("condition, value, expected", [
+    (None, None, True),
+    ("flag", "Yes", True),
+    ("flag", "1", True),
+    ("flag", "no", False),
+    ("flag", None, False),
+    ("!flag", "False", True),
+    ("!flag", "", True),
+    ("!flag", None, True),
+    ("!flag", "yes", False),
+])
+def test_predicate(condition, value, expected):
+    user_data = {} if value is None else {"flag": value}
+    assert ver2.Predicate.parse(condition)(user_data) is expected
+    assert ver2.evaluate_condition(condition, user_data) is expected
+
+def test_resolve_picks_the_variant_whose_condition_holds(csv_path):
+    graph = ver2.StateGraph(ver2.parse_state_machine(str(csv_path)))
+    assert graph.resolve("q2", {"isProvincial": "no"}).variableActions == ["federalMinistry=null"]
+    assert graph.resolve("q2", {"isProvincial": "yes"}).variables == ["federalMinistry"]
+    assert graph.resolve("missing", {}) is None
+    assert "q3" in graph and "missing" not in graph
+
+def test_validate_reports_dangling_and_unreachable_states():
+    states = ver2.parse_state_machine("state_machine.csv")
+    graph = ver2.StateGraph({**states, "orphan": [ver2.State("orphan", None, None, [], [], [], [], [], "nowhere")]})
+    assert sorted(graph.validate()) == ["State 'orphan' goes to unknown state 'nowhere'",
+                                        "State 'orphan' is unreachable from 'q1'"]
+    assert ver2.StateGraph(states).validate() == []
+
+def test_compiled_graph_round_trips(csv_path):
+    graph = ver2.StateGraph(ver2.parse_state_machine(str(csv_path)))
+    again = ver2.StateGraph.from_dict(json.loads(json.dumps(graph.to_dict())))
+    assert again.states == graph.states
+    assert again.start_state == "q1"
+
+def test_compiled_artefact_is_reused_until_the_csv_changes(csv_path, tmp_path, monkeypatch):
+    cache_path = tmp_path / "machine.compiled.json"
+    ver2.compile_state_machine(str(csv_path), str(cache_path))
+    assert json.loads(cache_path.read_text(encoding="utf-8"))["source_sha256"]
+
+    parsed = []
+    original = ver2.parse_state_machine
+    monkeypatch.setattr(ver2, "parse_state_machine", lambda path: parsed.append(path) or original(path))
+    graph = ver2.compile_state_machine(str(csv_path), str(cache_path))
+    assert parsed == []
+    assert graph.resolve("q1", {}).variables == ["isProvincial"]
+
+    csv_path.write_text(MACHINE.replace('["Provincial?"]', '["Is it provincial?"]'), encoding="utf-8")
+    graph = ver2.compile_state_machine(str(csv_path), str(cache_path))
+    assert parsed == [str(csv_path)]
+    assert graph.resolve("q1", {}).questions == ["Is it provincial?"]
+
+def test_unreadable_artefact_falls_back_to_the_csv(csv_path, tmp_path):
+    cache_path = tmp_path / "machine.compiled.json"
+    cache_path.write_text("{not json", encoding="utf-8")
+    graph = ver2.compile_state_machine(str(csv_path), str(cache_path))
+    assert graph.resolve("q3", {}).next_state is None
@@ -0,0 +1,74 @@
+import pytest
+
+import ver2
+
+def rows(text):
+    errors = []
+    result = [[field.text for field in row] for row in ver2.split_csv_rows(text, errors)]
+    return result, errors
+
+def test_brackets_and_json_strings_keep_commas_and_newlines_in_one_field():
+    result, errors = rows('q1,null,["a, b",\n "c"],["x"]\nq2,q1,[],[]\n')
+    assert errors == []
+    assert result == [["q1", "null", '["a, b",\n "c"]', '["x"]'], ["q2", "q1", "[]", "[]"]]
+
+def test_nested_brackets_and_escaped_quotes():
+    result, errors = rows('q1,[["a]", "b\\", c"], []],x\n')
+    assert errors == []
+    assert result == [["q1", '[["a]", "b\\", c"], []]', "x"]]
+
+def test_spreadsheet_quoted_fields():
+    result, errors = rows('q1,"[""a, b""]",x\r\n'.replace("\r", ""))
+    assert errors == []
+    assert result == [["q1", '["a, b"]', "x"]]
+
+def test_blank_lines_are_skipped_and_last_row_needs_no_newline():
+    result, errors = rows('\nq1,a\n\nq2,b')
+    assert errors == []
+    assert result == [["q1", "a"], ["q2", "b"]]
+
+@pytest.mark.parametrize("text, message, location", [
+    ('q1,["a",\nq2,b\n', "'[' is never closed", (1, 4)),
+    ('q1,a]\nq2,b\n', "unmatched ']'", (1, 5)),
+    ('q1,"abc\n', "unterminated quoted field", (1, 4)),
+    ('q1,"a"b,c\nq2,d\n', "unexpected text after quoted field", (1, 7)),
+])
+def test_errors_are_located(text, message, location):
+    _, errors = rows(text)
+    assert errors[0] == (*location, message)
+
+def test_row_with_an_error_is_skipped_but_the_rest_are_kept():
+    result, errors = rows('q1,a]\nq2,b\n')
+    assert len(errors) == 1
+    assert result == [["q2", "b"]]
+
+def write(tmp_path, text):
+    path = tmp_path / "machine.csv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_parse_state_machine_builds_states(tmp_path):
+    path = write(tmp_path, 'q1,null,null,["Name?"],["projectName"],[],[],[],q2\n'
+                           'q2,q1,flag,[],[],["Objectives of ^projectName"],["Objectives"],["x=1"],null\n')
+    states = ver2.parse_state_machine(path)
+    first, second = states["q1"][0], states["q2"][0]
+    assert first.previous_state is None and first.variables == ["projectName"] and first.next_state == "q2"
+    assert second.condition == "flag" and second.promptFields == ["Objectives"]
+    assert second.variableActions == ["x=1"] and second.next_state is None
+
+def test_parse_state_machine_reports_every_bad_row(tmp_path):
+    path = write(tmp_path, 'q1,null,null,[],[],[],[],[],q2\n'
+                           'q2,q1,null,[],[]\n'
+                           'q3,q2,null,[1 2],[],[],[],[],null\n')
+    with pytest.raises(ver2.StateMachineError) as info:
+        ver2.parse_state_machine(path)
+    messages = [message for _, _, message in info.value.errors]
+    assert messages == ["expected 9 columns, found 5", "invalid JSON in column 4: Expecting ',' delimiter"]
+    assert info.value.errors[0][:2] == (2, 1)
+    assert info.value.errors[1][:2] == (3, 15)
+    assert str(info.value).startswith(f"{path}:2:1: ")
+
+def test_repository_state_machine_parses():
+    states = ver2.parse_state_machine("state_machine.csv")
+    assert len(states["q6"]) == 2
+    assert states["q25"][0].promptFields[0] == "ICT-Reqs"
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import ver2
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def splits(text):
+    """The text cut into chunks of several sizes, and in two at every position."""
+    for size in (1, 2, 3, 5, 8, len(text) or 1):
+        yield chunked(text, size)
+    for i in range(1, len(text)):
+        yield [text[:i], text[i:]]
+
+def assemble(chunks):
+    assembler = ver2.StreamAssembler()
+    for chunk in chunks:
+        assembler.feed(chunk)
+    return assembler
+
+PLAIN = [
+    "The project improves school infrastructure in Lahore.",
+    "<think>Plan the answer first.</think>Objectives: better schools.",
+    "<think>a</think> one <think>b</think> two",
+    "```\nplain text in a fence\n```",
+    "Intro text then {\"a\": 1} and more",
+    "<think>never closed, still thinking",
+    "Ends mid-tag <thi",
+    "< think > isn't a tag",
+]
+
+@pytest.mark.parametrize("text", PLAIN)
+def test_text_matches_clean_response_however_the_stream_is_chunked(text):
+    for chunks in splits(text):
+        assembler = assemble(chunks)
+        assert not assembler.closed
+        assert assembler.text() == ver2.clean_response(text), chunks
+
+OBJECTS = [
+    '{"a": 1}',
+    '{"nested": {"list": [{"x": "}"}, {"y": "{"}]}}',
+    '{"quote": "she said \\"}\\" twice", "path": "C:\\\\"}',
+    '{"escaped_backslash_then_quote": "\\\\", "next": "}"}',
+]
+
+@pytest.mark.parametrize("body", OBJECTS)
+@pytest.mark.parametrize("lead", ["", "  \n", "```json\n", "---json\n", "<think>{ not json }</think>```\n"])
+def test_json_answer_stops_at_the_end_of_the_top_level_object(lead, body):
+    text = f"{lead}{body}\n```\nLet me know if you need anything else {{}}."
+    for chunks in splits(text):
+        assembler = assemble(chunks)
+        assert assembler.closed, chunks
+        assert assembler.text() == body, chunks
+        assert json.loads(assembler.text()) == json.loads(body)
+
+@pytest.mark.parametrize("body", OBJECTS)
+def test_unfinished_json_object_matches_clean_response(body):
+    text = "```json\n" + body[:-1]
+    for chunks in splits(text):
+        assembler = assemble(chunks)
+        assert not assembler.closed
+        assert assembler.text() == ver2.clean_response(text)
+
+def test_chunks_after_the_object_closes_are_ignored():
+    assembler = assemble(['{"a": ', '1}', ' trailing'])
+    assert assembler.closed
+    assembler.feed(' {"b": 2}')
+    assert assembler.text() == '{"a": 1}'
+
+def test_empty_stream():
+    assert assemble(["", ""]).text() == ""
@@ -0,0 +1,38 @@
+import json
+import os
+
+import ver2
+
+def write(path, data):
+    path.write_text(data if isinstance(data, str) else json.dumps(data), encoding="utf-8")
+
+def test_templates_are_compiled_with_their_var_markers(tmp_path):
+    path = tmp_path / "prompts.json"
+    write(path, {"costEstimation": {"total": "^budget"}})
+    registry = ver2.TemplateRegistry(str(path), reload_interval=0)
+    plan = registry.get("costEstimation")
+    assert ("^", "budget") in plan
+    assert ver2._render_parts(plan, {"budget": "500"}) == '{"total": "500"}'
+
+def test_reload_picks_up_changes(tmp_path):
+    path = tmp_path / "prompts.json"
+    write(path, {"summary": "old"})
+    registry = ver2.TemplateRegistry(str(path), reload_interval=0)
+    assert registry.get("summary") == ('"old"',)
+    write(path, {"summary": "new"})
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert registry.get("summary") == ('"new"',)
+
+def test_file_read_mid_write_keeps_last_good_templates(tmp_path, capsys):
+    path = tmp_path / "prompts.json"
+    write(path, {"summary": "good"})
+    registry = ver2.TemplateRegistry(str(path), reload_interval=0)
+    assert registry.get("summary") == ('"good"',)
+    write(path, '{"summary": "trunc')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert registry.get("summary") == ('"good"',)
+    assert "Could not reload prompt templates" in capsys.readouterr().out
+    # Once the write completes the new version is loaded
+    write(path, {"summary": "done"})
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2 * 10**9))
+    assert registry.get("summary") == ('"done"',)
@@ -1,10 +1,24 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
 import json
 import os
-from groq import Groq
+import random
+import threading
+import time
 from typing import Dict, List, Optional
-from dataclasses import dataclass
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict
+import groq
+import httpx
 import sample2
+import records
+import llm_cache
+import llm_client
+import metrics
+import model_router
+import rate_limiter
 import re
 
 @dataclass
@@ -19,154 +33,846 @@ class State:
     variableActions: List[str]
     next_state: Optional[str]
 
-def parse_csv_line(line: str) -> List[str]:
-    parts = []
-    current = []
-    in_array = False
-    for char in line:
-        if char == '[':
-            in_array = True
-        elif char == ']':
-            in_array = False
-        if char == ',' and not in_array:
-            parts.append(''.join(current))
-            current = []
+STATE_MACHINE_COLUMNS = 9
+_JSON_COLUMNS = (3, 4, 5, 6, 7)
+
+# Inside a bare field: a JSON string (with \\ escapes), a structural character, or a plain run
+_CSV_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\],\n]|[^\[\],"\n]+|"', re.S)
+# A spreadsheet-style quoted field, where "" stands for a literal quote
+_CSV_QUOTED = re.compile(r'"([^"]*(?:""[^"]*)*)"')
+
+class StateMachineError(ValueError):
+    """Raised with every malformed row of a state machine CSV, each located by line and column."""
+
+    def __init__(self, path: str, errors: List[tuple]):
+        self.path = path
+        self.errors = errors
+        super().__init__("\n".join(f"{path}:{line}:{column}: {message}" for line, column, message in errors))
+
+class _Field:
+    __slots__ = ("text", "offset", "quoted")
+
+    def __init__(self, text: str, offset: int, quoted: bool = False):
+        self.text = text
+        self.offset = offset
+        self.quoted = quoted
+
+def _location(text: str, offset: int) -> tuple:
+    line = text.count("\n", 0, offset) + 1
+    return line, offset - (text.rfind("\n", 0, offset) + 1) + 1
+
+def split_csv_rows(text: str, errors: List[tuple]):
+    """Yield the rows of a state machine CSV as lists of _Field, in a single pass.
+
+    Bare fields may hold JSON arrays: commas and newlines inside brackets or
+    JSON strings don't split fields, and brackets may nest. Fields can also be
+    CSV-quoted the way spreadsheets export them. Problems are appended to
+    `errors` as (line, column, message) and the offending row is skipped.
+    """
+    pos = 0
+    end = len(text)
+    row, row_ok = [], True
+    while pos <= end:
+        # Start of a field
+        if pos < end and text[pos] == '"':
+            match = _CSV_QUOTED.match(text, pos)
+            if match is None:
+                errors.append((*_location(text, pos), "unterminated quoted field"))
+                return
+            row.append(_Field(match.group(1).replace('""', '"'), pos + 1, quoted=True))
+            pos = match.end()
+            if pos < end and text[pos] not in ",\n":
+                errors.append((*_location(text, pos), "unexpected text after quoted field"))
+                row_ok = False
+                pos = text.find("\n", pos)
+                pos = end if pos == -1 else pos
         else:
-            current.append(char)
-    if current:
-        parts.append(''.join(current))
-    return parts
+            start = pos
+            depth = 0
+            opened = []
+            while pos < end:
+                match = _CSV_TOKEN.match(text, pos)
+                token = match.group()
+                if token == "[":
+                    depth += 1
+                    opened.append(pos)
+                elif token == "]":
+                    if depth == 0:
+                        errors.append((*_location(text, pos), "unmatched ']'"))
+                        row_ok = False
+                    else:
+                        depth -= 1
+                        opened.pop()
+                elif token == '"':
+                    errors.append((*_location(text, pos), "unterminated string"))
+                    row_ok = False
+                elif depth == 0 and token in ",\n":
+                    break
+                pos = match.end()
+            if depth:
+                errors.append((*_location(text, opened[-1]), "'[' is never closed"))
+                return
+            row.append(_Field(text[start:pos], start))
+        # End of a field: either another field follows, or the row ends
+        if pos < end and text[pos] == ",":
+            pos += 1
+            continue
+        if row_ok and (len(row) > 1 or row[0].text.strip()):
+            yield row
+        row, row_ok = [], True
+        pos += 1
 
 def parse_state_machine(csv_path: str) -> Dict[str, List[State]]:
-    states = {}
     with open(csv_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            if not line.strip():
-                continue
-            row = parse_csv_line(line.strip())
-            state_name = row[0]
-            prev_state = row[1] if row[1] != "null" else None
-            condition = row[2] if row[2] != "null" else None
-            try:
-                questions = json.loads(row[3])
-                variables = json.loads(row[4])
-                actions = json.loads(row[5])
-                pFields = json.loads(row[6])
-                variable_actions = json.loads(row[7])
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON in row: {row}\n{str(e)}")
-                continue
-            next_state = row[8] if row[8] != "null" else None
-            state = State(
-                name=state_name,
-                previous_state=prev_state,
-                condition=condition,
-                questions=questions,
-                variables=variables,
-                promptActions=actions,
-                promptFields=pFields,
-                variableActions=variable_actions,
-                next_state=next_state
-            )
-            if state_name not in states:
-                states[state_name] = []
-            states[state_name].append(state)
-    return states
+        text = file.read()
 
-def replace_markers(text: str, user_data: Dict[str, str]) -> str:
-    with open("prompts_with_json.json", 'r', encoding='utf-8') as file:
-        json_data = json.load(file)
+    states = {}
+    errors = []
+    for row in split_csv_rows(text, errors):
+        if len(row) != STATE_MACHINE_COLUMNS:
+            errors.append((*_location(text, row[0].offset),
+                           f"expected {STATE_MACHINE_COLUMNS} columns, found {len(row)}"))
+            continue
+        values = [field.text if field.quoted else field.text.strip() for field in row]
+        try:
+            for column in _JSON_COLUMNS:
+                values[column] = json.loads(values[column])
+        except json.JSONDecodeError as e:
+            field = row[column]
+            offset = field.offset + e.pos + (len(field.text) - len(field.text.lstrip()) if not field.quoted else 0)
+            errors.append((*_location(text, offset), f"invalid JSON in column {column + 1}: {e.msg}"))
+            continue
 
-    def replace_match(match):
-        var_name = match.group(1)
-        value = user_data.get(var_name, f"UNKNOWN_{var_name}")
-        return json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else str(value)
+        state_name = values[0]
+        actions = values[5]
+        state = State(
+            name=state_name,
+            previous_state=values[1] if values[1] != "null" else None,
+            condition=values[2] if values[2] != "null" else None,
+            questions=values[3],
+            variables=values[4],
+            promptActions=actions,
+            promptFields=values[6],
+            variableActions=values[7],
+            next_state=values[8] if values[8] != "null" else None
+        )
+        for action in actions:
+            compile_prompt(action)
+        states.setdefault(state_name, []).append(state)
+
+    if errors:
+        raise StateMachineError(csv_path, errors)
+    return states
 
-    def replace_json_match(match):
-        var_name = match.group(1)
-        value = user_data.get(var_name, json_data.get(var_name, f"UNKNOWN_JSON_{var_name}"))
-        return json.dumps(value, ensure_ascii=False)
+@dataclass(frozen=True)
+class Predicate:
+    """A pre-parsed state condition: `var` is true when var is yes/true/1, `!var` when it is no/false/0/empty."""
+    variable: Optional[str] = None
+    negated: bool = False
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def parse(condition: Optional[str]) -> "Predicate":
+        if not condition:
+            return Predicate()
+        return Predicate(condition.lstrip("!"), condition.startswith("!"))
+
+    def __call__(self, user_data: Dict[str, str]) -> bool:
+        if self.variable is None:
+            return True
+        value = user_data.get(self.variable)
+        value = "" if value is None else str(value).strip().lower()
+        return value in ("no", "false", "0", "") if self.negated else value in ("yes", "true", "1")
+
+class StateGraph:
+    """The state machine with conditions pre-parsed and transitions indexed by state name."""
+
+    def __init__(self, states: Dict[str, List[State]], start_state: str = "q1"):
+        self.states = states
+        self.start_state = start_state
+        self.transitions = {
+            name: tuple((Predicate.parse(s.condition), s) for s in variants)
+            for name, variants in states.items()
+        }
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.transitions
+
+    def get(self, name: str, default=None) -> List[State]:
+        return self.states.get(name, default)
+
+    def resolve(self, name: Optional[str], user_data: Dict[str, str]) -> Optional[State]:
+        """Return the first variant of state `name` whose condition holds, or None."""
+        for predicate, state in self.transitions.get(name, ()):
+            if predicate(user_data):
+                return state
+        return None
+
+    def validate(self) -> List[str]:
+        """List dangling next/previous state references and states unreachable from the start."""
+        issues = []
+        for name, variants in self.states.items():
+            for state in variants:
+                if state.next_state and state.next_state not in self.states:
+                    issues.append(f"State '{name}' goes to unknown state '{state.next_state}'")
+                if state.previous_state and state.previous_state not in self.states:
+                    issues.append(f"State '{name}' comes from unknown state '{state.previous_state}'")
+        reachable = set()
+        frontier = [self.start_state] if self.start_state in self.states else []
+        while frontier:
+            name = frontier.pop()
+            if name in reachable:
+                continue
+            reachable.add(name)
+            frontier.extend(s.next_state for s in self.states[name] if s.next_state in self.states)
+        issues.extend(f"State '{name}' is unreachable from '{self.start_state}'"
+                      for name in self.states if name not in reachable)
+        return issues
+
+    def to_dict(self) -> dict:
+        return {
+            "start_state": self.start_state,
+            "states": {name: [asdict(s) for s in variants] for name, variants in self.states.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StateGraph":
+        states = {name: [State(**s) for s in variants] for name, variants in data["states"].items()}
+        for variants in states.values():
+            for state in variants:
+                for action in state.promptActions:
+                    compile_prompt(action)
+        return cls(states, data["start_state"])
+
+def compile_state_machine(csv_path: str, cache_path: Optional[str] = None) -> StateGraph:
+    """Load the state machine as a StateGraph, reusing the compiled JSON artefact when the CSV is unchanged."""
+    cache_path = cache_path or os.path.splitext(csv_path)[0] + ".compiled.json"
+    with open(csv_path, 'rb') as file:
+        source_hash = hashlib.sha256(file.read()).hexdigest()
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+        if cached.get("source_sha256") == source_hash:
+            return StateGraph.from_dict(cached["graph"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    graph = StateGraph(parse_state_machine(csv_path))
+    for issue in graph.validate():
+        print(f"Warning: {issue}")
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as file:
+            json.dump({"source_sha256": source_hash, "graph": graph.to_dict()}, file, ensure_ascii=False)
+    except OSError as e:
+        print(f"Could not write compiled state machine to {cache_path}: {str(e)}")
+    return graph
+
+TEMPLATE_RELOAD_INTERVAL = 2.0
+
+_JSON_MARKER = re.compile(r"@(\w+)")
+_VAR_MARKER = re.compile(r"\^(\w+)")
+
+def _compile_var_markers(text: str) -> List:
+    parts = []
+    pos = 0
+    for match in _VAR_MARKER.finditer(text):
+        if match.start() > pos:
+            parts.append(text[pos:match.start()])
+        parts.append(("^", match.group(1)))
+        pos = match.end()
+    if pos < len(text):
+        parts.append(text[pos:])
+    return parts
 
-    text = re.sub(r"@(\w+)", replace_json_match, text)
-    text = re.sub(r"\^(\w+)", replace_match, text)
+@functools.lru_cache(maxsize=4096)
+def compile_prompt(text: str) -> tuple:
+    """Split a prompt into literal strings and ("@" | "^", name) marker parts, once per prompt."""
+    parts = []
+    pos = 0
+    for match in _JSON_MARKER.finditer(text):
+        parts.extend(_compile_var_markers(text[pos:match.start()]))
+        parts.append(("@", match.group(1)))
+        pos = match.end()
+    parts.extend(_compile_var_markers(text[pos:]))
+    return tuple(parts)
+
+class TemplateRegistry:
+    """The @templates from prompts_with_json.json, pre-serialised and reloaded when the file changes."""
+
+    def __init__(self, path: str = records.PROMPT_TEMPLATES_PATH, reload_interval: float = TEMPLATE_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._plans = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[tuple]:
+        """Return the compiled json.dumps form of template `name`, or None if there is none."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._refresh(now)
+        return self._plans.get(name)
+
+    def _refresh(self, now: float):
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    json_data = json.load(file)
+            except (OSError, ValueError) as e:
+                # Most likely read mid-write; keep the last good templates and try again on the next check
+                print(f"Could not reload prompt templates from {self.path}: {str(e)}")
+                return
+            # Templates may themselves contain ^markers (e.g. "^budget"), filled at render time
+            self._plans = {
+                name: tuple(_compile_var_markers(json.dumps(value, ensure_ascii=False)))
+                for name, value in json_data.items()
+            }
+            self._mtime = mtime
+
+template_registry = TemplateRegistry()
+
+def _render_var(name: str, user_data: Dict[str, str]) -> str:
+    value = user_data.get(name, f"UNKNOWN_{name}")
+    if isinstance(value, (dict, records.Record)):
+        return json.dumps(value, ensure_ascii=False, default=records.to_jsonable)
+    return str(value)
+
+def _render_parts(parts, user_data: Dict[str, str]) -> str:
+    out = []
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+        elif part[0] == "^":
+            out.append(_render_var(part[1], user_data))
+        elif part[1] in user_data:
+            # Values supplied for an @marker also get their ^markers filled
+            out.append(_render_parts(_compile_var_markers(json.dumps(user_data[part[1]], ensure_ascii=False,
+                                                                   default=records.to_jsonable)), user_data))
+        else:
+            template = template_registry.get(part[1])
+            if template is None:
+                out.append(json.dumps(f"UNKNOWN_JSON_{part[1]}", ensure_ascii=False))
+            else:
+                out.append(_render_parts(template, user_data))
+    return "".join(out)
 
-    return text
+def replace_markers(text: str, user_data: Dict[str, str]) -> str:
+    with metrics.stage("replace_markers"):
+        return _render_parts(compile_prompt(text), user_data)
 
 def evaluate_condition(condition: Optional[str], user_data: Dict[str, str]) -> bool:
-    if not condition:
-        return True
-
-    value = user_data.get(condition.lstrip("!"), "").strip().lower()
-    return value in ["yes", "true", "1"] if not condition.startswith("!") else value in ["no", "false", "0", "", None]
+    return Predicate.parse(condition)(user_data)
 
 def clean_response(raw_response: str) -> str:
     cleaned = re.sub(r"<think>.*?</think>", "", raw_response, flags=re.DOTALL)
     cleaned = re.sub(r"(?i)(---json|```json|```)", "", cleaned).strip()
     return cleaned
 
-def run_prompt_actions(state, user_data):
-    from groq import Groq
-    load_dotenv()
-    api_key = os.getenv("GROQ_API_KEY")
-    client = Groq(api_key=api_key)
-
+_FENCE = re.compile(r"(?i)(---json|```json|```)")
+# Leading whitespace and code fences, possibly ending in a fence cut off mid-chunk
+_FENCE_LEAD = re.compile(r"(?i)\s*(?:(?:---json|```(?:json)?)\s*)*(?:-{1,3}j?s?o?n?|`{1,3}j?s?o?n?)?")
+_JSON_SYNTAX = re.compile(r'[{}"\\]')
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+class StreamAssembler:
+    """Collects streamed completion chunks, dropping <think> blocks as they arrive.
+
+    If the visible output starts with a JSON object (optionally after a code
+    fence), the assembler tracks its braces and sets `closed` once the
+    top-level object ends, so the caller can stop reading the stream.
+    text() gives the same result as clean_response on the full output.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._visible = []
+        self._thinking = []
+        self._in_think = False
+        self._pending = ""
+        self._prefix = ""
+        self._json = None  # None: undecided, False: not JSON, list: JSON parts
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str):
+        if self.closed or not chunk:
+            return
+        text = self._pending + chunk
+        self._pending = ""
+        while text:
+            tag = _THINK_CLOSE if self._in_think else _THINK_OPEN
+            idx = text.find(tag)
+            if idx == -1:
+                # Hold back a possible partial tag at the end of the chunk
+                keep = next((n for n in range(min(len(tag) - 1, len(text)), 0, -1) if tag.startswith(text[-n:])), 0)
+                self._pending = text[len(text) - keep:]
+                self._emit(text[:len(text) - keep])
+                return
+            self._emit(text[:idx])
+            self._in_think = not self._in_think
+            if self._in_think:
+                self._thinking = []
+            text = text[idx + len(tag):]
+
+    def text(self) -> str:
+        if self.closed:
+            return "".join(self._json)
+        visible = "".join(self._visible)
+        if self._in_think:
+            # An unterminated <think> block is left in place, as clean_response does
+            visible += _THINK_OPEN + "".join(self._thinking)
+        visible += self._pending
+        return _FENCE.sub("", visible).strip()
+
+    def _emit(self, text: str):
+        if not text or self.closed:
+            return
+        if self._in_think:
+            self._thinking.append(text)
+            return
+        self._visible.append(text)
+        if self._json is None:
+            idx = text.find("{")
+            lead = self._prefix + (text if idx == -1 else text[:idx])
+            if idx == -1 and _FENCE_LEAD.fullmatch(lead):
+                self._prefix = lead
+            elif idx != -1 and not _FENCE.sub("", lead).strip():
+                self._json = []
+                self._scan_json(text[idx:])
+            else:
+                self._json = False
+        elif self._json:
+            self._scan_json(text)
+
+    def _scan_json(self, text: str):
+        pos = 1 if self._escaped else 0
+        self._escaped = False
+        while True:
+            match = _JSON_SYNTAX.search(text, pos)
+            if match is None:
+                break
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == "\\":
+                    # Skip the escaped character, which may start the next chunk
+                    self._escaped = pos == len(text)
+                    pos += 1
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._json.append(text[:pos])
+                    self.closed = True
+                    return
+        self._json.append(text)
+
+PROMPT_CONCURRENCY = int(os.getenv("PROMPT_CONCURRENCY", "4"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+
+# Bounded pool the async API offloads blocking Groq chains to, so a burst of
+# sessions queues here instead of spawning unbounded threads.
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+def prompt_references(text: str) -> set:
+    """Return the variable names a prompt reads through ^var and @var markers."""
+    return set(re.findall(r"\^(\w+)", text)) | set(re.findall(r"@(\w+)", text))
+
+def build_prompt_dependencies(state) -> Dict[int, set]:
+    """Map each prompt index to the indices of earlier prompts whose field it reads.
+
+    Only earlier prompts count, so a prompt still sees exactly the outputs it
+    would have seen when the prompts ran one after another.
+    """
+    dependencies = {}
     for i, action in enumerate(state.promptActions):
-        prompt = replace_markers(action, user_data)
-        field_name = state.promptFields[i] if i < len(state.promptFields) else None
-
-        if not field_name:
-            continue
-
-        messages = [
-            {"role": "system", "content": "You are a concise assistant..."},
-            {"role": "user", "content": prompt}
-        ]
-
-        response_text = ""
+        refs = prompt_references(action)
+        dependencies[i] = {
+            j for j, field in enumerate(state.promptFields[:i])
+            if field in refs
+        }
+    return dependencies
+
+def prompt_inputs(state, user_data) -> set:
+    """Return the variables a state's prompts read from user_data, leaving out fields its own earlier prompts fill.
+
+    An @marker with no value in user_data renders the template of that name,
+    so the ^markers inside the template are read instead.
+    """
+    inputs = set()
+    for i, action in enumerate(state.promptActions):
+        filled = set(state.promptFields[:i])
+        for part in compile_prompt(action):
+            if isinstance(part, str) or part[1] in filled:
+                continue
+            if part[0] == "@" and part[1] not in user_data:
+                template = template_registry.get(part[1])
+                if template is not None:
+                    inputs.update(p[1] for p in template if not isinstance(p, str))
+                    continue
+            inputs.add(part[1])
+    return inputs
+
+def upcoming_prompt_states(states: StateGraph, name: Optional[str], user_data) -> List[tuple]:
+    """List the states from `name` on whose prompts could run now, as (state, {input: value}) pairs.
+
+    Walks the path the answers so far lead down, applying variableActions on
+    the way. Variables a state on the way still asks for, and fields its
+    prompts fill, aren't known yet; the walk stops at a condition on one.
+    """
+    data = dict(user_data)
+    unknown = set()
+    ready = []
+    visited = set()
+    while name and name not in visited:
+        visited.add(name)
+        if any(predicate.variable in unknown for predicate, _ in states.transitions.get(name, ())):
+            break
+        state = states.resolve(name, data)
+        if state is None:
+            break
+        for action in state.variableActions:
+            var, value = action.split("=")
+            data[var] = None if value == "null" else value
+            unknown.discard(var)
+        unknown.update(state.variables)
+        if state.promptActions:
+            inputs = prompt_inputs(state, data)
+            if not inputs & unknown and all(input_name in data for input_name in inputs):
+                ready.append((state, {input_name: data[input_name] for input_name in inputs}))
+            unknown.update(state.promptFields)
+        name = state.next_state
+    return ready
+
+# Retries of a failed or malformed completion, bounded per field by attempts and wall time
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+FIELD_TIME_BUDGET = float(os.getenv("FIELD_TIME_BUDGET", "120"))
+REPAIR_INSTRUCTION = ("Your previous answer could not be used ({errors}). "
+                      "Reply with only the corrected JSON, with no text before or after it.")
+
+class BudgetExceeded(TimeoutError):
+    """A field ran out of its FIELD_TIME_BUDGET before getting a usable answer."""
+
+class Cancelled(Exception):
+    """The caller gave up on the prompt batch, so its streams are abandoned."""
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and dropped connections are worth another attempt."""
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (groq.APIConnectionError, httpx.TransportError))
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Exponential backoff with full jitter; the provider's Retry-After wins when it sends one."""
+    response = getattr(error, "response", None)
+    if response is not None:
         try:
-            completion = client.chat.completions.create(
-                model="deepseek-r1-distill-llama-70b",
-                messages=messages,
-                temperature=0.6,
-                max_completion_tokens=4096,
-                top_p=0.95,
-                stream=True,
-            )
-            for chunk in completion:
-                content = chunk.choices[0].delta.content or ""
-                response_text += content
-
-            cleaned_response = clean_response(response_text)
-            try:
-                user_data[field_name] = json.loads(cleaned_response)
-            except json.JSONDecodeError:
-                user_data[field_name] = cleaned_response
-
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def _prompt_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": "You are a concise assistant..."},
+        {"role": "user", "content": prompt}
+    ]
+
+def prompt_cache_key(prompt: str, route: model_router.Route = model_router.DEFAULT_ROUTE) -> str:
+    return llm_cache.cache_key(_prompt_messages(prompt), route.model, route.temperature, route.top_p,
+                               route.max_completion_tokens, route.reasoning_format)
+
+@contextlib.contextmanager
+def _stream_slot(cancel_event: Optional[threading.Event]):
+    if not llm_client.client_manager.acquire_stream(cancel_event):
+        raise Cancelled("request cancelled")
+    try:
+        yield
+    finally:
+        llm_client.client_manager.release_stream()
+
+def run_prompt(client, prompt: str, use_cache: bool = True, accept=None, deadline: Optional[float] = None,
+               on_token=None, cancel_event: Optional[threading.Event] = None,
+               route: model_router.Route = model_router.DEFAULT_ROUTE, timings: Optional[dict] = None,
+               limiter=None) -> str:
+    """Stream one completion and return it cleaned of <think> blocks and code fences.
+
+    If accept is given, only responses for which accept(text) is true are
+    cached, so a malformed answer is asked for again next time. deadline is a
+    time.monotonic() value past which the stream is abandoned. on_token is
+    called for every streamed chunk, and setting cancel_event closes the
+    stream with Cancelled. route gives the model and sampling settings. If
+    timings is given, the seconds to the first token and to the end of the
+    stream are stored in it as "first_token" and "stream".
+
+    Every completion first waits for room under its model's request and token
+    rate limits, then for a free connection to the provider, so a prompt held
+    back by its own model's limits doesn't keep a connection from prompts for
+    other models. limiter, if given, is an object whose slot() context manager
+    is held for the completion as well, such as the shared limiter of batch
+    runs. Seconds spent waiting for any of these are stored as "queued", and
+    the caller's deadline doesn't cover them.
+    """
+    messages = _prompt_messages(prompt)
+
+    cache = llm_cache.get_response_cache() if use_cache else None
+    if cache is not None:
+        key = prompt_cache_key(prompt, route)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    queued_at = time.monotonic()
+    permit = rate_limiter.limiter.acquire(route.model, rate_limiter.estimate_prompt_tokens(messages),
+                                          route.max_completion_tokens, cancel_event)
+    if permit is None:
+        raise Cancelled("request cancelled")
+    streaming = False
+    try:
+        with limiter.slot() if limiter is not None else contextlib.nullcontext(), _stream_slot(cancel_event):
+            streaming = True
+            queued = time.monotonic() - queued_at
+            if timings is not None:
+                timings["queued"] = queued
+            if deadline is not None:
+                deadline += queued
+            response_text = _stream_completion(client, messages, route, deadline, on_token, cancel_event, timings,
+                                               permit)
+    except Exception as e:
+        if streaming:
+            permit.failed(e)
+        else:
+            # Never sent, so the request and tokens it reserved go back to the model's buckets
+            permit.cancel()
+        raise
+
+    if cache is not None and response_text and (accept is None or accept(response_text)):
+        cache.put(key, response_text)
+    return response_text
+
+def _stream_completion(client, messages: list, route: model_router.Route, deadline: Optional[float], on_token,
+                       cancel_event: Optional[threading.Event], timings: Optional[dict],
+                       permit: rate_limiter.Permit) -> str:
+    started = time.perf_counter()
+    options = {}
+    if route.reasoning_format is not None:
+        options["reasoning_format"] = route.reasoning_format
+    if deadline is not None:
+        options["timeout"] = max(deadline - time.monotonic(), 1.0)
+    completion = client.chat.completions.create(
+        model=route.model,
+        messages=messages,
+        temperature=route.temperature,
+        max_completion_tokens=route.max_completion_tokens,
+        top_p=route.top_p,
+        stream=True,
+        **options,
+    )
+    assembler = StreamAssembler()
+    total_tokens = None
+    streamed_tokens = 0
+    try:
+        for chunk in completion:
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and x_groq.usage is not None:
+                total_tokens = x_groq.usage.total_tokens
+            content = chunk.choices[0].delta.content or ""
+            streamed_tokens += 1
+            if content and timings is not None and "first_token" not in timings:
+                timings["first_token"] = time.perf_counter() - started
+            assembler.feed(content)
+            if on_token:
+                on_token()
+            if cancel_event is not None and cancel_event.is_set():
+                raise Cancelled("request cancelled")
+            if assembler.closed:
+                # The JSON answer is complete; stop paying for trailing tokens
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise BudgetExceeded(f"no complete answer within {FIELD_TIME_BUDGET:g}s")
+    finally:
+        completion.close()
+        if timings is not None:
+            timings["stream"] = time.perf_counter() - started
+    response = getattr(completion, "response", None)
+    permit.observe(getattr(response, "headers", None), total_tokens, streamed_tokens)
+
+    with metrics.stage("clean_response"):
+        return assembler.text()
+
+def _run_prompt_action(client, state, index, user_data, on_event=None, use_cache=True,
+                       cancel_event: Optional[threading.Event] = None, limiter=None) -> List[str]:
+    """Run one prompt and store its parsed answer; returns the errors of the last attempt.
+
+    Transient provider errors are retried with backoff. An answer that fails to
+    parse, even after the repair pass, is asked for again with the errors
+    appended to the prompt. All attempts share the field's FIELD_TIME_BUDGET.
+    """
+    field_name = state.promptFields[index]
+    prompt = replace_markers(state.promptActions[index], user_data)
+    route = model_router.route(field_name, prompt)
+    if on_event:
+        on_event("field_started", field_name, {"model": route.model})
+    parsed = {}
+    tokens = 0
+
+    def on_token():
+        nonlocal tokens
+        tokens += 1
+        if on_event:
+            on_event("tokens", field_name, {"tokens": tokens})
+
+    def parse(text):
+        with metrics.stage("parse_response"):
+            return records.parse_response(field_name, text)
+
+    def accept(text):
+        parsed[text] = parse(text)
+        return not parsed[text][1]
+
+    deadline = time.monotonic() + FIELD_TIME_BUDGET
+    attempt_prompt = prompt
+    errors = []
+    status = "ok"
+    first_token = None
+    stream_seconds = None
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        timings = {}
+        try:
+            cleaned_response = run_prompt(client, attempt_prompt, use_cache, accept, deadline,
+                                          on_token, cancel_event, route, timings, limiter)
+        except Cancelled as e:
+            errors, status = [str(e)], "cancelled"
+            break
         except Exception as e:
             print(f"Error during completion: {str(e)}")
-
-def run_state_machine(states):
-    load_dotenv()
-    api_key = os.getenv("GROQ_API_KEY")
-    client = Groq(api_key=api_key)
-
+            errors, status = [str(e)], "failed"
+            if not is_retryable(e):
+                break
+            delay = backoff_delay(attempt, e)
+            if time.monotonic() + delay >= deadline:
+                break
+            if cancel_event is not None:
+                if cancel_event.wait(delay):
+                    break
+            else:
+                time.sleep(delay)
+            continue
+        finally:
+            deadline += timings.get("queued", 0.0)
+            if "stream" in timings:
+                stream_seconds = (stream_seconds or 0.0) + timings["stream"]
+                if first_token is None:
+                    first_token = timings.get("first_token")
+
+        value, errors = parsed.get(cleaned_response) or parse(cleaned_response)
+        user_data[field_name] = value
+        status = "invalid" if errors else "ok"
+        if not errors:
+            if attempt_prompt is not prompt and use_cache and llm_cache.get_response_cache() is not None:
+                # Answer the original prompt from the cache next time
+                llm_cache.get_response_cache().put(prompt_cache_key(prompt, route), cleaned_response)
+            break
+        print(f"Invalid {field_name}: {'; '.join(errors)}")
+        if time.monotonic() >= deadline or (cancel_event is not None and cancel_event.is_set()):
+            break
+        attempt_prompt = f"{prompt}\n\n" + REPAIR_INSTRUCTION.format(errors="; ".join(errors))
+    metrics.record_field(field_name, route.model, status, tokens, first_token, stream_seconds)
+    if on_event:
+        on_event("field_done", field_name, {"status": status, "errors": errors})
+    return errors
+
+def run_prompt_actions(state, user_data, max_concurrency: int = PROMPT_CONCURRENCY, on_event=None,
+                       use_cache: bool = True, cancel_event: Optional[threading.Event] = None,
+                       limiter=None) -> Dict[str, List[str]]:
+    """Run a state's prompts, executing prompts that don't read each other's fields concurrently.
+
+    on_event, if given, is called from worker threads as on_event(event, field_name, detail)
+    with event "field_started" (detail["model"] is the routed model), "tokens"
+    (detail["tokens"] chunks received so far) or "field_done" (detail["status"]
+    is ok, invalid, failed or cancelled). Once
+    cancel_event is set, running streams are closed and prompts not yet started
+    are skipped. limiter is passed on to run_prompt. Returns the errors of
+    every field whose answer failed, didn't match its schema or was cancelled.
+    """
+    dependencies = build_prompt_dependencies(state)
+    pending = {}
+    for i, action in enumerate(state.promptActions):
+        if i < len(state.promptFields) and state.promptFields[i]:
+            pending[i] = dependencies[i]
+        else:
+            print(f"Warning: No promptField defined for action '{action}', skipping.")
+    if not pending:
+        return {}
+
+    client = llm_client.get_client()
+
+    done = set()
+    field_errors = {}
+    with metrics.stage("prompt_actions"), ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        running = {}
+        while pending or running:
+            if cancel_event is not None and cancel_event.is_set():
+                for i in pending:
+                    field_errors[state.promptFields[i]] = ["request cancelled"]
+                pending.clear()
+                if not running:
+                    break
+            for i in [i for i, deps in pending.items() if deps <= done]:
+                del pending[i]
+                running[executor.submit(metrics.in_context(_run_prompt_action), client, state, i, user_data,
+                                        on_event, use_cache, cancel_event, limiter)] = i
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                done.add(i)
+                if future.result():
+                    field_errors[state.promptFields[i]] = future.result()
+    return field_errors
+
+async def run_prompt_actions_async(state, user_data, max_concurrency: int = PROMPT_CONCURRENCY, on_event=None,
+                                   use_cache: bool = True, cancel_event: Optional[threading.Event] = None):
+    """Awaitable run_prompt_actions that keeps the event loop free while completions stream."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _llm_executor,
+        metrics.in_context(functools.partial(run_prompt_actions, state, user_data, max_concurrency, on_event,
+                                             use_cache, cancel_event))
+    )
+
+def run_state_machine(states: StateGraph):
     user_data = {}
     current_state = "q1"
     completed_states = set()
 
     while current_state:
-        state_options = states.get(current_state, [])
-        if not state_options:
+        if current_state not in states:
             print(f"State '{current_state}' not found.")
             break
 
-        valid_states = [s for s in state_options if evaluate_condition(s.condition, user_data)]
-        if not valid_states:
+        selected_state = states.resolve(current_state, user_data)
+        if selected_state is None:
             print(f"No valid state transitions found for state '{current_state}'")
             break
 
-        selected_state = valid_states[0]
-
         for action in selected_state.variableActions:
             var, value = action.split("=")
             user_data[var] = None if value == "null" else value
@@ -175,42 +881,7 @@ def run_state_machine(states):
             user_input = input(f"{question}: ")
             user_data[variable] = user_input
 
-        for i, action in enumerate(selected_state.promptActions):
-            action = replace_markers(action, user_data)
-            if i < len(selected_state.promptFields):
-                field_name = selected_state.promptFields[i]
-            else:
-                print(f"Warning: No promptField defined for action '{action}', skipping.")
-                continue
-
-            messages = [
-                {"role": "system", "content": "You are a concise assistant..."},
-                {"role": "user", "content": action}
-            ]
-
-            response_text = ""
-            try:
-                completion = client.chat.completions.create(
-                    model="deepseek-r1-distill-llama-70b",
-                    messages=messages,
-                    temperature=0.6,
-                    max_completion_tokens=4096,
-                    top_p=0.95,
-                    stream=True,
-                    stop=None,
-                )
-                for chunk in completion:
-                    content = chunk.choices[0].delta.content or ""
-                    response_text += content
-
-                cleaned_response = clean_response(response_text)
-                try:
-                    user_data[field_name] = json.loads(cleaned_response)
-                except json.JSONDecodeError:
-                    user_data[field_name] = cleaned_response
-
-            except Exception as e:
-                print(f"Error during completion: {str(e)}")
+        run_prompt_actions(selected_state, user_data)
 
         completed_states.add(current_state)
         current_state = selected_state.next_state
@@ -219,7 +890,7 @@ def run_state_machine(states):
     file_name = input("Enter filename for the document (without extension): ").strip() or "PC1_Wizard_Output"
 
     with open(f"{file_name}.json", "w", encoding="utf-8") as f:
-        json.dump(user_data, f, ensure_ascii=False, indent=4)
+        json.dump(user_data, f, ensure_ascii=False, indent=4, default=records.to_jsonable)
     print(f"JSON saved as {file_name}.json")
 
     sample2.create_project_document_from_json(user_data, f"{file_name}.docx")
@@ -231,7 +902,7 @@ def main():
     if not os.path.exists(csv_path):
         print("State machine CSV file not found!")
         return
-    states = parse_state_machine(csv_path)
+    states = compile_state_machine(csv_path)
     run_state_machine(states)
 
 if __name__ == "__main__":